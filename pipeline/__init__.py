@@ -0,0 +1,37 @@
+"""Helper code used by the notebooks in "Surfing the Data Pipeline with Python"
+
+The chapters build everything step by step inside the notebooks. The modules in
+this folder collect the longer-running versions of that code so that a notebook
+can import them from the root of the book:
+
+    from pipeline.tweets import collect_tweets
+
+* `tweets`: a resumable, checkpointed tweet collector (chapters 4 and 9)
+* `cassette`: record and replay API responses so chapters 3-5 build offline
+* `completions`: send a file of ChatGPT prompts concurrently (ChatGPT appendix)
+* `ratelimit`: a token bucket for staying under an API's rate limit
+* `mockserver`: local stand-ins for the APIs, for testing and timing
+* `challenge`: a fast webhook endpoint for sha256 verification challenges
+* `timing`: latency percentiles for the benchmarks
+* `apibench`: time the chapter 4 API request patterns against mock servers
+* `wnrn`: the WNRN playlist spider from chapter 5
+* `crawler`: download and parse many playlist pages at once (chapter 5)
+* `extract`: pull several fields out of an HTML page in one pass with lxml
+* `spider`: spiders defined by a JSON spec, like `spiders/wnrn.json`
+* `accumulate`: build one data frame from many pieces with a single concat
+* `crawlcache`: skip playlist pages that have not changed since the last crawl
+* `frontier`: follow links through a station's whole archive without revisits
+* `politeness`: obey robots.txt and pace each website separately
+* `profiler`: time the fetch, parse, and build stages of a scraper
+* `bulkload`: load the chapter 6 tables with each database's bulk path
+* `arrowsql`: read query results into Arrow columns instead of tuples
+* `sqlstream`: read a large query in chunks and aggregate it as it arrives
+* `databases`: shared, pooled engines for the chapter 6 and 7 databases
+* `mongoload`: insert a data frame into MongoDB in parallel BSON batches
+* `mongoread`: read MongoDB queries into a data frame without the JSON round trip
+* `indexadvisor`: propose and create the indexes and keys a query workload needs
+* `normalize`: split a flat data frame into normalized tables with primary and foreign keys
+* `embedded`: run the chapter 7 SQL in process with DuckDB over data frames and Parquet files
+* `querycache`: cache query results by normalized SQL and table version
+* `pushdown`: build pandas wrangling chains on database tables and run each as one SQL query
+"""
@@ -0,0 +1,179 @@
+"""Build one data frame from many pieces without copying it over and over
+
+A loop that grows a data frame one page at a time,
+
+    for w in wnrn_url:
+        moredata = wnrn_spider('https://spinitron.com/' + w)
+        wnrn_total_playlist = pd.concat([wnrn_total_playlist, moredata], ignore_index=True)
+
+copies every row collected so far each time it goes around, so doubling the
+number of pages makes the loop about four times slower. (The old `df.append()`
+method did the same thing.) Chapter 5 avoids this by collecting the pages in a
+list and calling `pd.concat()` once. A `FrameAccumulator` keeps the pieces,
+or the values of each column in plain lists, and builds the data frame once at
+the end:
+
+    playlist = FrameAccumulator()
+    for w in wnrn_url:
+        playlist.add_frame(wnrn_spider('https://spinitron.com/' + w))
+    wnrn_total_playlist = playlist.to_frame()
+
+For a crawl too long to keep in memory, give it a `spill_dir`: every `spill_rows`
+rows are written to a Parquet file in that folder, and `iter_frames()` reads them
+back one at a time. `benchmark()` compares the two approaches.
+"""
+
+import os
+import time
+import uuid
+
+import pandas as pd
+
+
+class FrameAccumulator:
+    """Collect rows, dictionaries of columns, or data frames, and combine them once"""
+
+    def __init__(self, columns=None, spill_dir=None, spill_rows=500000):
+        self.buffer = {name: [] for name in columns or []}
+        self.buffered = 0
+        self.frames = []
+        self.framed = 0
+        self.parts = []
+        self.rows = 0
+        self.spill_dir = spill_dir
+        self.spill_rows = spill_rows
+
+    def __len__(self):
+        return self.rows
+
+    def _column(self, name):
+        # A column seen for the first time is missing for all the earlier rows
+        if name not in self.buffer:
+            self.buffer[name] = [None] * self.buffered
+        return self.buffer[name]
+
+    def add_row(self, row):
+        """Add one row, given as a dictionary of column names and values"""
+        for name in row:
+            self._column(name)
+        for name, values in self.buffer.items():
+            values.append(row.get(name))
+        self._added(1)
+
+    def add_rows(self, columns):
+        """Add rows given as a dictionary of equal-length lists, like `mydict` in chapter 5"""
+        lengths = {len(v) for v in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("columns have different lengths: {}".format(
+                {k: len(v) for k, v in columns.items()}))
+        n = lengths.pop() if lengths else 0
+        for name in columns:
+            self._column(name)
+        for name, values in self.buffer.items():
+            values.extend(columns[name] if name in columns else [None] * n)
+        self._added(n)
+
+    def add_frame(self, df):
+        """Add a data frame as it is; it is not copied until `to_frame()`"""
+        self._flush_buffer()
+        self.frames.append(df)
+        self.framed += len(df)
+        self._added(0, len(df))
+
+    def _added(self, buffered, framed=0):
+        self.buffered += buffered
+        self.rows += buffered + framed
+        if self.spill_dir and self.buffered + self.framed >= self.spill_rows:
+            self.spill()
+
+    def _flush_buffer(self):
+        if self.buffered:
+            self.frames.append(pd.DataFrame(self.buffer))
+            self.framed += self.buffered
+        self.buffer = {name: [] for name in self.buffer}
+        self.buffered = 0
+
+    def spill(self):
+        """Write the rows held in memory to a Parquet file in `spill_dir`"""
+        self._flush_buffer()
+        if not self.frames:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, 'part-{:05d}-{}.parquet'.format(
+            len(self.parts), uuid.uuid4().hex[:8]))
+        pd.concat(self.frames, ignore_index=True).to_parquet(path, index=False)
+        self.parts.append(path)
+        self.frames = []
+        self.framed = 0
+
+    def iter_frames(self):
+        """Yield the collected rows piece by piece, reading spilled parts one at a time"""
+        for path in self.parts:
+            yield pd.read_parquet(path)
+        self._flush_buffer()
+        yield from self.frames
+
+    def to_frame(self):
+        """Combine everything collected so far into one data frame with one `pd.concat()`"""
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame({name: [] for name in self.buffer})
+        if len(frames) == 1:
+            return frames[0].reset_index(drop=True)
+        return pd.concat(frames, ignore_index=True)
+
+
+def _page(n, rows_per_page):
+    return pd.DataFrame({'time': ['12:00 PM'] * rows_per_page,
+                         'artist': ['Artist {}'.format(n)] * rows_per_page,
+                         'song': ['Song {}'.format(i) for i in range(rows_per_page)],
+                         'album': ['Album {}'.format(n)] * rows_per_page})
+
+
+def benchmark(pages=(100, 200, 400, 800, 1600), rows_per_page=25):
+    """Time concatenating inside the loop against a `FrameAccumulator`
+
+    The accumulator is timed twice: once adding data frames and once adding
+    dictionaries of lists, the way `parse_playlist()` returns a page. Returns a
+    data frame with the seconds each approach took and the seconds per page. The
+    accumulator's time per page stays about the same as the number of
+    pages grows; the loop's time per page grows with the number of pages.
+    """
+    results = []
+    for n in pages:
+        pieces = [_page(i, rows_per_page) for i in range(n)]
+        dicts = [piece.to_dict('list') for piece in pieces]
+
+        start = time.perf_counter()
+        total = pieces[0]
+        for piece in pieces[1:]:
+            total = pd.concat([total, piece], ignore_index=True)
+        loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        acc = FrameAccumulator()
+        for piece in pieces:
+            acc.add_frame(piece)
+        total = acc.to_frame()
+        once = time.perf_counter() - start
+
+        start = time.perf_counter()
+        acc = FrameAccumulator()
+        for columns in dicts:
+            acc.add_rows(columns)
+        acc.to_frame()
+        lists = time.perf_counter() - start
+
+        results.append({'pages': n,
+                         'rows': len(total),
+                         'concat_in_loop_s': round(loop, 4),
+                         'accumulator_frames_s': round(once, 4),
+                         'accumulator_lists_s': round(lists, 4),
+                         'concat_in_loop_per_page_ms': round(loop / n * 1000, 4),
+                         'accumulator_frames_per_page_ms': round(once / n * 1000, 4),
+                         'accumulator_lists_per_page_ms': round(lists / n * 1000, 4)})
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    print(benchmark().to_string(index=False))
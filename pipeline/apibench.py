@@ -0,0 +1,253 @@
+"""Time the chapter 4 ways of calling an API against local mock servers
+
+Chapter 4 sends one `requests.get()` at a time to Wikipedia, the Census, and
+Google Maps. That is the right way to learn an API, but it is not the only way to
+send a thousand requests. This module starts local stand-ins for those APIs
+(see `pipeline.mockserver`) with a chosen latency and error rate, and sends the
+same requests using different patterns:
+
+* `'sync'`: one `requests.get()` after another, opening a new connection each time,
+* `'pooled'`: a `requests.Session()` that reuses connections, shared by several threads,
+* `'async'`: an `aiohttp` session with many requests waiting at once,
+* `'rate_limited'`: the pooled pattern, held under a number of requests per second,
+* `'googlemaps'`: the `googlemaps.Client` from chapter 4, one geocode at a time,
+* `'cursor'`: the way `tweepy.Cursor` pages through search results, one page after another.
+
+Every pattern retries a request that fails with a 429 or 5xx error, and
+`run_benchmarks()` reports requests per second, the 50th, 95th, and 99th
+percentile latency, and the number of retries:
+
+    from pipeline.apibench import run_benchmarks
+    run_benchmarks(n=200, latency=0.02, error_rate=0.05)
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline.mockserver import (MockServer, census_route, geocode_route,
+                                 twitter_search_route, wikipedia_route)
+from pipeline.ratelimit import TokenBucket
+from pipeline.timing import latency_summary
+
+PATTERNS = ('sync', 'pooled', 'async', 'rate_limited', 'googlemaps', 'cursor')
+
+API_PATHS = {'wikipedia': '/w/api.php',
+             'census': '/data/2019/pep/charagegroups',
+             'geocode': '/maps/api/geocode/json',
+             'twitter': '/1.1/search/tweets.json'}
+
+API_ROUTES = {'wikipedia': wikipedia_route,
+              'census': census_route,
+              'geocode': geocode_route,
+              'twitter': twitter_search_route}
+
+
+def start_mock_apis(latency=0.02, error_rate=0.0, seed=0):
+    """Start one mock server per API and return them in a dictionary"""
+    return {name: MockServer({API_PATHS[name]: route}, latency=latency,
+                             error_rate=error_rate, seed=seed).start()
+            for name, route in API_ROUTES.items()}
+
+
+def api_calls(servers, n=100):
+    """Build `n` (url, params) pairs for each API, like the requests in chapter 4"""
+    # Chapter 4 loads the Census key from .env with dotenv; the mock accepts any key
+    census_key = os.getenv('CensusKey', 'mock-census-key')
+    calls = {}
+    calls['wikipedia'] = [(servers['wikipedia'].url + API_PATHS['wikipedia'],
+                           {'action': 'query', 'prop': 'revisions', 'titles': 'Page_{}'.format(i),
+                            'rvslots': '*', 'rvprop': 'content', 'formatversion': '2',
+                            'format': 'json'}) for i in range(n)]
+    calls['census'] = [(servers['census'].url + API_PATHS['census'],
+                        {'get': 'GEO_ID,POP', 'for': 'state:*', 'key': census_key}) for i in range(n)]
+    calls['geocode'] = [(servers['geocode'].url + API_PATHS['geocode'],
+                         {'address': '{} Bonnycastle Dr Charlottesville, VA 22904'.format(i),
+                          'key': 'AIza-mock'}) for i in range(n)]
+    return calls
+
+
+def _retry_get(get, url, params, retries, backoff):
+    """Send a GET with retries and return (latency, retries used, succeeded)"""
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            status = get(url, params=params, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+        if status is not None and status < 500 and status != 429:
+            return time.perf_counter() - start, attempt, True
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    return time.perf_counter() - start, retries, False
+
+
+def _summarize(results, seconds):
+    latencies = [r[0] for r in results]
+    return latency_summary(latencies, seconds,
+                           retries=sum(r[1] for r in results),
+                           failures=sum(not r[2] for r in results))
+
+
+def run_sync(calls, retries=3, backoff=0.01, **kwargs):
+    start = time.perf_counter()
+    results = [_retry_get(requests.get, url, params, retries, backoff) for url, params in calls]
+    return _summarize(results, time.perf_counter() - start)
+
+
+def run_pooled(calls, concurrency=10, retries=3, backoff=0.01, rate=None, **kwargs):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    bucket = TokenBucket(rate, capacity=1) if rate else None
+
+    def one(call):
+        if bucket:
+            bucket.wait()
+        return _retry_get(session.get, call[0], call[1], retries, backoff)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, calls))
+    seconds = time.perf_counter() - start
+    session.close()
+    return _summarize(results, seconds)
+
+
+def run_rate_limited(calls, concurrency=10, rate=50, **kwargs):
+    return run_pooled(calls, concurrency=concurrency, rate=rate, **kwargs)
+
+
+async def _run_async(calls, concurrency, retries, backoff):
+    import aiohttp
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(session, url, params):
+        async with slots:
+            return await send(session, url, params)
+
+    async def send(session, url, params):
+        # Timed from when a connection is free, like the threads in run_pooled()
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                async with session.get(url, params=params) as r:
+                    await r.read()
+                    status = r.status
+            except aiohttp.ClientError:
+                status = None
+            if status is not None and status < 500 and status != 429:
+                return time.perf_counter() - start, attempt, True
+            if attempt < retries:
+                await asyncio.sleep(backoff * 2 ** attempt)
+        return time.perf_counter() - start, retries, False
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(session, url, params) for url, params in calls))
+        return _summarize(results, time.perf_counter() - start)
+
+
+def run_async(calls, concurrency=10, retries=3, backoff=0.01, **kwargs):
+    coro = _run_async(calls, concurrency, retries, backoff)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Jupyter already runs an event loop, so run ours in a separate thread
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+def run_googlemaps(server, n=100, retries=3, **kwargs):
+    """Geocode `n` addresses one at a time with `googlemaps.Client` pointed at the mock"""
+    import googlemaps
+
+    gmaps = googlemaps.Client(key='AIza-mock-key', base_url=server.url, retry_timeout=60)
+    before = server.errors
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        gmaps.geocode('{} Bonnycastle Dr Charlottesville, VA 22904'.format(i))
+        latencies.append(time.perf_counter() - t)
+    # googlemaps retries 5xx errors on its own, so count the errors the server sent
+    return latency_summary(latencies, time.perf_counter() - start,
+                           retries=server.errors - before, failures=0)
+
+
+def run_cursor(server, n=1000, per_page=100, retries=3, backoff=0.01, **kwargs):
+    """Page through `n` search results the way tweepy.Cursor(...).items(n) does"""
+    session = requests.Session()
+    url = server.url + API_PATHS['twitter']
+    results = []
+    max_id = None
+    fetched = 0
+    start = time.perf_counter()
+    while fetched < n:
+        params = {'q': '#uva', 'count': per_page}
+        if max_id is not None:
+            params['max_id'] = max_id
+        t = time.perf_counter()
+        # Each page depends on the last id of the one before, so pages cannot overlap
+        for attempt in range(retries + 1):
+            r = session.get(url, params=params, timeout=30)
+            if r.status_code < 500:
+                break
+            time.sleep(backoff * 2 ** attempt)
+        statuses = r.json()['statuses'] if r.status_code < 500 else []
+        results.append((time.perf_counter() - t, attempt, bool(statuses)))
+        if not statuses:
+            break
+        fetched += len(statuses)
+        max_id = statuses[-1]['id'] - 1
+    seconds = time.perf_counter() - start
+    session.close()
+    summary = _summarize(results, seconds)
+    summary['items'] = fetched
+    return summary
+
+
+RUNNERS = {'sync': run_sync,
+           'pooled': run_pooled,
+           'async': run_async,
+           'rate_limited': run_rate_limited}
+
+
+def run_benchmarks(patterns=PATTERNS, apis=('wikipedia', 'census', 'geocode'), n=200,
+                   latency=0.02, error_rate=0.0, concurrency=10, rate=50, retries=3, seed=0):
+    """Run every pattern against every API and return one row per run in a data frame"""
+    servers = start_mock_apis(latency=latency, error_rate=error_rate, seed=seed)
+    rows = []
+    try:
+        calls = api_calls(servers, n)
+        for pattern in patterns:
+            if pattern == 'googlemaps':
+                rows.append(dict(pattern=pattern, api='geocode',
+                                 **run_googlemaps(servers['geocode'], n=n, retries=retries)))
+            elif pattern == 'cursor':
+                rows.append(dict(pattern=pattern, api='twitter',
+                                 **run_cursor(servers['twitter'], n=n, retries=retries)))
+            else:
+                for api in apis:
+                    options = dict(concurrency=concurrency, retries=retries)
+                    if pattern == 'rate_limited':
+                        options['rate'] = rate
+                    summary = RUNNERS[pattern](calls[api], **options)
+                    rows.append(dict(pattern=pattern, api=api, **summary))
+    finally:
+        for server in servers.values():
+            server.stop()
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    print(run_benchmarks().to_string(index=False))
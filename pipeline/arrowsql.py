@@ -0,0 +1,239 @@
+"""Read query results straight into columns instead of a list of tuples
+
+Chapter 6 reads a table with the database cursor,
+
+    cursor.execute("SELECT * FROM reviews")
+    reviews_df = cursor.fetchall()
+    colnames = [desc[0] for desc in cursor.description]
+    pd.DataFrame(reviews_df, columns=colnames)
+
+which makes a Python tuple for every row and a Python object for every value,
+then copies all of them again into the data frame. `read_frame()` moves the
+results into Arrow columns instead (the format `pd.read_parquet()` uses), a batch
+at a time, and builds the data frame from the columns at the end:
+
+    from pipeline.arrowsql import read_frame
+    reviews_df = read_frame("SELECT * FROM reviews", engine)
+
+How the columns are filled depends on the connection:
+
+* with the `adbc_driver_postgresql` or `adbc_driver_sqlite` packages
+  installed, the ADBC driver hands over Arrow columns directly;
+* PostgreSQL (through psycopg) sends the results with `COPY ... TO STDOUT`,
+  which Arrow's CSV reader turns into typed columns in C, using the column
+  types the server reports;
+* any other connection, including `sqlite3`, is read `batch_size` rows at a
+  time with `fetchmany()`, and each batch is turned into typed columns before
+  the next one is read, so only one batch of Python objects exists at a time.
+
+With `dtype_backend='pyarrow'` the data frame keeps the Arrow columns as they
+are, so text columns do not become Python strings either.
+"""
+
+import io
+import sqlite3
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
+
+# The PostgreSQL type codes that `COPY` writes in a form Arrow can read back exactly
+POSTGRES_TYPES = {16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(),
+                  700: pa.float32(), 701: pa.float64(), 1700: pa.float64(),
+                  19: pa.string(), 25: pa.string(), 1042: pa.string(), 1043: pa.string(),
+                  1082: pa.date32(), 1114: pa.timestamp('us')}
+
+
+def _dialect(con):
+    if isinstance(con, sqlite3.Connection):
+        return 'sqlite'
+    if hasattr(con, 'dialect'):
+        return con.dialect.name
+    return type(con).__module__.split('.')[0]
+
+
+def _adbc(con):
+    """Return the ADBC `dbapi` module for a connection, or None if it is not installed"""
+    dialect = _dialect(con)
+    try:
+        if dialect == 'postgresql':
+            from adbc_driver_postgresql import dbapi
+        # An in-memory SQLite database lives in the engine's own connection, which ADBC cannot reach
+        elif dialect == 'sqlite' and hasattr(con, 'url') and con.url.database not in (None, '', ':memory:'):
+            from adbc_driver_sqlite import dbapi
+        else:
+            return None
+    except ImportError:
+        return None
+    return dbapi
+
+
+def _clean(query):
+    return query.strip().rstrip(';')
+
+
+def _batch(columns, names, text=None):
+    """Turn columns of Python values into a record batch
+
+    `text` is a set of the positions of columns kept as text; a column that
+    turns out to mix types is added to it.
+    """
+    arrays = []
+    for i, values in enumerate(columns):
+        if text is None or i not in text:
+            try:
+                arrays.append(pa.array(values))
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        # SQLite lets a column mix types; keep such a column as text
+        if text is not None:
+            text.add(i)
+        arrays.append(pa.array([None if v is None else str(v) for v in values], pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def fetch_batches(cursor, batch_size=4096):
+    """Yield the results of an executed cursor as Arrow record batches of `batch_size` rows
+
+    Once a column has been kept as text, it is text in every later batch too.
+    """
+    names = [d[0] for d in cursor.description]
+    text = set()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        del rows
+        yield _batch(columns, names, text)
+
+
+def _combine(batches, names):
+    tables = [pa.Table.from_batches([b]) for b in batches]
+    if not tables:
+        return pa.table({name: pa.array([], pa.null()) for name in names})
+    # A column kept as text in a later batch was typed in the earlier ones
+    text = {i for table in tables for i, field in enumerate(table.schema) if pa.types.is_string(field.type)}
+    tables = [table.cast(pa.schema([field.with_type(pa.string()) if i in text else field
+                                    for i, field in enumerate(table.schema)]))
+              for table in tables]
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def _read_cursor(cursor, query, params, batch_size):
+    cursor.execute(query, params or ())
+    names = [d[0] for d in cursor.description]
+    return _combine(fetch_batches(cursor, batch_size), names)
+
+
+class _CopyStream(io.RawIOBase):
+    """A file that reads the data coming out of a psycopg `COPY ... TO STDOUT`"""
+
+    def __init__(self, copy):
+        self.chunks = iter(copy)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            try:
+                self.pending = bytes(next(self.chunks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def _read_postgres_copy(raw, query, params, batch_size):
+    query = _clean(query)
+    with raw.cursor() as cursor:
+        cursor.execute("SELECT * FROM ({}) AS q LIMIT 0".format(query), params)
+        names = [d.name for d in cursor.description]
+        types = {name: POSTGRES_TYPES[d.type_code]
+                 for name, d in zip(names, cursor.description) if d.type_code in POSTGRES_TYPES}
+        with cursor.copy("COPY ({}) TO STDOUT (FORMAT csv)".format(query), params) as copy:
+            reader = pacsv.open_csv(
+                io.BufferedReader(_CopyStream(copy), buffer_size=1 << 20),
+                read_options=pacsv.ReadOptions(column_names=names, block_size=1 << 22),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=types, true_values=['t'], false_values=['f'],
+                    null_values=[''], strings_can_be_null=True,
+                    quoted_strings_can_be_null=False))
+            return pa.Table.from_batches(list(reader), schema=reader.schema)
+
+
+def read_arrow(query, con, params=None, batch_size=4096):
+    """Run a query and return the results as a `pyarrow.Table`
+
+    `con` is a SQLAlchemy engine, a `sqlite3` connection, or a DBAPI connection
+    such as one from `psycopg.connect()` or `mysql.connector.connect()`.
+    """
+    dbapi = _adbc(con)
+    if dbapi is not None:
+        uri = con.url.set(drivername=con.url.get_backend_name()).render_as_string(hide_password=False)
+        if con.url.get_backend_name() == 'sqlite':
+            uri = con.url.database
+        with dbapi.connect(uri) as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetch_arrow_table()
+
+    if hasattr(con, 'dialect'):
+        with con.connect() as conn:
+            raw = conn.connection.driver_connection
+            if con.dialect.name == 'postgresql' and con.dialect.driver == 'psycopg':
+                return _read_postgres_copy(raw, query, params, batch_size)
+            return _read_cursor(raw.cursor(), query, params, batch_size)
+    if _dialect(con) == 'psycopg':
+        return _read_postgres_copy(con, query, params, batch_size)
+    return _read_cursor(con.cursor(), query, params, batch_size)
+
+
+def read_frame(query, con, params=None, batch_size=4096, dtype_backend='numpy'):
+    """Run a query and return a data frame, filled column by column from Arrow
+
+    `dtype_backend='pyarrow'` keeps the Arrow columns, as in `pd.read_sql_query()`.
+    """
+    table = read_arrow(query, con, params=params, batch_size=batch_size)
+    if dtype_backend == 'pyarrow':
+        return table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _fetchall_frame(query, con):
+    cursor = con.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    colnames = [desc[0] for desc in cursor.description]
+    return pd.DataFrame(rows, columns=colnames)
+
+
+def benchmark(query, con):
+    """Compare `fetchall()` plus `pd.DataFrame()` with `read_frame()` on a DBAPI connection
+
+    Returns the seconds and the peak memory of each, as counted by
+    `tracemalloc` (Python objects and NumPy arrays, but not Arrow's own
+    buffers), and the memory of the final data frame.
+    """
+    results = {}
+    runs = (('fetchall', lambda: _fetchall_frame(query, con)),
+            ('read_frame', lambda: read_frame(query, con)),
+            ('read_frame_pyarrow', lambda: read_frame(query, con, dtype_backend='pyarrow')))
+    for label, run in runs:
+        tracemalloc.start()
+        start = time.perf_counter()
+        df = run()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[label] = {'seconds': round(seconds, 3),
+                          'peak_mb': round(peak / 1e6, 1),
+                          'frame_mb': round(df.memory_usage(deep=True).sum() / 1e6, 1)}
+        del df
+    return pd.DataFrame(results).T
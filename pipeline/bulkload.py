@@ -0,0 +1,220 @@
+"""Load data frames into SQLite, MySQL, and PostgreSQL much faster than `to_sql()`
+
+Chapter 6 loads the wine tables with
+
+    reviews.to_sql('reviews', con=engine, index=False, chunksize=1000, if_exists='replace')
+
+which sends the rows in `INSERT` statements, a thousand at a time, and makes
+the database handle every one of them on its own. Every database has a faster
+way in, and `bulk_load()` uses it:
+
+* SQLite: all of the rows in one transaction with `executemany()`, with the
+  settings that make SQLite wait for the disk turned down while the load runs;
+* PostgreSQL: `COPY ... FROM STDIN`, which streams the rows to the server in
+  the same format `COPY` reads from a file;
+* MySQL: `INSERT` statements with many rows each, sized to stay under the
+  server's `max_allowed_packet`, or `LOAD DATA LOCAL INFILE` with
+  `method='infile'` if the server and the connection allow it.
+
+The table is created the same way `to_sql()` creates it, so the column types
+are the same:
+
+    from pipeline.bulkload import bulk_load, load_tables
+    bulk_load(reviews, 'reviews', engine)
+    load_tables({'reviews': reviews, 'tasters': tasters,
+                 'wineries': wineries, 'locations': locations}, engine)
+
+`con` is a SQLAlchemy engine, as in chapter 6, or a `sqlite3` connection.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+SQLITE_PRAGMAS = {'synchronous': 'OFF', 'temp_store': 'MEMORY', 'cache_size': '-262144'}
+
+
+def _dialect(con):
+    if isinstance(con, sqlite3.Connection):
+        return 'sqlite'
+    return con.dialect.name
+
+
+def _quote(name, dialect):
+    if dialect == 'mysql':
+        return '`' + name.replace('`', '``') + '`'
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _columns(df):
+    """Return each column as a list of plain Python values, with None for missing values"""
+    columns = []
+    for _, values in df.items():
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        elif pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values) \
+                or pd.api.types.is_float_dtype(values):
+            if not values.hasnans:
+                columns.append(values.tolist())
+                continue
+        values = values.astype(object)
+        columns.append(values.where(values.notna(), None).tolist())
+    return columns
+
+
+def _rows(df):
+    return zip(*_columns(df))
+
+
+def _create(df, table, con, if_exists):
+    # An empty frame makes `to_sql()` create the table with its usual column types
+    df.head(0).to_sql(table, con, index=False, if_exists=if_exists)
+
+
+def _load_sqlite(df, table, raw):
+    names = ', '.join(_quote(c, 'sqlite') for c in df.columns)
+    placeholders = ', '.join(['?'] * len(df.columns))
+    raw.cursor().executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+        _quote(table, 'sqlite'), names, placeholders), _rows(df))
+
+
+@contextmanager
+def _sqlite_pragmas(raw):
+    """Turn SQLite's waits for the disk down inside the `with` block, and back afterwards"""
+    # These pragmas cannot be changed inside a transaction, so they are set around it
+    saved = {name: raw.execute('PRAGMA {}'.format(name)).fetchone()[0] for name in SQLITE_PRAGMAS}
+    for name, value in SQLITE_PRAGMAS.items():
+        raw.execute('PRAGMA {} = {}'.format(name, value))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            raw.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def _load_sqlite_fast(df, table, raw):
+    """Insert the rows in one transaction, with SQLite's waits for the disk turned down until it is done"""
+    with _sqlite_pragmas(raw), raw:
+        _load_sqlite(df, table, raw)
+
+
+def _load_postgresql(df, table, raw):
+    names = ', '.join(_quote(c, 'postgresql') for c in df.columns)
+    with raw.cursor() as cursor:
+        with cursor.copy('COPY {} ({}) FROM STDIN'.format(_quote(table, 'postgresql'), names)) as copy:
+            for row in _rows(df):
+                copy.write_row(row)
+
+
+def _load_mysql(df, table, raw, max_bytes=None):
+    cursor = raw.cursor()
+    cursor.execute("SELECT @@max_allowed_packet")
+    max_bytes = max_bytes or int(cursor.fetchone()[0]) // 2
+    names = ', '.join(_quote(c, 'mysql') for c in df.columns)
+    prefix = 'INSERT INTO {} ({}) VALUES '.format(_quote(table, 'mysql'), names)
+    row_sql = '(' + ', '.join(['%s'] * len(df.columns)) + ')'
+    # Estimate the size of a row from the first thousand, and send as many rows as fit
+    sample = df.head(1000)
+    row_bytes = max(1, int(sample.astype(str).map(len).to_numpy().sum() / max(len(sample), 1))
+                    + 4 * len(df.columns))
+    per_statement = max(1, min(50000, max_bytes // row_bytes))
+    batch = []
+    for row in _rows(df):
+        batch.extend(row)
+        if len(batch) == per_statement * len(df.columns):
+            cursor.execute(prefix + ', '.join([row_sql] * per_statement), batch)
+            batch = []
+    if batch:
+        cursor.execute(prefix + ', '.join([row_sql] * (len(batch) // len(df.columns))), batch)
+
+
+def _mysql_field(value):
+    # The default format of LOAD DATA: tabs between fields, \N for NULL, and backslash escapes
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = int(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _load_mysql_infile(df, table, raw):
+    cursor = raw.cursor()
+    names = ', '.join(_quote(c, 'mysql') for c in df.columns)
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', newline='', encoding='utf8',
+                                     delete=False) as f:
+        for row in _rows(df):
+            f.write('\t'.join(map(_mysql_field, row)) + '\n')
+    try:
+        cursor.execute("LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8mb4 ({})".format(
+            _quote(table, 'mysql'), names), (f.name,))
+    finally:
+        os.remove(f.name)
+
+
+def _load_other(df, table, con):
+    df.to_sql(table, con, index=False, if_exists='append', method='multi', chunksize=1000)
+
+
+def bulk_load(df, table, con, if_exists='replace', method=None):
+    """Write a data frame to a table with the fastest bulk path of the database
+
+    `if_exists` works as in `to_sql()`. For MySQL, `method='infile'` uses
+    `LOAD DATA LOCAL INFILE`, which needs `allow_local_infile=True` on the
+    connection and `local_infile` turned on in the server. Other databases
+    fall back to `to_sql(method='multi')`. Returns the number of rows, the
+    seconds it took, and the rows per second.
+    """
+    dialect = _dialect(con)
+    start = time.perf_counter()
+    if dialect == 'sqlite' and isinstance(con, sqlite3.Connection):
+        _create(df, table, con, if_exists)
+        _load_sqlite_fast(df, table, con)
+    elif dialect == 'sqlite':
+        # The same fast path on the sqlite3 connection underneath the engine, with the table
+        # created in the same transaction, so a load that fails leaves the old table as it was
+        with con.connect() as conn:
+            raw = conn.connection.driver_connection
+            with _sqlite_pragmas(raw), conn.begin():
+                # sqlite3 only starts a transaction by itself before an INSERT, not a CREATE TABLE
+                conn.exec_driver_sql('BEGIN')
+                _create(df, table, conn, if_exists)
+                _load_sqlite(df, table, raw)
+    else:
+        with con.begin() as conn:
+            _create(df, table, conn, if_exists)
+            raw = conn.connection.driver_connection
+            if dialect == 'postgresql':
+                _load_postgresql(df, table, raw)
+            elif dialect == 'mysql' and method == 'infile':
+                _load_mysql_infile(df, table, raw)
+            elif dialect == 'mysql':
+                _load_mysql(df, table, raw)
+            else:
+                _load_other(df, table, conn)
+    seconds = time.perf_counter() - start
+    return {'table': table, 'rows': len(df), 'seconds': round(seconds, 3),
+            'rows_per_s': round(len(df) / seconds) if seconds else None}
+
+
+def load_tables(tables, con, if_exists='replace', method=None):
+    """Bulk load a dictionary of `{table name: data frame}` and return a data frame of the timings"""
+    return pd.DataFrame([bulk_load(df, table, con, if_exists=if_exists, method=method)
+                         for table, df in tables.items()])
+
+
+def benchmark(df, con, table='bulkload_benchmark'):
+    """Time `to_sql(chunksize=1000)` against `bulk_load()` on the same table
+
+    Returns the seconds each one took and how many times faster `bulk_load()` was.
+    """
+    start = time.perf_counter()
+    df.to_sql(table, con, index=False, chunksize=1000, if_exists='replace')
+    to_sql = time.perf_counter() - start
+    bulk = bulk_load(df, table, con)['seconds']
+    return {'rows': len(df), 'to_sql_s': round(to_sql, 3), 'bulk_load_s': bulk,
+            'speedup': round(to_sql / bulk, 1) if bulk else None}
@@ -0,0 +1,173 @@
+"""Record API responses once and replay them when the notebooks run again
+
+Chapters 3, 4, and 5 send GET requests to Wikipedia, the Census, Reddit,
+jsonplaceholder, and spinitron every time the book is built. A `Cassette` saves
+each response in a small SQLite file the first time it is requested, and hands
+back the saved copy afterwards, so rebuilding a chapter does not wait on the
+network and always sees the same data.
+
+    from pipeline.cassette import Cassette
+
+    with Cassette('cassettes/ch4.sqlite').patch():
+        r = requests.get("https://en.wikipedia.org/w/api.php", params = p_dict)
+
+Inside the `with` block `requests.get()` goes through the cassette, so the code
+in the chapter does not change. A cassette has three modes:
+
+* `'record'` replays a saved response if there is one and records it if not,
+* `'replay'` never touches the network and raises an error for a missing response,
+* `'refresh'` records again any response older than `max_age` seconds.
+
+Responses are matched on the method, the URL, and the query parameters in sorted
+order. Parameters that hold API keys (`ignore_params`) are left out of the match
+and are never written to disk.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+MODES = ('record', 'replay', 'refresh')
+
+# requests has already decompressed and reassembled the body we store
+DROP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'set-cookie')
+
+
+def normalize_request(method, url, params=None, ignore_params=()):
+    """Return the method, URL, and sorted query string that identify a request"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        for k, v in items:
+            values = v if isinstance(v, (list, tuple)) else [v]
+            query.extend((k, str(x)) for x in values)
+    query = sorted((k, v) for k, v in query if k not in ignore_params)
+    netloc = parts.netloc.lower()
+    if (parts.scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    url = urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', '', ''))
+    return method.upper(), url, urlencode(query)
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was never recorded"""
+
+
+class Cassette:
+    """A store of recorded HTTP responses kept in one SQLite file"""
+
+    def __init__(self, path, mode='record', max_age=None, ignore_params=('key',)):
+        if mode not in MODES:
+            raise ValueError("mode must be one of {}".format(MODES))
+        if mode == 'refresh' and max_age is None:
+            raise ValueError("refresh mode needs a max_age in seconds")
+        self.mode = mode
+        self.max_age = max_age
+        self.ignore_params = set(ignore_params)
+        self.hits = 0
+        self.misses = 0
+        self._send = requests.request
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                method TEXT,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                recorded REAL)
+        """)
+
+    def _key(self, method, url, params, body):
+        method, url, query = normalize_request(method, url, params, self.ignore_params)
+        h = hashlib.sha256('{} {}?{}'.format(method, url, query).encode('utf8'))
+        if body is not None:
+            h.update(body if isinstance(body, bytes) else json.dumps(body, sort_keys=True).encode('utf8'))
+        return h.hexdigest(), method, url + ('?' + query if query else '')
+
+    def _load(self, key):
+        with self._lock:
+            return self.db.execute(
+                "SELECT status, headers, body, recorded, url FROM responses WHERE key = ?",
+                (key,)).fetchone()
+
+    def _save(self, key, method, url, r):
+        headers = {k: v for k, v in r.headers.items() if k.lower() not in DROP_HEADERS}
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, method, url, r.status_code, json.dumps(headers),
+                 zlib.compress(r.content), time.time()))
+            self.db.commit()
+
+    def request(self, method, url, params=None, **kwargs):
+        """Work like `requests.request()`, but replay or record through the cassette"""
+        body = kwargs.get('data', kwargs.get('json'))
+        key, method, shown_url = self._key(method, url, params, body)
+        saved = self._load(key)
+        fresh = saved is not None and (self.mode != 'refresh'
+                                       or time.time() - saved[3] <= self.max_age)
+        if fresh or (saved is not None and self.mode == 'replay'):
+            self.hits += 1
+            return _response(*saved)
+        if self.mode == 'replay':
+            raise CassetteMiss("no recorded response for {} {}".format(method, shown_url))
+
+        self.misses += 1
+        try:
+            r = self._send(method, url, params=params, **kwargs)
+        except requests.RequestException:
+            # A stale copy is better than a failed build
+            if saved is None:
+                raise
+            self.hits += 1
+            return _response(*saved)
+        # Server errors are usually temporary, so we do not keep them
+        if r.status_code < 500:
+            self._save(key, method, shown_url, r)
+        return r
+
+    def get(self, url, params=None, **kwargs):
+        """Work like `requests.get()`"""
+        return self.request('GET', url, params=params, **kwargs)
+
+    @contextlib.contextmanager
+    def patch(self):
+        """Send every `requests.get()` call through this cassette inside a `with` block"""
+        original = requests.get
+        requests.get = self.get
+        try:
+            yield self
+        finally:
+            requests.get = original
+
+    def close(self):
+        self.db.close()
+
+
+def _response(status, headers, body, recorded, url):
+    r = requests.Response()
+    r.status_code = status
+    r.headers = CaseInsensitiveDict(json.loads(headers))
+    r._content = zlib.decompress(body)
+    r.encoding = get_encoding_from_headers(r.headers)
+    r.url = url
+    r.reason = 'Replayed'
+    return r
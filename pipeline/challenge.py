@@ -0,0 +1,148 @@
+"""Answer webhook verification challenges quickly
+
+Some APIs (eBay's account deletion notifications, for example) check that we own
+a webhook endpoint by sending it a challenge code. The endpoint must answer with
+
+    hashlib.sha256((challengeCode + verificationToken + endpoint).encode()).hexdigest()
+
+Worked out by hand, that builds a new string for every challenge. `Responder`
+encodes the fixed part, `verificationToken + endpoint`, to bytes once, and feeds
+the challenge code and then the fixed bytes to the hash, so answering a challenge
+copies no strings. (The fixed part comes after the challenge code, so the hash
+itself cannot be started ahead of time.) The JSON answer always has the same
+length, so the HTTP headers are built once as well.
+
+`serve()` runs the endpoint on a local port with `asyncio`, and `load_test()`
+sends it many challenges over several connections and reports the requests per
+second and the median (p50) and 99th percentile (p99) latency. `benchmark()` does
+both at once:
+
+    from pipeline.challenge import benchmark
+    await benchmark('my-verification-token', 'https://example.com/webhook')
+"""
+
+import asyncio
+import hashlib
+import time
+from urllib.parse import unquote_to_bytes
+
+from pipeline.timing import latency_summary
+
+PARAM = b'challenge_code='
+BODY_START = b'{"challengeResponse":"'
+BODY_END = b'"}'
+HEADERS = (b'HTTP/1.1 200 OK\r\n'
+           b'Content-Type: application/json\r\n'
+           b'Content-Length: ' + str(len(BODY_START) + 64 + len(BODY_END)).encode() + b'\r\n'
+           b'\r\n' + BODY_START)
+NO_CONTENT = b'HTTP/1.1 204 No Content\r\n\r\n'
+BAD_REQUEST = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n'
+
+
+class Responder:
+    """Compute challenge responses for one verification token and endpoint"""
+
+    def __init__(self, verification_token, endpoint):
+        self.fixed = (verification_token + endpoint).encode('utf8')
+
+    def digest(self, challenge_code):
+        """Return the hex digest for a challenge code given as bytes"""
+        h = hashlib.sha256(challenge_code)
+        h.update(self.fixed)
+        return h.hexdigest().encode('ascii')
+
+    def expected(self, challenge_code):
+        """The answer worked out the slow way, for checking"""
+        return hashlib.sha256((challenge_code + self.fixed.decode('utf8')).encode('utf8')).hexdigest()
+
+    async def handle(self, reader, writer):
+        """Answer requests on one keep-alive connection until the client closes it"""
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                line_end = head.index(b'\r\n')
+                method, _, rest = head[:line_end].partition(b' ')
+                target = rest.rpartition(b' ')[0]
+
+                length = _content_length(head)
+                if length:
+                    await reader.readexactly(length)
+
+                start = target.find(PARAM)
+                if method == b'GET' and start >= 0:
+                    start += len(PARAM)
+                    end = target.find(b'&', start)
+                    code = target[start:end] if end >= 0 else target[start:]
+                    if b'%' in code or b'+' in code:
+                        code = unquote_to_bytes(code.replace(b'+', b' '))
+                    writer.writelines((HEADERS, self.digest(code), BODY_END))
+                elif method == b'POST':
+                    # Notifications only need to be acknowledged
+                    writer.write(NO_CONTENT)
+                else:
+                    writer.write(BAD_REQUEST)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _content_length(head):
+    i = head.lower().find(b'\r\ncontent-length:')
+    if i < 0:
+        return 0
+    end = head.index(b'\r\n', i + 2)
+    return int(head[i + 17:end])
+
+
+async def serve(verification_token, endpoint, host='127.0.0.1', port=8080):
+    """Start the verification endpoint and return the `asyncio` server"""
+    responder = Responder(verification_token, endpoint)
+    return await asyncio.start_server(responder.handle, host, port)
+
+
+async def load_test(host, port, requests=10000, connections=50, check=None):
+    """Send `requests` challenges over `connections` keep-alive connections
+
+    If `check` is a `Responder`, every answer is compared with the slow
+    calculation. Returns a dictionary with requests per second and latency
+    percentiles in milliseconds.
+    """
+    latencies = []
+    per_connection = [requests // connections + (i < requests % connections)
+                      for i in range(connections)]
+    errors = 0
+
+    async def client(n, offset):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(n):
+            code = 'challenge{}'.format(offset + i)
+            request = 'GET /webhook?challenge_code={} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(code, host)
+            t = time.perf_counter()
+            writer.write(request.encode('ascii'))
+            head = await reader.readuntil(b'\r\n\r\n')
+            body = await reader.readexactly(_content_length(head))
+            latencies.append(time.perf_counter() - t)
+            if check is not None and body[len(BODY_START):-len(BODY_END)].decode() != check.expected(code):
+                errors += 1
+        writer.close()
+
+    start = time.perf_counter()
+    offsets = [sum(per_connection[:i]) for i in range(connections)]
+    await asyncio.gather(*(client(n, o) for n, o in zip(per_connection, offsets) if n))
+    return latency_summary(latencies, time.perf_counter() - start, errors=errors)
+
+
+async def benchmark(verification_token, endpoint, requests=10000, connections=50):
+    """Run the endpoint on a free local port and measure it with `load_test()`"""
+    server = await serve(verification_token, endpoint, port=0)
+    host, port = server.sockets[0].getsockname()[:2]
+    async with server:
+        return await load_test(host, port, requests, connections,
+                               check=Responder(verification_token, endpoint))
+
+
+if __name__ == '__main__':
+    print(asyncio.run(benchmark('example-verification-token-0123456789', 'https://example.com/webhook')))
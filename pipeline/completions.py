@@ -0,0 +1,184 @@
+"""Send many prompts to ChatGPT at the same time
+
+In the ChatGPT appendix, `get_completion()` sends one prompt to
+`client.chat.completions.create()` and waits for the answer before the next prompt
+can be sent. `complete_file()` reads prompts from a JSON lines file, one per line,
+
+    {"id": 1, "prompt": "What is the best way to make smores?"}
+    {"id": 2, "messages": [{"role": "user", "content": "Say this is a test"}], "model": "gpt-4o-mini"}
+
+and keeps up to `concurrency` of them in flight at once, while keeping the
+(estimated) number of tokens sent each minute under `tokens_per_minute`. A prompt
+that was already answered, earlier in the file or in an earlier run, is answered
+from a `ResponseCache` instead of being sent again. The answers are written to
+another JSON lines file in the same order as the prompts, as soon as each answer
+and every answer before it are ready.
+
+Notebooks already run an event loop, so there we use `await`:
+
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=os.getenv('openaikey'))
+    await complete_file('prompts.jsonl', 'answers.jsonl', openai_completer(client))
+
+In a script, use `asyncio.run(complete_file(...))`. To test without an API key,
+point the client at `pipeline.mockserver.MockServer({'/v1/chat/completions':
+openai_route})` with `AsyncOpenAI(base_url=server.url + '/v1', api_key='test')`.
+"""
+
+import asyncio
+import collections
+import hashlib
+import json
+import sqlite3
+import time
+
+from pipeline.ratelimit import TokenBucket
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+DEFAULT_MAX_TOKENS = 256
+
+
+def prompt_messages(item):
+    """Return the chat messages for a prompt written with either "prompt" or "messages" """
+    if 'messages' in item:
+        return item['messages']
+    return [{'role': 'user', 'content': item['prompt']}]
+
+
+def prompt_params(item):
+    """Return the model and the other arguments for `chat.completions.create()`"""
+    params = {k: v for k, v in item.items() if k not in ('id', 'prompt', 'messages')}
+    params.setdefault('model', DEFAULT_MODEL)
+    return params
+
+
+def estimate_tokens(item):
+    """Roughly count the tokens a prompt will use: four characters per token plus the answer"""
+    text = sum(len(m['content']) + 16 for m in prompt_messages(item))
+    return text // 4 + item.get('max_tokens', DEFAULT_MAX_TOKENS)
+
+
+def prompt_key(item):
+    """Identify a prompt by its model, messages, and arguments, but not its id"""
+    text = json.dumps([prompt_messages(item), prompt_params(item)], sort_keys=True)
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+class ResponseCache:
+    """Answers to prompts we have already sent, kept in memory or in a SQLite file"""
+
+    def __init__(self, path=':memory:'):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, result TEXT)")
+
+    def get(self, key):
+        row = self.db.execute("SELECT result FROM answers WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        self.db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?)", (key, json.dumps(result)))
+        self.db.commit()
+
+
+def openai_completer(client):
+    """Wrap an `openai.AsyncOpenAI` client as a function that answers one prompt"""
+
+    async def complete(item):
+        r = await client.chat.completions.create(messages=prompt_messages(item),
+                                                 **prompt_params(item))
+        return {'response': r.choices[0].message.content,
+                'usage': r.usage.total_tokens if r.usage else None}
+
+    return complete
+
+
+async def complete_all(items, complete, concurrency=8, tokens_per_minute=90000,
+                       cache=None, retries=3, window=None):
+    """Answer every prompt in `items`, yielding `(item, result)` pairs in order
+
+    `complete` is an async function that answers one prompt and returns a
+    dictionary such as `{'response': ..., 'usage': ...}`. At most `window`
+    prompts (four times `concurrency` by default) are started ahead of the
+    oldest unfinished one, so a long file never sits in memory all at once.
+    """
+    bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+    slots = asyncio.Semaphore(concurrency)
+    cache = cache if cache is not None else ResponseCache()
+    window = window or concurrency * 4
+    running = {}
+    pending = collections.deque()
+
+    async def answer(item, key):
+        saved = cache.get(key)
+        if saved is not None:
+            return dict(saved, cached=True)
+        async with slots:
+            for attempt in range(retries + 1):
+                estimate = estimate_tokens(item)
+                await bucket.acquire(estimate)
+                try:
+                    result = await complete(item)
+                    break
+                except Exception as e:
+                    bucket.refund(estimate)
+                    if attempt == retries:
+                        return {'error': repr(e)}
+                    await asyncio.sleep(2 ** attempt)
+        used = result.get('usage')
+        if used is not None and used < estimate:
+            bucket.refund(estimate - used)
+        cache.put(key, result)
+        return dict(result, cached=False)
+
+    async def finish_oldest():
+        item, key, task, duplicate = pending.popleft()
+        result = await task
+        if running.get(key) is task:
+            del running[key]
+        if duplicate:
+            result = dict(result, cached=True)
+        return item, result
+
+    for item in items:
+        key = prompt_key(item)
+        duplicate = key in running
+        if not duplicate:
+            running[key] = asyncio.ensure_future(answer(item, key))
+        pending.append((item, key, running[key], duplicate))
+        while len(pending) >= window or pending[0][2].done():
+            yield await finish_oldest()
+            if not pending:
+                break
+    while pending:
+        yield await finish_oldest()
+
+
+def read_prompts(path):
+    """Read prompts one at a time from a JSON lines file"""
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def complete_file(infile, outfile, complete, **kwargs):
+    """Answer the prompts in `infile` and write them with their answers to `outfile`
+
+    Takes the same keyword arguments as `complete_all()` and returns a summary
+    of how many prompts were sent, answered from the cache, or failed.
+    """
+    summary = {'prompts': 0, 'sent': 0, 'cached': 0, 'errors': 0}
+    start = time.perf_counter()
+    with open(outfile, 'w', encoding='utf8') as out:
+        async for item, result in complete_all(read_prompts(infile), complete, **kwargs):
+            out.write(json.dumps(dict(item, **result)) + '\n')
+            out.flush()
+            summary['prompts'] += 1
+            if 'error' in result:
+                summary['errors'] += 1
+            elif result['cached']:
+                summary['cached'] += 1
+            else:
+                summary['sent'] += 1
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
@@ -0,0 +1,128 @@
+"""Skip the playlists that have not changed since the last crawl
+
+Every run of the chapter 5 spider downloads and parses every playlist again,
+even though a playlist from last week will never change. A `CrawlCache` remembers,
+for every URL, the `ETag` and `Last-Modified` headers the website sent, a hash of
+the page, and the rows we parsed from it (in a Parquet file). On the next crawl:
+
+1. the request includes `If-None-Match` and `If-Modified-Since` headers, and a
+   website that supports them answers "304 Not Modified" with no page at all;
+2. if the website sends the page anyway, but its hash has not changed, we skip
+   parsing it;
+3. either way, the rows come from the saved Parquet file.
+
+Only new or changed pages are parsed. Pass a cache to the crawler or a spider:
+
+    from pipeline.crawlcache import CrawlCache
+    cache = CrawlCache('crawlcache/wnrn')
+    wnrn_total_playlist = crawl(urls, cache=cache)
+    cache.stats
+
+Use a separate folder for each spider, because the saved rows depend on which
+fields the spider extracts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+
+def page_hash(content):
+    """Return a fingerprint of a page's raw bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class CrawlCache:
+    """Validators, fingerprints, and parsed rows for every URL we have crawled"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.rows_folder = os.path.join(folder, 'rows')
+        os.makedirs(self.rows_folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, 'pages.sqlite'), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                hash TEXT,
+                checked REAL)
+        """)
+        self._lock = threading.Lock()
+        self.stats = {'not_modified': 0, 'unchanged': 0, 'parsed': 0}
+
+    def lookup(self, url):
+        """Return `(etag, last_modified, hash)` for a URL, or None if it was never crawled"""
+        with self._lock:
+            row = self.db.execute("SELECT etag, last_modified, hash FROM pages WHERE url = ?",
+                                  (url,)).fetchone()
+        if row is None or not os.path.exists(self._rows_path(url)):
+            return None
+        return row
+
+    def conditional_headers(self, url):
+        """Return the headers that ask the website to skip the page if it has not changed"""
+        saved = self.lookup(url)
+        headers = {}
+        if saved is not None:
+            if saved[0]:
+                headers['If-None-Match'] = saved[0]
+            if saved[1]:
+                headers['If-Modified-Since'] = saved[1]
+        return headers
+
+    def is_unchanged(self, url, response):
+        """Decide whether a response means we can reuse the saved rows
+
+        Returns `(unchanged, hash)`; the hash is None for a 304 response.
+        """
+        if response.status_code == 304:
+            self._count('not_modified')
+            self._touch(url, response)
+            return True, None
+        digest = page_hash(response.content)
+        saved = self.lookup(url)
+        if saved is not None and saved[2] == digest:
+            self._count('unchanged')
+            self._touch(url, response)
+            return True, digest
+        return False, digest
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _touch(self, url, response):
+        with self._lock:
+            self.db.execute("""
+                UPDATE pages SET checked = ?,
+                    etag = COALESCE(?, etag),
+                    last_modified = COALESCE(?, last_modified)
+                WHERE url = ?""",
+                (time.time(), response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), url))
+            self.db.commit()
+
+    def _rows_path(self, url):
+        return os.path.join(self.rows_folder, hashlib.sha256(url.encode('utf8')).hexdigest() + '.parquet')
+
+    def rows(self, url):
+        """Return the saved rows for a URL as a dictionary of lists"""
+        return pd.read_parquet(self._rows_path(url)).to_dict('list')
+
+    def store(self, url, columns, headers, digest):
+        """Save the rows parsed from a page along with its validators and hash"""
+        path = self._rows_path(url)
+        tmp = path + '.tmp'
+        pd.DataFrame(columns).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        self._count('parsed')
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                            (url, headers.get('ETag'), headers.get('Last-Modified'),
+                             digest, time.time()))
+            self.db.commit()
@@ -0,0 +1,194 @@
+"""Download and parse many playlist pages at the same time
+
+In chapter 5 the spider visits one playlist at a time:
+
+    for w in wnrn_url:
+        moredata = wnrn_spider('https://spinitron.com/' + w)
+
+so the total time is the sum of the time it takes every page to download. Most
+of that time is spent waiting on the network, and the computer could be waiting
+on several pages at once. `crawl()` downloads pages in a pool of threads, but
+never more than `per_host` pages at once from the same website, to stay polite.
+As soon as a page arrives it is parsed in a pool of processes (parsing HTML keeps
+a processor busy, so threads would take turns), and its rows are added to the
+columns of the final data frame.
+
+    from pipeline.crawler import crawl
+    wnrn_total_playlist = crawl(['https://spinitron.com/' + w for w in wnrn_url])
+
+The parser is any function that takes the HTML text and returns a dictionary of
+lists, such as `pipeline.wnrn.parse_playlist()`. It has to be defined in a module
+(not in a notebook cell) so the processes in the pool can import it. To test a
+crawl without touching spinitron, serve saved pages with
+`MockServer(fixture_routes('fixtures'))` from `pipeline.mockserver`.
+"""
+
+import threading
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline.accumulate import FrameAccumulator
+from pipeline.profiler import NullProfiler, timed
+from pipeline.wnrn import HEADERS, parse_playlist
+
+
+class HostLimits:
+    """Allow at most `per_host` requests at a time to any one website"""
+
+    def __init__(self, per_host=2):
+        self.per_host = per_host
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+
+def make_session(pool_size=10, headers=HEADERS):
+    """Return a `requests.Session` that can keep `pool_size` connections open per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+def fetch(session, url, limits, timeout=30, cache=None, profiler=None):
+    """Download one page, waiting for a free slot for its website first
+
+    With a `pipeline.crawlcache.CrawlCache`, the request asks the website to
+    answer "304 Not Modified" if the page has not changed since the last crawl.
+    """
+    headers = cache.conditional_headers(url) if cache is not None else None
+    profiler = profiler or NullProfiler()
+    with limits(url), profiler.stage('fetch', url) as fetched:
+        r = session.get(url, headers=headers, timeout=timeout)
+        fetched['bytes'] = len(r.content)
+    r.raise_for_status()
+    return r
+
+
+def iter_crawl(urls, parse=parse_playlist, fetch_workers=8, per_host=2, parse_workers=None,
+               session=None, cache=None, scheduler=None, profiler=None):
+    """Yield `(url, columns)` for each page as soon as it has been downloaded and parsed
+
+    A page that fails to download or parse is yielded as `(url, exception)`. With
+    a `cache`, pages that have not changed are not parsed again: their rows come
+    from the cache. A `scheduler`, such as a `pipeline.politeness.PoliteScheduler`,
+    replaces the pool of `fetch_workers` threads and decides when each page is
+    downloaded. A `pipeline.profiler.StageProfiler` records the `fetch` and
+    `parse` time of every page.
+    """
+    session = session or make_session(max(fetch_workers, per_host))
+    if scheduler is None:
+        limits = HostLimits(per_host)
+        fetchers = ThreadPoolExecutor(fetch_workers)
+    else:
+        limits = lambda url: nullcontext()
+        fetchers = scheduler
+    get = partial(fetch, session, limits=limits, cache=cache, profiler=profiler)
+    if profiler is not None:
+        parse = partial(timed, parse)
+    with fetchers, ProcessPoolExecutor(parse_workers) as parsers:
+        downloads = {fetchers.submit(get, url): url for url in urls}
+        parsing = {}
+        validators = {}
+        sizes = {}
+        pending = set(downloads)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    url = downloads.pop(future)
+                    try:
+                        r = future.result()
+                        if cache is not None:
+                            unchanged, digest = cache.is_unchanged(url, r)
+                            if unchanged:
+                                yield url, cache.rows(url)
+                                continue
+                            validators[url] = (r.headers, digest)
+                        job = parsers.submit(parse, r.text)
+                        sizes[url] = len(r.content)
+                    except Exception as e:
+                        yield url, e
+                        continue
+                    parsing[job] = url
+                    pending.add(job)
+                else:
+                    url = parsing.pop(future)
+                    try:
+                        columns = future.result()
+                        if profiler is not None:
+                            columns, (wall, seconds, pid) = columns
+                            profiler.record('parse', wall, seconds, sizes.pop(url), url=url,
+                                            thread='parser {}'.format(pid))
+                        if cache is not None:
+                            cache.store(url, columns, *validators.pop(url))
+                    except Exception as e:
+                        yield url, e
+                        continue
+                    yield url, columns
+
+
+def crawl(urls, parse=parse_playlist, url_column=None, **kwargs):
+    """Crawl every URL and return all of the rows in one data frame, in the order of `urls`
+
+    Takes the same keyword arguments as `iter_crawl()`. If `url_column` is
+    given, a column with that name records the page each row came from. Pages
+    that could not be crawled, or whose columns have different lengths, are
+    listed in `df.attrs['failed']`. Only the pages that arrive ahead of an
+    earlier page wait in memory as dictionaries. With a `profiler`, building
+    the data frame is timed as the stage `build`.
+    """
+    urls = list(urls)
+    profiler = kwargs.get('profiler') or NullProfiler()
+    playlist = FrameAccumulator()
+    pages = {}
+    finished = set()
+    failed = []
+    added = 0
+
+    def add(url, page):
+        if url_column:
+            n = len(next(iter(page.values()), []))
+            page = dict(page, **{url_column: [url] * n})
+        try:
+            playlist.add_rows(page)
+        except ValueError as e:
+            # A page whose columns do not line up is lost, not the whole crawl
+            failed.append((url, repr(e)))
+
+    for url, result in iter_crawl(urls, parse=parse, **kwargs):
+        if url in finished:
+            # A URL listed twice is crawled twice, but its rows are added once
+            continue
+        finished.add(url)
+        if isinstance(result, Exception):
+            failed.append((url, repr(result)))
+        else:
+            pages[url] = result
+        # Pages are added in the order of `urls`, as soon as every page before them is done
+        if added < len(urls) and urls[added] in finished:
+            with profiler.stage('build'):
+                while added < len(urls) and urls[added] in finished:
+                    page = pages.pop(urls[added], None)
+                    if page is not None:
+                        add(urls[added], page)
+                    added += 1
+
+    with profiler.stage('build'):
+        df = playlist.to_frame()
+    df.attrs['failed'] = failed
+    return df
@@ -0,0 +1,222 @@
+"""One place to get a database engine, instead of a new one in every notebook cell
+
+Chapters 6 and 7 connect to the same `winedb` in several ways: a raw
+`mysql.connector.connect()` or `psycopg.connect()` to create the database, then
+a `create_engine()` for pandas, and sometimes an old `dbserver` is closed
+while an engine to the same database is still open. Every `create_engine()`
+starts its own pool of connections, so notebooks and dashboards that each make
+their own engines can use up the server's connection limit.
+
+A `Registry` builds each engine once and hands out the same one every time:
+
+    from pipeline.databases import get_engine
+    engine = get_engine('postgres', 'winedb')
+    pd.read_sql_query(myquery, con=engine)
+
+The passwords are read from `.env` with `dotenv` the first time an engine is
+built. Every engine is created with `pool_pre_ping=True`, so a connection the
+server has dropped is replaced before it is used instead of raising an error,
+and with a limit on the number of connections it may open. `connect()` hands out
+a connection from the pool and records how long it had to wait for one, and
+`stats()` shows those waits for every engine, which tells us when the pool is too
+small for the number of kernels or dashboard workers sharing it.
+
+The local servers from `compose.yaml` are registered as `'mysql'` and
+`'postgres'`; their host is `localhost` unless `MYSQL_HOST` or `POSTGRES_HOST`
+says otherwise (inside the Docker network it is `mysql` or `postgres`). Add
+others, such as a database on AWS RDS, with `register()`:
+
+    registry.register('rds', dbms='postgresql', package='psycopg', user='postgres',
+                      password='$RDS_PASSWORD', host='mydb.abc123.us-east-1.rds.amazonaws.com')
+"""
+
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import dotenv
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from pipeline.timing import percentile
+
+SERVERS = {
+    'mysql': {'dbms': 'mysql', 'package': 'mysqlconnector', 'user': 'root',
+              'password': '$MYSQL_ROOT_PASSWORD', 'host': '$MYSQL_HOST', 'port': 3306},
+    'postgres': {'dbms': 'postgresql', 'package': 'psycopg', 'user': 'postgres',
+                 'password': '$POSTGRES_PASSWORD', 'host': '$POSTGRES_HOST', 'port': 5432},
+}
+
+POOL = {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 30, 'pool_recycle': 1800}
+
+
+class _PoolStats:
+    def __init__(self):
+        self.waits = []
+        self.checked_out = 0
+        self.most_checked_out = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+
+    def listen(self, engine):
+        @event.listens_for(engine, 'checkout')
+        def checkout(dbapi_connection, record, proxy):
+            with self._lock:
+                self.checked_out += 1
+                self.most_checked_out = max(self.most_checked_out, self.checked_out)
+
+        @event.listens_for(engine, 'checkin')
+        def checkin(dbapi_connection, record):
+            with self._lock:
+                self.checked_out -= 1
+
+        @event.listens_for(engine, 'invalidate')
+        def invalidate(dbapi_connection, record, exception):
+            with self._lock:
+                self.invalidated += 1
+
+    def waited(self, seconds):
+        with self._lock:
+            self.waits.append(seconds)
+            # Keep the most recent waits only
+            if len(self.waits) > 10000:
+                del self.waits[:5000]
+
+
+class Registry:
+    """Build each database engine once, share it, and keep track of its pool"""
+
+    def __init__(self, servers=None, pool=None, env_file=None):
+        self.servers = dict(SERVERS if servers is None else servers)
+        self.pool = dict(POOL if pool is None else pool)
+        self.env_file = env_file
+        self.engines = {}
+        self.pool_stats = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def register(self, name, url=None, **server):
+        """Add a server by URL, or by the same pieces chapter 6 uses to build one
+
+        A `password` or `host` that starts with `$`, such as `'$RDS_PASSWORD'`,
+        is the name of an environment variable (from `.env`), which is looked
+        up when the engine is built. Any other value is used as it is.
+        """
+        self.servers[name] = {'url': url} if url is not None else server
+
+    def _env(self, value, default=None):
+        if not self._loaded:
+            dotenv.load_dotenv(self.env_file)
+            self._loaded = True
+        if isinstance(value, str) and value.startswith('$'):
+            return os.getenv(value[1:], default)
+        return value if value is not None else default
+
+    def url(self, name, db=None):
+        """Return the SQLAlchemy URL of a registered server and database"""
+        server = self.servers[name]
+        if 'url' in server:
+            return server['url']
+        return URL.create('{}+{}'.format(server['dbms'], server['package']),
+                          username=server.get('user'),
+                          password=self._env(server.get('password')),
+                          host=self._env(server.get('host'), 'localhost'),
+                          port=server.get('port'),
+                          database=db)
+
+    def engine(self, name, db=None, **options):
+        """Return the shared engine for a server and database, building it the first time
+
+        `options` are passed to `create_engine()` the first time only.
+        """
+        key = (name, db)
+        with self._lock:
+            if key not in self.engines:
+                url = self.url(name, db)
+                kwargs = {'pool_pre_ping': True}
+                if not str(url).startswith('sqlite'):
+                    kwargs.update(self.pool)
+                kwargs.update(options)
+                engine = create_engine(url, **kwargs)
+                stats = _PoolStats()
+                stats.listen(engine)
+                self.engines[key] = engine
+                self.pool_stats[key] = stats
+            return self.engines[key]
+
+    @contextmanager
+    def connect(self, name, db=None):
+        """Check out a connection from the shared pool, recording how long that took"""
+        engine = self.engine(name, db)
+        stats = self.pool_stats[(name, db)]
+        start = time.perf_counter()
+        try:
+            conn = engine.connect()
+        except PoolTimeout:
+            with stats._lock:
+                stats.timeouts += 1
+            raise
+        stats.waited(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create_database(self, name, db, replace=True):
+        """Create a database on a server, dropping it first if `replace`, as chapter 6 does with a cursor"""
+        # PostgreSQL will not drop a database that our pool still has connections to,
+        # and connections to the old database would be no good afterwards anyway
+        self.dispose(name, db)
+        engine = self.engine(name)
+        quoted = engine.dialect.identifier_preparer.quote(db)
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            if replace:
+                conn.exec_driver_sql('DROP DATABASE IF EXISTS {}'.format(quoted))
+            conn.exec_driver_sql('CREATE DATABASE {}'.format(quoted))
+
+    def stats(self):
+        """Return a data frame with the pool size and checkout waits of every engine"""
+        rows = []
+        for (name, db), engine in self.engines.items():
+            s = self.pool_stats[(name, db)]
+            waits = sorted(s.waits)
+            pool = engine.pool
+            rows.append({'server': name, 'database': db,
+                         'pool_size': pool.size() if hasattr(pool, 'size') else None,
+                         'checked_out': s.checked_out,
+                         'most_checked_out': s.most_checked_out,
+                         'checkouts': len(waits),
+                         'wait_p50_ms': round(percentile(waits, 50) * 1000, 3),
+                         'wait_p95_ms': round(percentile(waits, 95) * 1000, 3),
+                         'wait_max_ms': round(waits[-1] * 1000, 3) if waits else float('nan'),
+                         'timeouts': s.timeouts,
+                         'invalidated': s.invalidated})
+        return pd.DataFrame(rows)
+
+    def dispose(self, name=None, db=None):
+        """Close the pooled connections of one engine, or of all of them"""
+        with self._lock:
+            keys = [k for k in self.engines if name is None or k == (name, db)]
+            for key in keys:
+                self.engines.pop(key).dispose()
+                self.pool_stats.pop(key)
+
+
+registry = Registry()
+atexit.register(registry.dispose)
+
+
+def get_engine(name, db=None, **options):
+    """Return the shared engine for a server in the default registry"""
+    return registry.engine(name, db, **options)
+
+
+def connect(name, db=None):
+    """Check out a connection from the default registry's pool for a `with` block"""
+    return registry.connect(name, db)
@@ -0,0 +1,227 @@
+"""Run the chapter 7 SQL in process with DuckDB, over data frames and Parquet files
+
+Every query in chapter 7 goes to a PostgreSQL server through
+`pd.read_sql_query(myquery, con=engine)`, so before we can try a single one we
+need the server running and the wine database loaded into it. DuckDB is a
+database that runs inside Python, like SQLite, but it stores tables by column
+and runs `GROUP BY`, joins, and subqueries on all of the computer's cores at
+once, many values at a time. It can read data frames and Parquet files where
+they are, without loading them first.
+
+A backend is anything with a `query(sql)` method that returns a data frame.
+`ServerBackend` wraps a SQLAlchemy engine, as in chapter 7, and `DuckDBBackend`
+runs the same SQL text on tables we register with it:
+
+    from pipeline.embedded import DuckDBBackend, read_sql_query
+    duck = DuckDBBackend()
+    duck.register_tables({'reviews': reviews, 'tasters': tasters,
+                          'wineries': wineries, 'locations': locations})
+    duck.register('reviews', 'wines_reviews.parquet')   # or from a Parquet file
+    read_sql_query(myquery, con=duck)
+
+`read_sql_query()` takes a backend or anything `pd.read_sql_query()` takes. The
+queries need no changes: `%%`, which psycopg needs for `%` in `LIKE`, is turned
+back into `%`, and PostgreSQL's `INITCAP()`, which DuckDB does not have, is
+added as a function that works on a whole column at a time.
+
+`DuckDBBackend.from_engine(engine)` copies the tables of a database into DuckDB,
+and `compare()` runs a set of queries on two backends, checks they return the
+same rows, and reports how much faster the second one is. `notebook_queries()`
+collects the queries of a chapter's notebook:
+
+    duck = DuckDBBackend.from_engine(engine)
+    compare(notebook_queries('ch7.ipynb', duck.tables()), ServerBackend(engine), duck)
+"""
+
+import json
+import os
+import re
+import time
+
+import duckdb
+import pandas as pd
+import pyarrow.compute as pc
+
+from pipeline.arrowsql import read_arrow
+from pipeline.timing import percentile
+
+_NAMED = re.compile(r'%\((\w+)\)s')
+
+
+def _initcap(values):
+    # Upper case the first letter of each word and lower case the rest, like PostgreSQL
+    # (except that Arrow also starts a new word after a digit)
+    return pc.utf8_title(values)
+
+
+class ServerBackend:
+    """Run SQL on a database server through a SQLAlchemy engine, as chapter 7 does"""
+
+    name = 'server'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def query(self, sql, params=None):
+        """Run a query and return the result as a data frame"""
+        return pd.read_sql_query(sql, con=self.engine, params=params)
+
+    def tables(self):
+        from sqlalchemy import inspect
+        return inspect(self.engine).get_table_names()
+
+
+class DuckDBBackend:
+    """Run SQL with DuckDB, in this process, on registered data frames and Parquet files
+
+    `database` is ':memory:' or a file to keep the tables in. DuckDB uses
+    every core unless `threads` says otherwise.
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, database=':memory:', threads=None):
+        self.con = duckdb.connect(database)
+        if threads:
+            self.con.execute('SET threads = {}'.format(int(threads)))
+        self.con.create_function('initcap', _initcap, [duckdb.sqltype('VARCHAR')],
+                                 duckdb.sqltype('VARCHAR'), type='arrow')
+        self._registered = set()
+
+    def register(self, name, source, copy=False):
+        """Make a data frame, Arrow table, or Parquet file (or glob of files) available as a table
+
+        Data frames and Arrow tables are read where they are, so changes to
+        them show up in later queries. `copy=True` loads the rows into a
+        DuckDB table instead, which `INSERT`, `UPDATE`, and `DELETE` can change.
+        """
+        if name in self._registered:
+            self.con.unregister(name)
+            self._registered.discard(name)
+        for (kind,) in self.con.execute('SELECT table_type FROM information_schema.tables '
+                                        'WHERE table_name = ?', [name]).fetchall():
+            self.con.execute('DROP {} "{}"'.format('VIEW' if kind == 'VIEW' else 'TABLE', name))
+        if isinstance(source, (str, os.PathLike)):
+            self.con.execute("CREATE {} \"{}\" AS SELECT * FROM read_parquet('{}')".format(
+                'TABLE' if copy else 'VIEW', name, str(source).replace("'", "''")))
+        elif copy:
+            self.con.register('_source', source)
+            self.con.execute('CREATE TABLE "{}" AS SELECT * FROM _source'.format(name))
+            self.con.unregister('_source')
+        else:
+            self.con.register(name, source)
+            self._registered.add(name)
+
+    def register_tables(self, tables, copy=False):
+        """Register a dictionary of `{table name: data frame or Parquet file}`"""
+        for name, source in tables.items():
+            self.register(name, source, copy=copy)
+
+    @classmethod
+    def from_engine(cls, engine, tables=None, **options):
+        """Copy tables (all of them by default) from a database into a new DuckDB backend"""
+        duck = cls(**options)
+        if tables is None:
+            tables = ServerBackend(engine).tables()
+        for table in tables:
+            duck.register(table, read_arrow('SELECT * FROM {}'.format(table), engine), copy=True)
+        return duck
+
+    def tables(self):
+        return [row[0] for row in self.con.execute('SHOW TABLES').fetchall()]
+
+    def _sql(self, sql, params):
+        # Queries written for psycopg double the % signs and name parameters %(name)s
+        sql = _NAMED.sub(r'$\1', sql).replace('%%', '%')
+        return sql.strip().rstrip(';'), params
+
+    def query(self, sql, params=None):
+        """Run a query and return the result as a data frame"""
+        sql, params = self._sql(sql, params)
+        return self.con.execute(sql, params).df()
+
+    def execute(self, sql, params=None):
+        """Run a statement that changes the data, such as `INSERT`, `UPDATE`, or `DELETE`"""
+        sql, params = self._sql(sql, params)
+        self.con.execute(sql, params)
+
+    def close(self):
+        self.con.close()
+
+
+def read_sql_query(sql, con, params=None):
+    """`pd.read_sql_query()` that also takes a backend as `con`"""
+    if isinstance(con, (ServerBackend, DuckDBBackend)):
+        return con.query(sql, params)
+    return pd.read_sql_query(sql, con=con, params=params)
+
+
+def notebook_queries(path, tables=None):
+    """Return the SQL queries a notebook reads with `pd.read_sql_query()`, by cell number
+
+    With `tables`, only queries that use no other tables are kept.
+    """
+    with open(path, encoding='utf-8') as f:
+        cells = json.load(f)['cells']
+    queries = {}
+    for i, cell in enumerate(cells):
+        source = ''.join(cell['source'])
+        if cell['cell_type'] != 'code' or 'read_sql_query(myquery' not in source:
+            continue
+        match = re.search(r'myquery\s*=\s*("""|\'\'\')(.*?)\1', source, re.S)
+        if not match:
+            continue
+        sql = match.group(2).strip()
+        used = {name.lower() for name in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)', sql, re.I)}
+        if tables is None or used <= {t.lower() for t in tables}:
+            queries['cell{}'.format(i)] = sql
+    return queries
+
+
+def _comparable(df):
+    """Sort the rows and make every number a rounded float, so results that differ only in
+    row order, number type, or rounding match"""
+    df = df.copy()
+    df.columns = [str(c).lower() for c in df.columns]
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = df[column].astype('float64').round(6)
+    text = df.astype(str)
+    return text.sort_values(list(text.columns)).reset_index(drop=True)
+
+
+def _time(backend, sql, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = backend.query(sql)
+        seconds.append(time.perf_counter() - start)
+    return percentile(sorted(seconds), 50), result
+
+
+def compare(queries, first, second, repeat=3):
+    """Time a dictionary of named queries on two backends and check they return the same rows
+
+    Returns the median seconds on each backend over `repeat` runs, how many
+    times faster the second one is, the number of rows, and whether the
+    results match (ignoring row order, column type, and float rounding). A
+    query that fails on a backend gets the error instead of a time.
+    """
+    rows = []
+    for label, sql in queries.items():
+        row = {'query': label}
+        results = {}
+        for backend in (first, second):
+            try:
+                row[backend.name + '_s'], results[backend.name] = _time(backend, sql, repeat)
+            except Exception as e:
+                row[backend.name + '_s'] = float('nan')
+                row[backend.name + '_error'] = str(e).splitlines()[0]
+        if len(results) == 2:
+            a, b = results.values()
+            row['rows'] = len(a)
+            row['same'] = a.shape == b.shape and \
+                _comparable(a).values.tolist() == _comparable(b).values.tolist()
+            row['speedup'] = round(row[first.name + '_s'] / row[second.name + '_s'], 1)
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('query')
@@ -0,0 +1,278 @@
+"""Pull several fields out of an HTML page in one pass
+
+`wnrn_spider()` in chapter 5 asks `BeautifulSoup()` to build a tree of every tag
+on the page, and then searches the whole tree four times, once each for
+`span.artist`, `span.song`, `span.release`, and `td.spin-time`. An `Extractor`
+is given all of the fields it needs up front, as CSS-style selectors:
+
+    fields = {'time': 'td.spin-time',
+              'artist': 'span.artist',
+              'song': 'span.song',
+              'album': 'span.release',
+              'link': ('div.recent-playlists a', 'href')}
+    wnrn = Extractor(fields)
+    wnrn.extract(r.text)
+
+It reads the page once with lxml's C parser and never builds a tree: each tag is
+checked against the selectors as the parser reaches it, and only the text of the
+matching tags is kept. A field given as `(selector, attribute)` collects the
+value of that attribute instead of the text.
+
+The selectors can use tag names, `.class`, `#id`, `[attribute]`, and
+`[attribute=value]`, and a space between two selectors means "inside of", as
+in `div.recent-playlists a`.
+
+For very large pages, `stream_url()` downloads the page in chunks and feeds
+them to the parser as they arrive, yielding each row as soon as it is complete:
+
+    archive = Extractor(fields, row='tr')
+    for row in stream_url(url, archive):
+        ...
+"""
+
+import re
+import time
+import tracemalloc
+from collections import deque
+
+import requests
+from lxml import etree
+
+_SIMPLE = re.compile(r'([a-zA-Z][\w-]*)|\.([\w-]+)|#([\w-]+)|\[([\w-]+)(?:=["\']?([^"\'\]]*)["\']?)?\]')
+
+
+def compile_selector(selector):
+    """Turn a selector like `div.recent-playlists a[href]` into a list of tests, outermost first"""
+    compiled = []
+    for part in selector.split():
+        tag, classes, attrs = None, set(), []
+        pos = 0
+        for m in _SIMPLE.finditer(part):
+            if m.start() != pos:
+                break
+            pos = m.end()
+            if m.group(1):
+                tag = m.group(1).lower()
+            elif m.group(2):
+                classes.add(m.group(2))
+            elif m.group(3):
+                attrs.append(('id', m.group(3)))
+            else:
+                attrs.append((m.group(4), m.group(5)))
+        if pos != len(part):
+            raise ValueError("unsupported selector: {!r}".format(selector))
+        compiled.append((tag, frozenset(classes), tuple(attrs)))
+    return compiled
+
+
+def _matches(test, element):
+    tag, classes, attrs = test
+    name, element_classes, attrib = element
+    if tag is not None and tag != name:
+        return False
+    if classes and not classes <= element_classes:
+        return False
+    for key, value in attrs:
+        if key not in attrib or (value is not None and attrib[key] != value):
+            return False
+    return True
+
+
+def _matches_path(tests, stack):
+    if not _matches(tests[-1], stack[-1]):
+        return False
+    i = len(stack) - 2
+    for test in reversed(tests[:-1]):
+        while i >= 0 and not _matches(test, stack[i]):
+            i -= 1
+        if i < 0:
+            return False
+        i -= 1
+    return True
+
+
+class _Target:
+    """Receives tags and text from the lxml parser and keeps the ones we asked for
+
+    With `keep=False` nothing is kept: values are only passed to `on_value`,
+    and rows to `on_row`, so memory does not grow with the size of the page.
+    """
+
+    def __init__(self, fields, row=None, on_value=None, on_row=None, keep=True):
+        self.fields = fields
+        self.row = row
+        self.results = {name: [] for name, _, _ in fields}
+        self.counts = {name: 0 for name, _, _ in fields}
+        self.rows = 0
+        self.on_value = on_value
+        self.on_row = on_row
+        self.keep = keep
+        self.stack = []
+        self.open = []
+        self.row_depth = None
+        self.filled = set()
+        self.current = {}
+
+    def _slot(self, name):
+        # Keep a place in line, so values come out in page order even when
+        # an attribute value is known before the text of an earlier tag
+        if self.keep:
+            self.results[name].append(None)
+        self.counts[name] += 1
+        return self.counts[name] - 1
+
+    def _emit(self, name, index, value):
+        if self.keep:
+            self.results[name][index] = value
+        if self.row is not None:
+            self.current[name] = value
+        if self.on_value is not None:
+            self.on_value(name, index, value)
+
+    def start(self, tag, attrib):
+        element = (tag.lower() if isinstance(tag, str) else tag,
+                   frozenset(attrib.get('class', '').split()), attrib)
+        self.stack.append(element)
+        if self.row is not None:
+            if self.row_depth is None and _matches_path(self.row, self.stack):
+                # Every field gets a value for every row, None if it is missing
+                self.row_depth = len(self.stack)
+                self.filled = set()
+                self.current = {}
+                self.row_index = self.rows
+                self.rows += 1
+                if self.keep:
+                    for values in self.results.values():
+                        values.append(None)
+            if self.row_depth is None:
+                return
+        for name, tests, attribute in self.fields:
+            if name in self.filled or not _matches_path(tests, self.stack):
+                continue
+            if self.row is None:
+                index = self._slot(name)
+            else:
+                index = self.row_index
+                self.filled.add(name)
+            if attribute is not None:
+                self._emit(name, index, attrib.get(attribute))
+            else:
+                self.open.append((name, index, len(self.stack), []))
+
+    def data(self, text):
+        for capture in self.open:
+            capture[3].append(text)
+
+    def end(self, tag):
+        depth = len(self.stack)
+        while self.open and self.open[-1][2] == depth:
+            name, index, _, pieces = self.open.pop()
+            self._emit(name, index, ''.join(pieces) or None)
+        if depth == self.row_depth:
+            self.row_depth = None
+            if self.on_row is not None:
+                self.on_row({name: self.current.get(name) for name in self.results})
+        if self.stack:
+            self.stack.pop()
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        while self.stack:
+            self.end(None)
+        return self.results
+
+
+class Extractor:
+    """Extract named fields from HTML pages in a single pass with lxml
+
+    If `row` is a selector, such as `tr`, the page is read one row at a time:
+    each field takes the first match inside each row, and is None when a row
+    has no match, so every field has one value per row.
+    """
+
+    def __init__(self, fields, row=None):
+        self.fields = []
+        for name, spec in fields.items():
+            selector, attribute = spec if isinstance(spec, (tuple, list)) else (spec, None)
+            self.fields.append((name, compile_selector(selector), attribute))
+        self.row = compile_selector(row) if row else None
+
+    def parser(self, on_value=None):
+        """Return an lxml parser that collects the fields from whatever it is fed"""
+        return etree.HTMLParser(target=_Target(self.fields, self.row, on_value))
+
+    def extract(self, html):
+        """Return a dictionary with a list of values for each field"""
+        parser = self.parser()
+        parser.feed(html)
+        return parser.close()
+
+    def iter_extract(self, chunks, encoding=None):
+        """Yield what the page contains while it is still arriving, from an iterable of chunks
+
+        With a `row`, yields one dictionary per row as soon as the row's closing
+        tag is read; otherwise yields `(field, value)` pairs as each matching
+        tag closes. Nothing else is kept, so the memory used does not grow with
+        the length of the page.
+        """
+        ready = deque()
+        if self.row:
+            target = _Target(self.fields, self.row, on_row=ready.append, keep=False)
+        else:
+            target = _Target(self.fields, keep=False,
+                             on_value=lambda name, index, value: ready.append((name, value)))
+        parser = etree.HTMLParser(target=target, encoding=encoding)
+        for chunk in chunks:
+            parser.feed(chunk)
+            while ready:
+                yield ready.popleft()
+        parser.close()
+        while ready:
+            yield ready.popleft()
+
+
+def stream_url(url, extractor, session=None, headers=None, chunk_size=64 * 1024, timeout=30):
+    """Download a page in chunks and yield what `extractor.iter_extract()` finds as it arrives
+
+    The page is never held in memory as a whole, as text or as a tree, and the
+    first rows are ready before the download has finished.
+    """
+    get = session.get if session is not None else requests.get
+    with get(url, headers=headers, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        # Use the encoding only if the server names one; otherwise lxml reads the page's <meta> tag
+        content_type = r.headers.get('Content-Type', '').lower()
+        encoding = r.encoding if 'charset' in content_type else None
+        yield from extractor.iter_extract(r.iter_content(chunk_size), encoding)
+
+
+def benchmark(html, fields, repeat=20):
+    """Compare `BeautifulSoup()` plus one `find_all()` per field with an `Extractor`
+
+    `fields` must be plain selectors of the form `tag.class`, which is what
+    `find_all(tag, class)` understands. Returns the seconds per page and the peak
+    memory per page for each approach.
+    """
+    from bs4 import BeautifulSoup
+
+    def with_soup():
+        soup = BeautifulSoup(html, 'lxml')
+        return {name: [t.string for t in soup.find_all(*selector.split('.', 1))]
+                for name, selector in fields.items()}
+
+    extractor = Extractor(fields)
+    results = {}
+    for label, run in (('beautifulsoup', with_soup), ('extractor', lambda: extractor.extract(html))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        seconds = (time.perf_counter() - start) / repeat
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[label] = {'seconds_per_page': seconds, 'peak_bytes_per_page': peak}
+    results['speedup'] = results['beautifulsoup']['seconds_per_page'] / results['extractor']['seconds_per_page']
+    return results
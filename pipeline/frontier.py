@@ -0,0 +1,199 @@
+"""Discover playlist pages by following links, visiting each page only once
+
+Chapter 5 finds more playlists by reading the links in the "recent-playlists"
+box of a single page:
+
+    wnrn_url = [pl['href'] for pl in recent_atags if "/pl/" in pl['href']]
+
+To collect a station's whole archive we have to keep following links from the
+pages we find, which raises three problems: the same playlist is linked from
+many pages, the same page can be written as several different URLs, and the
+crawl has to stop somewhere. A `Frontier` holds the URLs waiting to be visited
+in a priority queue (by default the pages closest to the start come first), and
+it
+
+1. puts every URL in a canonical form with `canonicalize()`, so that
+   `HTTPS://Spinitron.com:443/WNRN/pl/1/?b=2&a=1#top` and
+   `https://spinitron.com/WNRN/pl/1/?a=1&b=2` count as the same page;
+2. remembers every URL it has ever queued in a `BloomFilter`, which takes a
+   fixed amount of memory (about 2.4MB for a million URLs) no matter how long
+   the URLs are;
+3. drops links that are more than `max_depth` clicks away from the start.
+
+`iter_frontier()` runs the crawler from `pipeline.crawler` on the frontier,
+adding the links on every page it parses:
+
+    from pipeline.frontier import Frontier, iter_frontier
+    from pipeline.wnrn import parse_playlist, playlist_links
+    frontier = Frontier(max_depth=3)
+    frontier.add('https://spinitron.com/WNRN')
+    for url, depth, columns in iter_frontier(frontier, parse_playlist, playlist_links):
+        ...
+
+`Spider.crawl()` in `pipeline.spider` does the same for a spider spec.
+
+A Bloom filter can be wrong in one direction: now and then (with probability
+`error_rate`) it says it has seen a URL that it has not, and that page is skipped.
+It never says a URL is new when it has been queued before, so no page is visited
+twice.
+"""
+
+import functools
+import hashlib
+import heapq
+import itertools
+import math
+import posixpath
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from pipeline.crawler import iter_crawl
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+
+def canonicalize(url, base=None):
+    """Return one standard spelling of a URL, resolved against `base` if it is relative
+
+    The scheme and host are lowercased, default ports, fragments, and tracking
+    parameters like `utm_source` are removed, `.` and `..` are resolved in the
+    path, a trailing slash is dropped, and the query parameters are sorted.
+    """
+    if base is not None:
+        url = urljoin(base, url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = '{}:{}'.format(host, parts.port)
+    path = posixpath.normpath(parts.path) if parts.path else '/'
+    if path.startswith('//'):
+        path = '/' + path.lstrip('/')
+    if path != '/' and path.endswith('/'):
+        path = path.rstrip('/')
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.startswith(TRACKING_PARAMS))
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+class BloomFilter:
+    """A set of strings that only answers "probably seen" or "definitely not seen"
+
+    The size is fixed when it is created, from the number of items it should
+    hold and the chance of a false "probably seen" that we are willing to accept.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=1e-4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Two hashes from one digest give as many positions as we need
+        digest = hashlib.blake2b(item.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item):
+        """Add an item; return True if it was not in the filter before"""
+        new = False
+        for p in self._positions(item):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+class Frontier:
+    """A priority queue of URLs to visit that never queues the same URL twice
+
+    `priority` is a function of `(url, depth)`; lower numbers are visited
+    first. By default it is the depth, so the crawl goes breadth first. `allow`
+    is a function of the canonical URL that returns False for links that
+    should not be followed at all.
+    """
+
+    def __init__(self, max_depth=None, priority=None, allow=None,
+                 capacity=1000000, error_rate=1e-4):
+        self.max_depth = max_depth
+        self.priority = priority or (lambda url, depth: depth)
+        self.allow = allow
+        self.seen = BloomFilter(capacity, error_rate)
+        self.queue = []
+        self._order = itertools.count()
+        self.stats = {'queued': 0, 'duplicate': 0, 'too_deep': 0, 'not_allowed': 0}
+
+    def add(self, url, depth=0, base=None):
+        """Queue a URL found `depth` links away from the start; return True if it was new"""
+        if self.max_depth is not None and depth > self.max_depth:
+            self.stats['too_deep'] += 1
+            return False
+        url = canonicalize(url, base)
+        if self.allow is not None and not self.allow(url):
+            self.stats['not_allowed'] += 1
+            return False
+        if not self.seen.add(url):
+            self.stats['duplicate'] += 1
+            return False
+        heapq.heappush(self.queue, (self.priority(url, depth), next(self._order), depth, url))
+        self.stats['queued'] += 1
+        return True
+
+    def pop(self):
+        """Return the `(url, depth)` that should be visited next"""
+        _, _, depth, url = heapq.heappop(self.queue)
+        return url, depth
+
+    def __len__(self):
+        return len(self.queue)
+
+
+def _parse_with_links(parse, links, html):
+    return parse(html), links(html)
+
+
+def iter_frontier(frontier, parse, links, max_pages=None, batch_size=100, **crawl_args):
+    """Crawl the frontier until it is empty, yielding `(url, depth, columns)` for every page
+
+    `links` is a function that takes the HTML of a page and returns the links to
+    follow from it; relative links are resolved against the page's URL. Pages
+    are crawled `batch_size` at a time with `pipeline.crawler.iter_crawl()`,
+    which takes the rest of the keyword arguments. A page that fails is yielded
+    with the exception instead of its columns.
+
+    A `cache` is not accepted: the rows it keeps for a page that has not
+    changed say nothing about the page's links, so the crawl would stop there.
+    """
+    if crawl_args.get('cache') is not None:
+        raise TypeError("iter_frontier() does not take a cache: an unchanged page's links are not kept")
+    return _iter_frontier(frontier, parse, links, max_pages, batch_size, crawl_args)
+
+
+def _iter_frontier(frontier, parse, links, max_pages, batch_size, crawl_args):
+    parse_page = functools.partial(_parse_with_links, parse, links)
+    crawled = 0
+    while frontier and (max_pages is None or crawled < max_pages):
+        n = batch_size if max_pages is None else min(batch_size, max_pages - crawled)
+        batch = dict(frontier.pop() for _ in range(min(n, len(frontier))))
+        crawled += len(batch)
+        for url, result in iter_crawl(list(batch), parse=parse_page, **crawl_args):
+            depth = batch[url]
+            if isinstance(result, Exception):
+                yield url, depth, result
+                continue
+            columns, found = result
+            for link in found:
+                frontier.add(link, depth + 1, base=url)
+            yield url, depth, columns
@@ -0,0 +1,510 @@
+"""Propose, and create, the indexes and keys that the chapter 7 queries need
+
+Chapter 6 puts the wine tables into the database with `to_sql()`, which makes
+no primary keys, no foreign keys, and no indexes, so every query in chapter 7
+that joins `reviews` to `locations` on `location_id`, filters on `country` or
+`points`, or groups by `winery_id` reads every row of every table it touches.
+The index advisor looks at a set of queries (a workload) and
+
+1. finds the tables, the join columns, the columns compared in `WHERE`, and the
+   `GROUP BY` and `ORDER BY` columns of each query;
+2. runs `EXPLAIN` on each query to see which tables it scans from top to bottom;
+3. proposes a primary key for the column a join looks up in another table (when
+   its values are unique), a foreign key from the column on the other side, and
+   an index for the filters and groups of each table, which also covers the
+   other columns the query reads from that table when there are only a few;
+4. creates them if we ask it to, and times every query before and after.
+
+    from pipeline.indexadvisor import tune
+    proposals, timings = tune(engine)
+
+runs the chapter 7 queries in `WINE_QUERIES`. To tune other queries, pass a
+dictionary of them, or record the queries a notebook runs:
+
+    from pipeline.indexadvisor import capture, advise
+    with capture(engine) as workload:
+        pd.read_sql_query(myquery, con=engine)
+    advise(engine, workload)
+
+`con` is a SQLAlchemy engine or a `sqlite3` connection. SQLite cannot add keys to
+a table that already exists, so there the primary key becomes a unique index and
+the foreign key is skipped. The advisor reads the SQL with regular expressions,
+not a full parser: it understands the joins and filters that chapter 7 writes,
+and ignores what it cannot place, such as columns inside functions like
+`LOWER(description)`, which no plain index can help with anyway.
+"""
+
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from pipeline.bulkload import _dialect, _quote
+from pipeline.timing import percentile
+
+# The queries on the wine tables from chapter 7 that an index can help
+WINE_QUERIES = {
+    'join_all': """
+        SELECT r.title, r.variety, r.price, r.points, l.country, t.taster_name
+        FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        INNER JOIN tasters t ON r.taster_id = t.taster_id""",
+    'france_voss_100': """
+        SELECT r.title, r.variety, r.price
+        FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        INNER JOIN tasters t ON r.taster_id = t.taster_id
+        WHERE l.country='France' AND t.taster_name='Roger Voss' AND r.points=100""",
+    'points_price_or_virginia': """
+        SELECT r.title, r.variety, r.price, r.points, l.country, l.province
+        FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        WHERE r.points >= 90 AND (r.price BETWEEN 5 AND 10 OR l.province = 'Virginia')""",
+    'virginia_by_points': """
+        SELECT r.title, r.points, r.price FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        WHERE province = 'Virginia'
+        ORDER BY points DESC, price ASC""",
+    'country_points': """
+        SELECT l.country, ROUND(AVG(points),1) as average_points, COUNT(*) as numberofwines
+        FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        GROUP BY l.country
+        ORDER BY average_points DESC""",
+    'riesling_by_country': """
+        SELECT l.country, ROUND(AVG(points),1) as average_points, COUNT(*) as numberofwines
+        FROM reviews r
+        INNER JOIN locations l ON r.location_id = l.location_id
+        WHERE r.variety = 'Riesling'
+        GROUP BY l.country
+            HAVING COUNT(*) >= 100
+        ORDER BY average_points DESC""",
+    'big_wineries': """
+        SELECT winery_id, title, variety, points, price FROM reviews
+        WHERE winery_id IN (
+            SELECT winery_id FROM reviews r
+            GROUP BY winery_id
+                HAVING COUNT(*) >= 100)""",
+    'best_of_winery': """
+        SELECT r.title, r.variety, r.points, r.price FROM reviews r
+        INNER JOIN (
+            SELECT winery_id, MAX(points) as maxpoints
+            FROM reviews
+            GROUP BY winery_id) b
+            ON r.winery_id = b.winery_id
+        WHERE r.points = b.maxpoints""",
+}
+
+_WORDS = ('ON', 'WHERE', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'JOIN',
+          'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'USING', 'OUTER', 'UNION', 'SELECT')
+_TABLE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.I)
+_PAIR = re.compile(r'(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)')
+_COMPARE = re.compile(r'(?:(\w+)\.)?(\w+)\s*(<>|!=|>=|<=|=|>|<|\bNOT\s+IN\b|\bIN\b|\bBETWEEN\b'
+                      r'|\bNOT\s+LIKE\b|\bLIKE\b|\bIS\b)', re.I)
+_CLAUSE = r'(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bHAVING\b|\bSELECT\b|\)|;|$)'
+_REFERENCE = re.compile(r'(?:(\w+)\.)?(\w+|\*)')
+_EQUAL = {'=', 'IN', 'IS'}
+_RANGE = {'>', '<', '>=', '<=', 'BETWEEN'}
+
+
+def _execute(con, sql):
+    """Run a statement and return its rows as dictionaries"""
+    if isinstance(con, sqlite3.Connection):
+        cursor = con.execute(sql)
+        names = [d[0] for d in cursor.description or []]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        con.commit()
+        return rows
+    with con.begin() as conn:
+        result = conn.exec_driver_sql(sql)
+        return [dict(row) for row in result.mappings()] if result.returns_rows else []
+
+
+def _schema(con):
+    """Return the columns, primary keys, indexes, and foreign keys of every table"""
+    schema = {'columns': {}, 'primary': {}, 'indexes': {}, 'unique': {}, 'foreign': {}}
+    if isinstance(con, sqlite3.Connection):
+        tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        for table in tables:
+            q = _quote(table, 'sqlite')
+            info = con.execute('PRAGMA table_info({})'.format(q)).fetchall()
+            schema['columns'][table] = {row[1]: row[2] for row in info}
+            schema['primary'][table] = tuple(row[1] for row in sorted(info, key=lambda r: r[5]) if row[5])
+            indexes = []
+            for index in con.execute('PRAGMA index_list({})'.format(q)).fetchall():
+                info = con.execute('PRAGMA index_info({})'.format(_quote(index[1], 'sqlite')))
+                indexes.append((tuple(r[2] for r in info), index[2]))
+            schema['indexes'][table] = [cols for cols, _ in indexes]
+            schema['unique'][table] = [cols for cols, unique in indexes if unique]
+            schema['foreign'][table] = [(row[3], row[2], row[4])
+                                        for row in con.execute('PRAGMA foreign_key_list({})'.format(q))]
+        return schema
+    from sqlalchemy import inspect
+    inspector = inspect(con)
+    for table in inspector.get_table_names():
+        schema['columns'][table] = {c['name']: str(c['type']) for c in inspector.get_columns(table)}
+        schema['primary'][table] = tuple(inspector.get_pk_constraint(table).get('constrained_columns') or ())
+        indexes = inspector.get_indexes(table)
+        schema['indexes'][table] = [tuple(c for c in index['column_names'] if c) for index in indexes]
+        schema['unique'][table] = [tuple(index['column_names']) for index in indexes if index['unique']]
+        schema['foreign'][table] = [(c, fk['referred_table'], r)
+                                    for fk in inspector.get_foreign_keys(table)
+                                    for c, r in zip(fk['constrained_columns'], fk['referred_columns'])]
+    return schema
+
+
+def _parse(query, columns):
+    """Find the tables, joins, filters, groups, and columns a query uses
+
+    Every column is returned as a (table, column) pair; a column written without
+    a table alias belongs to the one table in the query that has it.
+    """
+    text = re.sub(r"'(?:[^']|'')*'", "''", query)
+    aliases = {}
+    for table, alias in _TABLE.findall(text):
+        if table in columns:
+            aliases[table] = table
+            if alias and alias.upper() not in _WORDS:
+                aliases[alias] = table
+    tables = set(aliases.values())
+
+    def resolve(alias, column):
+        if alias:
+            table = aliases.get(alias)
+            return (table, column) if table and column in columns[table] else None
+        owners = [t for t in tables if column in columns[t]]
+        return (owners[0], column) if len(owners) == 1 else None
+
+    joins = []
+    for a, x, b, y in _PAIR.findall(text):
+        left, right = resolve(a, x), resolve(b, y)
+        if left and right and left[0] != right[0]:
+            joins.append((left, right))
+    equal, ranges = [], []
+    for where in re.finditer(r'\bWHERE\b' + _CLAUSE, text, re.I | re.S):
+        for alias, column, op in _COMPARE.findall(_PAIR.sub(' ', where.group(1))):
+            found = resolve(alias, column)
+            op = ' '.join(op.upper().split())
+            if found and op in _EQUAL and found not in equal:
+                equal.append(found)
+            elif found and op in _RANGE and found not in ranges:
+                ranges.append(found)
+    grouped, ordered = [], []
+    for clause, found in (('GROUP', grouped), ('ORDER', ordered)):
+        for match in re.finditer(r'\b{}\s+BY\b'.format(clause) + _CLAUSE, text, re.I | re.S):
+            for item in match.group(1).split(','):
+                words = item.split()
+                ref = _REFERENCE.fullmatch(words[0]) if words else None
+                column = ref and resolve(*ref.groups())
+                if column and column not in found:
+                    found.append(column)
+    used = {table: set() for table in tables}
+    star = set()
+    for alias, column in _REFERENCE.findall(text):
+        if column == '*':
+            if alias and alias in aliases:
+                star.add(aliases[alias])
+            elif not alias and re.search(r'SELECT\s+\*', text, re.I):
+                star.update(tables)
+            continue
+        found = resolve(alias, column)
+        if found:
+            used[found[0]].add(found[1])
+    return {'aliases': aliases, 'tables': tables, 'joins': joins, 'equal': equal, 'range': ranges,
+            'group': grouped, 'order': ordered, 'used': used, 'star': star}
+
+
+def explain(query, con):
+    """Return the lines of the database's plan for a query"""
+    dialect = _dialect(con)
+    if dialect == 'sqlite':
+        return [row['detail'] for row in _execute(con, 'EXPLAIN QUERY PLAN ' + query)]
+    if dialect == 'mysql':
+        return ['{}: type={} key={} rows={}'.format(row['table'], row['type'], row['key'], row['rows'])
+                for row in _execute(con, 'EXPLAIN ' + query)]
+    return [list(row.values())[0] for row in _execute(con, 'EXPLAIN ' + query)]
+
+
+def full_scans(plan, con, aliases=None):
+    """Return the tables a plan reads from top to bottom"""
+    aliases = aliases or {}
+    patterns = {'sqlite': r'^SCAN (\w+)(?!.*COVERING INDEX)', 'mysql': r'^(\w+): type=ALL\b'}
+    pattern = re.compile(patterns.get(_dialect(con), r'Seq Scan on (\w+)'))
+    scans = set()
+    for line in plan:
+        match = pattern.search(line.strip())
+        # Leave out subqueries in FROM, which have an alias but no table
+        if match and (not aliases or match.group(1) in aliases):
+            scans.add(aliases.get(match.group(1), match.group(1)))
+    return sorted(scans)
+
+
+class _Profiles:
+    """Count rows, missing values, and distinct values of columns, once each"""
+
+    def __init__(self, con):
+        self.con = con
+        self.dialect = _dialect(con)
+        self.counts = {}
+
+    def __call__(self, table, column):
+        if (table, column) not in self.counts:
+            c = _quote(column, self.dialect)
+            row = _execute(self.con, 'SELECT COUNT(*) AS n, COUNT({0}) AS present, '
+                                     'COUNT(DISTINCT {0}) AS distinct_values FROM {1}'.format(
+                                         c, _quote(table, self.dialect)))[0]
+            self.counts[(table, column)] = row
+        return self.counts[(table, column)]
+
+    def unique(self, table, column):
+        row = self(table, column)
+        return row['n'] == row['present'] == row['distinct_values'] and row['n'] > 0
+
+    def orphans(self, table, column, parent, key):
+        q = lambda name: _quote(name, self.dialect)
+        sql = 'SELECT COUNT(*) AS n FROM {0} WHERE {1} IS NOT NULL AND {1} NOT IN (SELECT {3} FROM {2})'
+        return _execute(self.con, sql.format(q(table), q(column), q(parent), q(key)))[0]['n']
+
+
+def _propose(proposals, kind, table, columns, queries, include=(), references=None):
+    key = (kind, table, tuple(columns), tuple(include), references)
+    if key not in proposals:
+        proposals[key] = []
+    for name in queries:
+        if name not in proposals[key]:
+            proposals[key].append(name)
+
+
+def _include(parsed, table, keys, max_columns):
+    """The other columns a query reads from a table, if an index on `keys` can hold them all"""
+    used = sorted(parsed['used'][table] - set(keys))
+    if table in parsed['star'] or len(keys) + len(used) > max_columns:
+        return ()
+    return tuple(used)
+
+
+def _covered(columns, include, indexes, extra=()):
+    """True if one of `indexes` starts with `columns` and holds `include` (or has them in `extra`)"""
+    wanted = len(columns)
+    return any(index[:wanted] == tuple(columns) and set(include) <= set(index) | set(extra)
+               for index in indexes)
+
+
+def _ddl(kind, table, columns, include, references, dialect, types):
+    q = lambda name: _quote(name, dialect)
+    name = '{}_{}_{}'.format({'primary key': 'pk', 'foreign key': 'fk', 'index': 'ix'}[kind],
+                             table, '_'.join(columns + include))[:60]
+    if kind == 'primary key':
+        if dialect == 'sqlite':
+            return 'CREATE UNIQUE INDEX {} ON {} ({})'.format(q(name), q(table), q(columns[0]))
+        return 'ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({})'.format(q(table), q(name), q(columns[0]))
+    if kind == 'foreign key':
+        parent, key = references.split('.')
+        return 'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({})'.format(
+            q(table), q(name), q(columns[0]), q(parent), q(key))
+    if dialect == 'postgresql':
+        extra = ' INCLUDE ({})'.format(', '.join(q(c) for c in include)) if include else ''
+        return 'CREATE INDEX {} ON {} ({}){}'.format(q(name), q(table), ', '.join(q(c) for c in columns),
+                                                     extra)
+    keys = list(columns) + list(include)
+    if dialect == 'mysql':
+        # MySQL can only index the start of a TEXT column, so it cannot cover one
+        text = {c for c in keys if 'TEXT' in types.get(c, '').upper()}
+        keys = [c for c in columns] + [c for c in include if c not in text]
+        return 'CREATE INDEX {} ON {} ({})'.format(q(name), q(table), ', '.join(
+            q(c) + '(100)' if c in text else q(c) for c in keys))
+    return 'CREATE INDEX {} ON {} ({})'.format(q(name), q(table), ', '.join(q(c) for c in keys))
+
+
+def advise(con, workload=None, max_columns=5):
+    """Propose primary keys, foreign keys, and indexes for a dictionary of named queries
+
+    Returns a data frame with one row per proposal: what it is, its table and
+    columns, the queries it helps, the SQL that creates it, and its status,
+    which is 'proposed', 'exists', or 'skipped' with the reason. An index also
+    holds the other columns a query reads from the table (so the query never
+    has to look at the table itself) if that makes it `max_columns` or fewer.
+    """
+    workload = WINE_QUERIES if workload is None else workload
+    dialect = _dialect(con)
+    schema = _schema(con)
+    columns = schema['columns']
+    profiles = _Profiles(con)
+    proposals = {}
+    for name, query in workload.items():
+        parsed = _parse(query, columns)
+        for left, right in parsed['joins']:
+            # The side whose values are unique is the table being looked up
+            if profiles.unique(*right):
+                parent, child = right, left
+            elif profiles.unique(*left):
+                parent, child = left, right
+            else:
+                _propose(proposals, 'index', left[0], [left[1]], [name])
+                _propose(proposals, 'index', right[0], [right[1]], [name])
+                continue
+            _propose(proposals, 'primary key', parent[0], [parent[1]], [name])
+            _propose(proposals, 'foreign key', child[0], [child[1]], [name], references='.'.join(parent))
+            _propose(proposals, 'index', child[0], [child[1]], [name],
+                     include=_include(parsed, child[0], [child[1]], max_columns))
+        for table in parsed['tables']:
+            equal = [c for t, c in parsed['equal'] if t == table]
+            ranges = [c for t, c in parsed['range'] if t == table]
+            grouped = [c for t, c in parsed['group'] if t == table]
+            keys = equal + ranges[:1] if equal or ranges else grouped
+            if keys:
+                _propose(proposals, 'index', table, keys, [name],
+                         include=_include(parsed, table, keys, max_columns))
+
+    # Drop an index when another one on the same table can do everything it does
+    indexes = [key for key in proposals if key[0] == 'index']
+    for key in indexes:
+        for other in indexes:
+            if other != key and other[1] == key[1] and other in proposals and key in proposals \
+                    and _covered(key[2], key[3], [other[2]], other[3]):
+                _propose(proposals, *other[:3], proposals.pop(key), include=other[3])
+                break
+
+    rows = []
+    for (kind, table, cols, include, references), queries in proposals.items():
+        status = 'proposed'
+        if kind == 'primary key':
+            primary = schema['primary'].get(table)
+            if primary == cols or dialect == 'sqlite' and cols in schema['unique'].get(table, []):
+                status = 'exists'
+            elif primary:
+                status = 'skipped: {} already has a primary key'.format(table)
+        elif kind == 'foreign key':
+            parent, key = references.split('.')
+            types = columns[table][cols[0]], columns[parent][key]
+            if (cols[0], parent, key) in schema['foreign'].get(table, []):
+                status = 'exists'
+            elif dialect == 'sqlite':
+                status = 'skipped: SQLite cannot add a foreign key to a table that exists'
+            elif types[0] != types[1]:
+                status = 'skipped: {}.{} is {} but {} is {}'.format(table, cols[0], types[0],
+                                                                   references, types[1])
+            else:
+                orphans = profiles.orphans(table, cols[0], parent, key)
+                if orphans:
+                    status = 'skipped: {} values of {}.{} are not in {}'.format(orphans, table, cols[0],
+                                                                               references)
+        elif _covered(cols, include, schema['indexes'].get(table, []) + [schema['primary'].get(table, ())]):
+            status = 'exists'
+        rows.append({'kind': kind, 'table': table, 'columns': list(cols), 'include': list(include),
+                     'references': references, 'queries': queries, 'status': status,
+                     'ddl': _ddl(kind, table, cols, include, references, dialect, columns[table])})
+    order = {'primary key': 0, 'index': 1, 'foreign key': 2}
+    rows.sort(key=lambda row: order[row['kind']])
+    return pd.DataFrame(rows, columns=['kind', 'table', 'columns', 'include', 'references',
+                                       'queries', 'status', 'ddl'])
+
+
+def apply(con, proposals):
+    """Run the SQL of every proposal whose status is 'proposed', then update the planner's statistics
+
+    Returns a copy of `proposals` with the status set to 'created' or to the
+    error the database gave.
+    """
+    proposals = proposals.copy()
+    dialect = _dialect(con)
+    for i, row in proposals.iterrows():
+        if row['status'] != 'proposed':
+            continue
+        try:
+            _execute(con, row['ddl'])
+            proposals.loc[i, 'status'] = 'created'
+        except Exception as e:
+            proposals.loc[i, 'status'] = 'failed: {}'.format(str(e).splitlines()[0])
+    tables = sorted(set(proposals.loc[proposals['status'] == 'created', 'table']))
+    if dialect == 'sqlite':
+        _execute(con, 'ANALYZE')
+    for table in tables if dialect != 'sqlite' else []:
+        _execute(con, '{} {}'.format('ANALYZE TABLE' if dialect == 'mysql' else 'ANALYZE',
+                                     _quote(table, dialect)))
+    return proposals
+
+
+def _time(con, query, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pd.read_sql_query(query, con)
+        seconds.append(time.perf_counter() - start)
+    return percentile(sorted(seconds), 50)
+
+
+def tune(con, workload=None, create=True, repeat=3, max_columns=5):
+    """Time and explain every query, propose indexes and keys, create them, and time the queries again
+
+    Returns the proposals (see `advise()`) and a data frame with the median
+    seconds of each query over `repeat` runs before and after, and the tables
+    each plan reads from top to bottom. With `create=False` nothing is
+    created and only the times before are filled in.
+
+    A query that needs every row, like `join_all`, gains nothing from an
+    index, and can get slower if the planner chooses to walk an index instead
+    of reading the table; a speedup below 1 shows when that happens.
+    """
+    workload = WINE_QUERIES if workload is None else workload
+    columns = _schema(con)['columns']
+    rows = {}
+    for name, query in workload.items():
+        aliases = _parse(query, columns)['aliases']
+        rows[name] = {'seconds_before': _time(con, query, repeat),
+                      'scans_before': full_scans(explain(query, con), con, aliases)}
+    proposals = advise(con, workload, max_columns)
+    if create:
+        proposals = apply(con, proposals)
+        for name, query in workload.items():
+            aliases = _parse(query, columns)['aliases']
+            plan = explain(query, con)
+            rows[name].update({'seconds_after': _time(con, query, repeat),
+                               'scans_after': full_scans(plan, con, aliases),
+                               'plan_after': plan})
+    timings = pd.DataFrame(rows).T
+    if create:
+        timings['speedup'] = (timings['seconds_before'] / timings['seconds_after']).astype(float).round(1)
+    return proposals, timings
+
+
+def _workload_query(statement):
+    words = statement.lstrip('( \n\t').split(None, 1)
+    return bool(words) and words[0].upper() in ('SELECT', 'WITH') and not re.search(
+        r'\b(sqlite_master|sqlite_schema|information_schema|pg_catalog)\b', statement, re.I)
+
+
+@contextmanager
+def capture(con):
+    """Record the queries run on a connection inside a `with` block, as a workload for `advise()`
+
+    Queries sent with separate parameters are left out, since `EXPLAIN` needs
+    the values.
+    """
+    workload = {}
+
+    def record(statement):
+        statement = statement.strip()
+        if _workload_query(statement) and statement not in workload.values():
+            workload['q{}'.format(len(workload) + 1)] = statement
+
+    if isinstance(con, sqlite3.Connection):
+        con.set_trace_callback(record)
+        try:
+            yield workload
+        finally:
+            con.set_trace_callback(None)
+        return
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if not parameters and not executemany:
+            record(statement)
+
+    event.listen(con, 'before_cursor_execute', before)
+    try:
+        yield workload
+    finally:
+        event.remove(con, 'before_cursor_execute', before)
@@ -0,0 +1,254 @@
+"""Small local HTTP servers that stand in for the APIs used in the book
+
+Code that talks to an API is easier to test, time, and rerun against a server on
+our own machine that answers instantly (or as slowly as we ask it to) and never
+changes its data. A `MockServer` runs in a background thread and answers each
+path with a "route" function:
+
+    with MockServer({'/v1/chat/completions': openai_route}) as server:
+        client = OpenAI(base_url=server.url + '/v1', api_key='test')
+
+`latency` adds a delay to every response, and `error_rate` answers that fraction
+of requests with a 503 error, so we can see how client code copes with a slow or
+unreliable API.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class MockRequest:
+    """The parts of an HTTP request that a route needs"""
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so without this small responses
+    # wait on the TCP delayed acknowledgement timer
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        query = {k: v[0] if len(v) == 1 else v for k, v in parse_qs(parts.query).items()}
+        request = MockRequest(self.command, parts.path, query, self.headers, body)
+        status, headers, content = self.server.mock.respond(request)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections when many clients start at once
+    request_queue_size = 128
+
+
+class MockServer:
+    """Serve `routes`, a dictionary of paths and route functions, on a local port
+
+    A route takes a `MockRequest` and returns a dictionary or list (sent as JSON),
+    a string or bytes (sent as HTML), or a `(status, headers, body)` tuple.
+    """
+
+    def __init__(self, routes, latency=0, error_rate=0, seed=None, host='127.0.0.1', port=0):
+        self.routes = routes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def _delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            return self.random.uniform(*self.latency)
+        return self.latency
+
+    def respond(self, request):
+        with self._lock:
+            self.requests += 1
+            delay = self._delay()
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return 503, {'Content-Type': 'text/plain', 'Retry-After': '0'}, b'Service Unavailable'
+
+        route = self.routes.get(request.path)
+        if route is None:
+            return 404, {'Content-Type': 'text/plain'}, b'Not Found'
+        return _encode(route(request))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _encode(result):
+    if isinstance(result, tuple):
+        status, headers, body = result
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        return status, headers, body
+    if isinstance(result, (dict, list)):
+        return 200, {'Content-Type': 'application/json'}, json.dumps(result).encode('utf8')
+    if isinstance(result, str):
+        result = result.encode('utf8')
+    return 200, {'Content-Type': 'text/html; charset=utf-8'}, result
+
+
+def openai_route(request):
+    """Answer a chat completion request by echoing the last message back"""
+    data = request.json()
+    prompt = data['messages'][-1]['content']
+    answer = 'Echo: ' + prompt
+    prompt_tokens = sum(len(m['content']) for m in data['messages']) // 4 + 1
+    completion_tokens = len(answer) // 4 + 1
+    return {'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': data.get('model', 'mock'),
+            'choices': [{'index': 0,
+                         'message': {'role': 'assistant', 'content': answer},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens,
+                      'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}}
+
+
+def wikipedia_route(request):
+    """Answer a Wikipedia API revisions query like the one in chapter 4"""
+    title = request.query.get('titles', 'University_of_Virginia')
+    content = "{{Infobox university\n| name = " + title + " }}\n" + "Lorem ipsum dolor sit amet. " * 200
+    return {'batchcomplete': True,
+            'query': {'pages': [{'pageid': zlib.crc32(title.encode('utf8')) % 100000,
+                                 'ns': 0,
+                                 'title': title.replace('_', ' '),
+                                 'revisions': [{'slots': {'main': {'contentmodel': 'wikitext',
+                                                                   'contentformat': 'text/x-wiki',
+                                                                   'content': content}}}]}]}}
+
+
+def census_route(request):
+    """Answer a Census population query like the one in chapter 4"""
+    if not request.query.get('key'):
+        return 400, {'Content-Type': 'text/plain'}, 'error: missing key'
+    rows = [['GEO_ID', 'POP', 'state']]
+    rows += [['0400000US{:02d}'.format(s), str(500000 + 123457 * s), '{:02d}'.format(s)]
+             for s in range(1, 57)]
+    return rows
+
+
+def geocode_route(request):
+    """Answer a Google Maps geocoding request the way `googlemaps.Client.geocode()` expects"""
+    address = request.query.get('address', '')
+    h = zlib.crc32(address.encode('utf8'))
+    return {'results': [{'formatted_address': address,
+                         'geometry': {'location': {'lat': 38.0 + (h % 1000) / 10000,
+                                                   'lng': -78.5 - (h % 997) / 10000},
+                                      'location_type': 'ROOFTOP'},
+                         'place_id': 'mock{}'.format(h % 100000),
+                         'types': ['street_address']}],
+            'status': 'OK'}
+
+
+def twitter_search_route(request, total=1000, per_page=100):
+    """Answer a Twitter search the way tweepy's cursor pages through it, newest first"""
+    max_id = int(request.query.get('max_id', total))
+    count = int(request.query.get('count', per_page))
+    ids = range(min(max_id, total), max(0, min(max_id, total) - count), -1)
+    return {'statuses': [{'id': i,
+                          'text': 'Tweet number {} #uva'.format(i),
+                          'created_at': 'Mon Aug 03 12:00:00 +0000 2020',
+                          'user': {'screen_name': 'user{}'.format(i % 50)}} for i in ids],
+            'search_metadata': {'count': count}}
+
+
+def fixture_routes(folder):
+    """Serve every saved HTML page in `folder` at its path, without the .html ending
+
+    A page saved as `fixtures/WNRN/pl/123/Title.html` is served at
+    `/WNRN/pl/123/Title`, so links copied from the real site work on the mock.
+    Each page has an `ETag`, and a request with a matching `If-None-Match`
+    header gets a "304 Not Modified" answer.
+    """
+    routes = {}
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                content = f.read()
+            url_path = '/' + os.path.relpath(path, folder).replace(os.sep, '/')
+            if url_path.endswith('.html'):
+                url_path = url_path[:-len('.html')]
+            routes[url_path] = _fixture_route(content)
+    return routes
+
+
+def _fixture_route(content):
+    etag = '"{:08x}"'.format(zlib.crc32(content))
+
+    def route(request):
+        # Answer conditional requests the way a real web server would
+        if request.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'Content-Type': 'text/html; charset=utf-8', 'ETag': etag}, content
+
+    return route
+
+
+def save_fixture(folder, url, html):
+    """Save a downloaded page so `fixture_routes()` can serve it later"""
+    path = urlsplit(url).path.strip('/') or 'index'
+    filename = os.path.join(folder, *path.split('/')) + '.html'
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w', encoding='utf8') as f:
+        f.write(html)
+    return filename
@@ -0,0 +1,147 @@
+"""Load a data frame into MongoDB in parallel batches, without going through JSON
+
+Chapter 6 turns the wine data frame into documents by writing it out as JSON
+text and reading that text back in,
+
+    wine_json_text = total.to_json(orient="records")
+    wine_json = json.loads(wine_json_text)
+    allwine = winecollection.insert_many(wine_json)
+
+so all 130,000 reviews exist three times over (as a data frame, as one long
+string, and as dictionaries), and then are sent in one ordered `insert_many()`,
+which stops at the first bad document and waits for every batch before sending
+the next one. `bulk_insert()` instead
+
+1. builds each document straight from the columns of the data frame and
+   encodes it to BSON (MongoDB's format) once, as a `RawBSONDocument`, so
+   pymongo sends the bytes without encoding them again;
+2. cuts the documents into batches of at most `batch_bytes` bytes;
+3. sends the batches from `workers` threads at once with `ordered=False`, so
+   the server can write them in any order and one bad document does not stop
+   the rest.
+
+    from pipeline.mongoload import bulk_insert
+    bulk_insert(winecollection, total)
+
+Missing values become `null`, as they do in the JSON from `to_json()`, unless
+`drop_missing=True` leaves them out of the document. It also works with a
+`mongomock` collection for testing, in which case the documents are plain
+dictionaries.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bson
+import pandas as pd
+from bson.raw_bson import RawBSONDocument
+
+
+def _column_values(values):
+    """Return a column as a list of values BSON can store, with None for missing values"""
+    if pd.api.types.is_timedelta64_dtype(values):
+        values = values.dt.total_seconds()
+    if not values.hasnans:
+        return values.tolist()
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def frame_documents(df, drop_missing=False):
+    """Yield one dictionary per row of a data frame, built column by column"""
+    names = [str(name) for name in df.columns]
+    columns = [_column_values(values) for _, values in df.items()]
+    for row in zip(*columns):
+        if drop_missing:
+            yield {name: value for name, value in zip(names, row) if value is not None}
+        else:
+            yield dict(zip(names, row))
+
+
+def _is_pymongo(collection):
+    try:
+        from pymongo.collection import Collection
+    except ImportError:
+        return False
+    return isinstance(collection, Collection)
+
+
+def encode_batches(df, batch_bytes=4 * 1024 * 1024, batch_docs=10000, raw=True, drop_missing=False):
+    """Yield lists of documents whose encoded size adds up to at most `batch_bytes`
+
+    With `raw=True` each document is encoded to BSON once and wrapped in a
+    `RawBSONDocument`; the server gives it an `_id` when it is inserted.
+    """
+    batch = []
+    size = 0
+    for doc in frame_documents(df, drop_missing):
+        data = bson.encode(doc)
+        if batch and (size + len(data) > batch_bytes or len(batch) >= batch_docs):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(RawBSONDocument(data) if raw else doc)
+        size += len(data)
+    if batch:
+        yield batch
+
+
+def bulk_insert(collection, df, workers=4, batch_bytes=4 * 1024 * 1024, batch_docs=10000,
+                drop_missing=False):
+    """Insert every row of a data frame as a document, with several batches in flight at once
+
+    Returns the number of documents inserted, the seconds it took, documents
+    per second, the number of batches, and the write errors (if any) of
+    documents that could not be inserted.
+    """
+    raw = _is_pymongo(collection)
+    inserted = 0
+    errors = []
+    lock = threading.Lock()
+    # Allow a few batches to wait for a worker, but do not encode the whole frame ahead
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def insert(batch):
+        nonlocal inserted
+        try:
+            result = collection.insert_many(batch, ordered=False)
+            # pymongo records no ids for RawBSONDocuments, so count what was sent
+            n, failed = len(batch) if raw else len(result.inserted_ids), []
+        except Exception as e:
+            details = getattr(e, 'details', None)
+            if details is None:
+                raise
+            n, failed = details.get('nInserted', 0), details.get('writeErrors', [])
+        finally:
+            slots.release()
+        with lock:
+            inserted += n
+            errors.extend(failed)
+
+    start = time.perf_counter()
+    batches = 0
+    with ThreadPoolExecutor(workers) as pool:
+        futures = []
+        for batch in encode_batches(df, batch_bytes, batch_docs, raw=raw, drop_missing=drop_missing):
+            slots.acquire()
+            futures.append(pool.submit(insert, batch))
+            batches += 1
+        for future in futures:
+            future.result()
+    seconds = time.perf_counter() - start
+    return {'documents': inserted, 'seconds': round(seconds, 3),
+            'docs_per_s': round(inserted / seconds) if seconds else None,
+            'batches': batches, 'errors': errors}
+
+
+def json_insert(collection, df):
+    """Insert a data frame the way chapter 6 does, through `to_json()` and `json.loads()`"""
+    import json
+
+    start = time.perf_counter()
+    wine_json = json.loads(df.to_json(orient="records"))
+    result = collection.insert_many(wine_json)
+    seconds = time.perf_counter() - start
+    return {'documents': len(result.inserted_ids), 'seconds': round(seconds, 3),
+            'docs_per_s': round(len(result.inserted_ids) / seconds) if seconds else None}
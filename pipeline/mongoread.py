@@ -0,0 +1,101 @@
+"""Turn MongoDB query results into a data frame without the JSON round trip
+
+Chapters 6 and 7 read a query into a data frame with
+
+    def mongo_read_query(col, q):
+        qtext = dumps(col.find(q))
+        qrec = loads(qtext)
+        qdf = pd.DataFrame.from_records(qrec)
+        return qdf
+
+pymongo has already decoded every document into a dictionary; `dumps()` writes
+all of them out again as one long Extended JSON string, `loads()` parses that
+string back into a second set of dictionaries, and `from_records()` copies the
+values a third time into the data frame. The `mongo_read_query()` here has the
+same signature and returns the same data frame, but
+
+1. asks the server for raw BSON batches with `find_raw_batches()`, so pymongo
+   does not build dictionaries it would throw away;
+2. decodes each batch with `bson.decode_all()` (in C) and adds its documents to
+   the columns of the result right away, so only one batch of dictionaries
+   exists at a time;
+3. accepts a `projection`, like `{'title': 1, 'points': 1}`, so the server only
+   sends the fields we need.
+
+    from pipeline.mongoread import mongo_read_query
+    mongo_read_query(winecollection, {'points': 100}, projection={'title': 1, 'price': 1})
+
+If the `pymongoarrow` package is installed, `engine='pymongoarrow'` lets it
+decode the BSON straight into Arrow columns. pymongoarrow works out the
+columns from the first document, so use it only when every document has the
+same fields.
+"""
+
+import itertools
+import time
+
+import bson
+import pandas as pd
+from bson.json_util import dumps, loads
+
+from pipeline.accumulate import FrameAccumulator
+
+
+def _document_batches(col, q, projection, batch_size):
+    """Yield the documents of a query as lists, one list per batch from the server"""
+    try:
+        cursor = col.find_raw_batches(q, projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        batches = iter(cursor)
+        first = next(batches, None)
+    except NotImplementedError:
+        # Test doubles like mongomock only return decoded documents
+        yield list(col.find(q, projection))
+        return
+    for batch in itertools.chain([first] if first is not None else [], batches):
+        yield bson.decode_all(batch)
+
+
+def mongo_read_query(col, q, projection=None, batch_size=None, engine='bson'):
+    """Run `col.find(q)` and return the documents as a data frame
+
+    Fields missing from a document are missing values in its row, as with
+    `pd.DataFrame.from_records()`.
+    """
+    if engine == 'pymongoarrow':
+        from pymongoarrow.api import find_pandas_all
+        return find_pandas_all(col, q, projection=projection)
+    frame = FrameAccumulator()
+    for docs in _document_batches(col, q, projection, batch_size):
+        for doc in docs:
+            frame.add_row(doc)
+    return frame.to_frame()
+
+
+def mongo_query(collection, row_query={}, col_query={}):
+    """Return the documents of a query as a list of dictionaries, like `mongo_query()` in chapter 6"""
+    return [doc for docs in _document_batches(collection, row_query, col_query or None, None)
+            for doc in docs]
+
+
+def chapter_read_query(col, q):
+    """The `mongo_read_query()` from chapter 7, for comparison"""
+    qtext = dumps(col.find(q))
+    qrec = loads(qtext)
+    return pd.DataFrame.from_records(qrec)
+
+
+def benchmark(col, q, projection=None):
+    """Time the chapter 7 `mongo_read_query()` against this one, with and without a projection"""
+    results = {}
+    runs = [('dumps_loads', lambda: chapter_read_query(col, q)),
+            ('raw_batches', lambda: mongo_read_query(col, q))]
+    if projection is not None:
+        runs.append(('raw_batches_projection', lambda: mongo_read_query(col, q, projection)))
+    for label, run in runs:
+        start = time.perf_counter()
+        df = run()
+        results[label] = {'seconds': round(time.perf_counter() - start, 3), 'rows': len(df),
+                          'columns': df.shape[1]}
+    return pd.DataFrame(results).T
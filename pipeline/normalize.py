@@ -0,0 +1,323 @@
+"""Split a flat data frame into normalized tables with primary and foreign keys
+
+Chapter 6 explains normal forms and then splits `winemag.csv` into the
+`reviews`, `tasters`, `wineries`, and `locations` CSV files by hand. Here the
+same split is done from the flat `total` data frame, given the columns we think
+belong to each entity:
+
+    from pipeline.normalize import normalize
+    schema = normalize(total, {'tasters': ['taster_name', 'taster_twitter_handle'],
+                               'wineries': ['winery'],
+                               'locations': ['country', 'province', 'region_1', 'region_2']},
+                       key='wine_id', name='reviews')
+    schema.tables['reviews']
+    schema.to_sql(engine)
+
+The `form` argument says how far to go:
+
+1. first normal form: the rows of the main table have a primary key (`key`,
+   or a new integer column if there is none), and a column that holds lists
+   moves to a table of its own with one row per item;
+2. second normal form: each entity's columns move to their own table, with one
+   row for each distinct combination and a new integer key (`taster_id`,
+   `winery_id`, ...), which the main table keeps as a foreign key instead of
+   the repeated strings. If the key of the main table has several columns, any
+   column that depends on only one of them moves out as well;
+3. third normal form (the default): inside an entity, a column that depends on
+   another column that is not the key (in the functional dependence sense of
+   chapter 6) moves out again, with the column it depends on.
+
+With `form=2` the example above gives the four tables of chapter 6. With
+`form=3`, since each province lies in one country, `locations` keeps a
+`province_id` instead, and a `provinces` table holds the province and country.
+
+Functional dependencies are found with `groupby()`: X determines Y if no value
+of X appears with more than one value of Y, which `dependencies()` checks for
+every pair of columns at once. A missing value of X determines nothing, and a
+row whose entity columns are all missing gets a missing foreign key rather than
+an entity of its own. The checks are only as good as the data: a dependency that
+holds in this data by chance is treated as a real one.
+
+`schema.to_sql()` creates the tables with `PRIMARY KEY` and `FOREIGN KEY`
+constraints before loading them, parents first, and `schema.join()` rebuilds
+the flat data frame, which is a good check that nothing was lost.
+"""
+
+import pandas as pd
+
+from pipeline.bulkload import _dialect, _quote, bulk_load
+
+
+def _plural(word):
+    if word.endswith('y') and word[-2:-1] not in 'aeiou':
+        return word[:-1] + 'ies'
+    return word + 's'
+
+
+def _singular(word):
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    return word[:-1] if word.endswith('s') else word
+
+
+def dependencies(df, columns=None):
+    """Return a data frame of True and False: row X, column Y is True if X determines Y
+
+    X determines Y if every value of X appears with only one value of Y. A
+    column never determines itself here, so the diagonal is False.
+    """
+    columns = list(df.columns if columns is None else columns)
+    result = pd.DataFrame(False, index=columns, columns=columns)
+    for x in columns:
+        others = [c for c in columns if c != x]
+        if not others:
+            continue
+        counts = df.groupby(x, sort=False)[others].nunique(dropna=False)
+        if len(counts):
+            result.loc[x, others] = (counts.max() <= 1).to_numpy()
+    return result
+
+
+def _key_columns(table, columns):
+    """Return the columns of an entity that together identify its rows
+
+    These are the columns no other column of the entity determines (unless
+    they determine each other). If those do not identify the rows, because
+    some of their values are missing, the columns that determine the most
+    others are added until they do.
+    """
+    deps = dependencies(table, columns)
+    natural = [c for c in columns
+               if not any(deps.loc[o, c] and not deps.loc[c, o] for o in columns if o != c)]
+    others = sorted((c for c in columns if c not in natural), key=lambda c: -deps.loc[c].sum())
+    while others and (not natural or table.groupby(natural, dropna=False)[columns]
+                      .nunique(dropna=False).max().max() > 1):
+        natural.append(others.pop(0))
+    return [c for c in columns if c in natural]
+
+
+def _list_columns(df, skip):
+    found = []
+    for column in df.columns:
+        if column not in skip and df[column].dtype == object:
+            if df[column].map(lambda v: isinstance(v, (list, tuple, set))).any():
+                found.append(column)
+    return found
+
+
+class Schema:
+    """Normalized tables, the columns that identify their rows, and the keys that connect them"""
+
+    def __init__(self):
+        self.tables = {}
+        self.primary = {}
+        self.natural = {}
+        self.foreign = []
+        self.surrogates = set()
+
+    def add(self, name, df, primary, natural=None):
+        self.tables[name] = df
+        self.primary[name] = list(primary)
+        self.natural[name] = list(natural or primary)
+
+    def _name(self, name):
+        taken = set(self.tables)
+        new, i = name, 2
+        while new in taken:
+            new, i = '{}{}'.format(name, i), i + 1
+        return new
+
+    def split(self, table, entity, columns):
+        """Move `columns` of `table` to a new table `entity`, keyed by a new integer id
+
+        `table` keeps the id as a foreign key, in the place of the first of the
+        columns. Returns the name of the id column.
+        """
+        df = self.tables[table]
+        entity = self._name(entity)
+        id_column = _singular(entity) + '_id'
+        present = df[columns].notna().any(axis=1)
+        rows = df.loc[present, columns]
+        natural = _key_columns(rows, columns)
+        codes = rows.groupby(natural, dropna=False, sort=True).ngroup()
+        ids = pd.Series(pd.NA, index=df.index, dtype='Int64')
+        ids[present] = codes
+        entity_df = (rows.assign(**{id_column: codes})
+                     .drop_duplicates(id_column)
+                     .sort_values(id_column)[[id_column] + list(columns)]
+                     .reset_index(drop=True))
+        entity_df[id_column] = entity_df[id_column].astype('int64')
+        position = df.columns.get_loc(columns[0])
+        df = df.drop(columns=columns)
+        df.insert(min(position, len(df.columns)), id_column, ids)
+        self.tables[table] = df
+        self.natural[table] = [id_column if c in columns else c for c in self.natural[table]]
+        if self.natural[table].count(id_column) > 1:
+            self.natural[table] = list(dict.fromkeys(self.natural[table]))
+        self.add(entity, entity_df, [id_column], natural)
+        self.surrogates.add(id_column)
+        self.foreign.append((table, [id_column], entity, [id_column]))
+        return id_column
+
+    def third_normal_form(self, name):
+        """Split out columns of a table that depend on another column that is not its key, until none do"""
+        foreign = {c for table, columns, _, _ in self.foreign if table == name for c in columns}
+        while True:
+            df = self.tables[name]
+            natural = self.natural[name]
+            columns = [c for c in df.columns if c not in self.primary[name] and c not in foreign]
+            deps = dependencies(df, columns)
+            # Every column determines a column with a single value, which says nothing
+            varies = {c for c in columns if df[c].nunique(dropna=False) > 1}
+            moved = None
+            for x in columns:
+                if natural == [x] or df[x].dropna().is_unique:
+                    # A column that identifies the rows is a key, not a transitive dependency
+                    continue
+                ys = [y for y in columns if y != x and y not in natural and y in varies
+                      and deps.loc[x, y] and not deps.loc[y, x]]
+                if ys:
+                    moved = self.split(name, _plural(x), [x] + ys)
+                    break
+            if moved is None:
+                return
+            foreign.add(moved)
+            self.third_normal_form(self.foreign[-1][2])
+
+    def order(self):
+        """Return the table names with every table after the tables its foreign keys refer to"""
+        ordered = []
+
+        def visit(name):
+            if name in ordered:
+                return
+            for table, _, parent, _ in self.foreign:
+                if table == name:
+                    visit(parent)
+            ordered.append(name)
+
+        for name in self.tables:
+            visit(name)
+        return ordered
+
+    def ddl(self, con):
+        """Return the `CREATE TABLE` statement of every table, with its primary and foreign keys"""
+        dialect = _dialect(con)
+        statements = {}
+        for name in self.order():
+            sql = pd.io.sql.get_schema(self.tables[name], name, keys=self.primary[name], con=con).strip()
+            q = lambda names: ', '.join(_quote(c, dialect) for c in names)
+            constraints = ['FOREIGN KEY ({}) REFERENCES {} ({})'.format(
+                q(columns), _quote(parent, dialect), q(keys))
+                for table, columns, parent, keys in self.foreign if table == name]
+            if constraints:
+                sql = sql[:sql.rindex(')')].rstrip() + ',\n\t' + ',\n\t'.join(constraints) + '\n)'
+            statements[name] = sql
+        return statements
+
+    def to_sql(self, con, method=None):
+        """Drop and create every table with its keys, then bulk load the rows, parents first
+
+        Returns the number of rows and the seconds each table took to load.
+        """
+        dialect = _dialect(con)
+        order = self.order()
+        statements = self.ddl(con)
+
+        def run(sql):
+            if dialect == 'sqlite' and not hasattr(con, 'dialect'):
+                con.execute(sql)
+                con.commit()
+            else:
+                with con.begin() as conn:
+                    conn.exec_driver_sql(sql)
+
+        for name in reversed(order):
+            run('DROP TABLE IF EXISTS {}'.format(_quote(name, dialect)))
+        results = []
+        for name in order:
+            run(statements[name])
+            results.append(bulk_load(self.tables[name], name, con, if_exists='append', method=method))
+        return pd.DataFrame(results)
+
+    def join(self, name):
+        """Rebuild the flat data frame of a table by joining in every table it refers to
+
+        The new integer ids are dropped again, so the columns are those of the
+        data frame that was normalized, less any list columns.
+        """
+        df = self.tables[name]
+        for table, columns, parent, keys in self.foreign:
+            if table == name:
+                df = df.merge(self.join(parent), how='left', left_on=columns, right_on=keys, sort=False)
+                df = df.drop(columns=[c for c in dict.fromkeys(columns + keys) if c in self.surrogates])
+        return df
+
+    def memory(self, flat=None):
+        """Return the rows, columns, and megabytes of every table, and of the flat data frame if given"""
+        rows = [{'table': name, 'rows': len(df), 'columns': df.shape[1],
+                 'mb': round(df.memory_usage(deep=True, index=False).sum() / 1e6, 2)}
+                for name, df in self.tables.items()]
+        total = {'table': 'total', 'rows': sum(r['rows'] for r in rows),
+                 'columns': sum(r['columns'] for r in rows), 'mb': round(sum(r['mb'] for r in rows), 2)}
+        rows.append(total)
+        if flat is not None:
+            rows.append({'table': 'flat', 'rows': len(flat), 'columns': flat.shape[1],
+                         'mb': round(flat.memory_usage(deep=True, index=False).sum() / 1e6, 2)})
+        return pd.DataFrame(rows).set_index('table')
+
+
+def normalize(df, entities, key=None, name='main', form=3):
+    """Split a flat data frame into tables in first, second, or third normal form
+
+    `entities` is a dictionary of `{table name: [columns]}`. `key` is the
+    column (or list of columns) that identifies the rows of `df`; without it,
+    a new column `<name>_id` numbers the rows. Returns a `Schema`.
+    """
+    if form not in (1, 2, 3):
+        raise ValueError("form must be 1, 2, or 3")
+    schema = Schema()
+    df = df.copy()
+    if key is None:
+        key = _singular(name) + '_id'
+        df.insert(0, key, range(len(df)))
+        schema.surrogates.add(key)
+    keys = [key] if isinstance(key, str) else list(key)
+    if df.duplicated(keys).any():
+        raise ValueError("{} do not identify the rows: some values appear more than once".format(keys))
+
+    for column in _list_columns(df, keys):
+        items = df[keys + [column]].explode(column).dropna(subset=[column]).reset_index(drop=True)
+        df = df.drop(columns=column)
+        child = '{}_{}'.format(name, column)
+        schema.add(child, items, keys + [column])
+        schema.foreign.append((child, keys, name, keys))
+    schema.add(name, df.reset_index(drop=True), keys)
+    if form == 1:
+        return schema
+
+    for entity, columns in entities.items():
+        missing = [c for c in columns if c not in df.columns]
+        if missing:
+            raise KeyError("{} has no columns {}".format(name, missing))
+        schema.split(name, entity, list(columns))
+    if len(keys) > 1:
+        # Columns that depend on one part of the key, not all of it
+        main = schema.tables[name]
+        foreign = {c for t, columns, _, _ in schema.foreign if t == name for c in columns}
+        rest = [c for c in main.columns if c not in keys and c not in foreign]
+        for part in keys:
+            deps = dependencies(main, [part] + rest).loc[part]
+            moved = [c for c in rest if deps[c]]
+            if moved:
+                entity = schema._name(_plural(part))
+                schema.add(entity, main[[part] + moved].drop_duplicates(part).reset_index(drop=True), [part])
+                main = main.drop(columns=moved)
+                schema.foreign.append((name, [part], entity, [part]))
+                rest = [c for c in rest if c not in moved]
+        schema.tables[name] = main
+    if form == 3:
+        for entity in list(schema.tables):
+            if entity in entities:
+                schema.third_normal_form(entity)
+    return schema
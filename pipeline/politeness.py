@@ -0,0 +1,208 @@
+"""Crawl politely: obey robots.txt and give every website its own pace
+
+Chapter 5 talks about whether scraping a site is allowed, and about sites that
+block scrapers, but `wnrn_spider()` sends its requests as fast as it can with
+nothing but a user-agent header. Most websites say what they allow in a file
+at `/robots.txt`:
+
+    User-agent: *
+    Crawl-delay: 5
+    Disallow: /admin/
+
+A `PoliteScheduler` downloads each website's robots.txt once, skips the pages it
+disallows, and waits `Crawl-delay` seconds (or the `Request-rate`) between two
+requests to that website (`urllib.robotparser` only reads a `Crawl-delay` in
+whole seconds). It keeps a separate queue for each website, so a slow
+website does not hold up the others: different websites are crawled at the same
+time, and each one as fast as its robots.txt allows (up to `per_host` requests
+at once if it asks for no delay).
+
+    from pipeline.crawler import crawl
+    from pipeline.politeness import PoliteScheduler
+    wnrn_total_playlist = crawl(urls, scheduler=PoliteScheduler())
+
+A page that robots.txt disallows comes back from the crawl as a `Disallowed`
+error in `df.attrs['failed']`. If robots.txt cannot be downloaded because of a
+server error or a network error, the whole website is treated as disallowed, as
+RFC 9309 recommends; if it does not exist (a 404), everything is allowed.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from pipeline.ratelimit import TokenBucket
+from pipeline.wnrn import HEADERS
+
+
+class Disallowed(Exception):
+    """Raised for a page that the website's robots.txt does not let us crawl"""
+
+
+class RobotsCache:
+    """Download, parse, and remember the robots.txt of every website we visit"""
+
+    def __init__(self, session=None, user_agent=None, timeout=10):
+        self.session = session or requests.Session()
+        # A session with no user agent of its own says python-requests/x.y; use the crawler's instead
+        session_agent = self.session.headers.get('user-agent')
+        if session_agent == requests.utils.default_user_agent():
+            session_agent = None
+        self.user_agent = user_agent or session_agent or HEADERS['user-agent']
+        self.timeout = timeout
+        self.parsers = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _load(self, root):
+        parser = RobotFileParser(root + '/robots.txt')
+        try:
+            r = self.session.get(root + '/robots.txt', headers={'user-agent': self.user_agent},
+                                 timeout=self.timeout)
+        except requests.RequestException:
+            parser.disallow_all = True
+            return parser
+        if r.status_code in (401, 403) or r.status_code >= 500:
+            parser.disallow_all = True
+        elif r.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(r.text.splitlines())
+        parser.modified()
+        return parser
+
+    def parser(self, url):
+        """Return the `RobotFileParser` for the website a URL belongs to"""
+        parts = urlsplit(url)
+        root = '{}://{}'.format(parts.scheme, parts.netloc.lower())
+        with self._lock:
+            lock = self._loading.setdefault(root, threading.Lock())
+        # Each website has its own lock, so robots.txt files download in parallel
+        with lock:
+            if root not in self.parsers:
+                self.parsers[root] = self._load(root)
+            return self.parsers[root]
+
+    def allowed(self, url):
+        """Return True if robots.txt lets our user agent download the URL"""
+        return self.parser(url).can_fetch(self.user_agent, url)
+
+    def delay(self, url):
+        """Return the number of seconds robots.txt asks us to wait between requests"""
+        parser = self.parser(url)
+        delay = parser.crawl_delay(self.user_agent) or 0
+        rate = parser.request_rate(self.user_agent)
+        if rate is not None and rate.requests:
+            delay = max(delay, rate.seconds / rate.requests)
+        return float(delay)
+
+
+class _Host:
+    def __init__(self):
+        self.queue = deque()
+        self.delay = None
+        # One worker reads robots.txt first; then a website that asks for no
+        # delay gets up to `per_host` workers, and one that does gets just one
+        self.slots = 1
+        self.workers = 0
+        self.bucket = None
+
+
+class PoliteScheduler:
+    """Run downloads with one queue per website, paced by each website's robots.txt
+
+    `submit(fn, url)` works like `Executor.submit()`: it returns a future for
+    `fn(url)`, which runs when the website's robots.txt and pace allow.
+    `min_delay` is the smallest wait between two requests to the same website,
+    even if its robots.txt asks for none. `workers` is the number of threads
+    shared by all of the websites.
+    """
+
+    def __init__(self, session=None, user_agent=None, per_host=2, min_delay=0, workers=32):
+        self.robots = RobotsCache(session, user_agent)
+        self.per_host = per_host
+        self.min_delay = min_delay
+        self.workers = workers
+        self.hosts = {}
+        self.stats = {'fetched': 0, 'disallowed': 0, 'waited_s': 0.0}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        """Wait for the queued downloads to finish and stop the threads"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def delays(self):
+        """Return the wait between requests that each website was given"""
+        return {host: state.delay for host, state in self.hosts.items()}
+
+    def submit(self, fn, url):
+        """Queue `fn(url)` behind the other pages from the same website"""
+        future = Future()
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers)
+            state = self.hosts.setdefault(host, _Host())
+            state.queue.append((future, fn, url))
+            self._start_workers(state)
+        return future
+
+    def _start_workers(self, state):
+        while state.workers < state.slots and len(state.queue) > state.workers:
+            state.workers += 1
+            self._pool.submit(self._drain, state)
+
+    def _pace(self, state, url):
+        # robots.txt is read in a worker, so slow websites do not hold up the others
+        delay = max(self.min_delay, self.robots.delay(url))
+        with self._lock:
+            state.delay = delay
+            if delay:
+                state.bucket = TokenBucket(rate=1 / delay, capacity=1)
+            else:
+                state.slots = self.per_host
+                self._start_workers(state)
+
+    def _drain(self, state):
+        while True:
+            with self._lock:
+                if not state.queue:
+                    state.workers -= 1
+                    return
+                future, fn, url = state.queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            # Anything that goes wrong, even reading robots.txt, ends up in the future, not in the worker
+            try:
+                if state.delay is None:
+                    self._pace(state, url)
+                if not self.robots.allowed(url):
+                    with self._lock:
+                        self.stats['disallowed'] += 1
+                    future.set_exception(Disallowed("robots.txt disallows {}".format(url)))
+                    continue
+                if state.bucket is not None:
+                    waited = state.bucket.wait()
+                    with self._lock:
+                        self.stats['waited_s'] += waited
+                result = fn(url)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            with self._lock:
+                self.stats['fetched'] += 1
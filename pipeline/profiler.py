@@ -0,0 +1,225 @@
+"""Find out where a scraper spends its time: downloading, parsing, or building the data frame
+
+`wnrn_spider()` in chapter 5 does three things for every page: it downloads the
+page with `requests.get()`, parses it with `BeautifulSoup()`, and builds a data
+frame with `pd.DataFrame()`. Speeding up the wrong one of these is wasted
+effort, so a `StageProfiler` times each of them:
+
+    from pipeline.profiler import StageProfiler
+    from pipeline.wnrn import wnrn_spider
+    profiler = StageProfiler()
+    for w in wnrn_url:
+        wnrn_spider('https://spinitron.com/' + w, profiler=profiler)
+    profiler.summary()
+
+`crawl()` in `pipeline.crawler` takes a `profiler` too. Each stage keeps a count,
+a total, and a histogram of its durations, which is all that `summary()` needs
+no matter how many pages are crawled. The individual timings (up to
+`max_events` of them) are kept as well, so they can be saved as a trace for
+Chrome's `chrome://tracing` or https://ui.perfetto.dev with `chrome_trace()`,
+or as "folded stacks" for flame graph tools like `flamegraph.pl` or
+https://www.speedscope.app with `folded_stacks()`.
+
+Stages can be nested: a stage started inside another one is shown inside it in
+the trace and in the flame graph.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Four buckets for every doubling of the duration, starting at a microsecond
+_BUCKETS_PER_DOUBLING = 4
+
+
+def _bucket(seconds):
+    return max(0, int(math.log2(max(seconds, 1e-6) * 1e6) * _BUCKETS_PER_DOUBLING))
+
+
+def _bucket_middle(bucket):
+    return 2 ** ((bucket + 0.5) / _BUCKETS_PER_DOUBLING) / 1e6
+
+
+class _Stage:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.histogram = {}
+
+    def add(self, seconds, nbytes):
+        self.calls += 1
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += nbytes
+        bucket = _bucket(seconds)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def percentile(self, q):
+        """Estimate the `q`th percentile from the histogram"""
+        rank = max(1, math.ceil(q / 100 * self.calls))
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(_bucket_middle(bucket), self.max)
+        return float('nan')
+
+
+class StageProfiler:
+    """Record the time and bytes of each stage of a scraper, page by page"""
+
+    def __init__(self, max_events=100000):
+        self.stages = {}
+        # Seconds of each stage when it was not inside another one
+        self.outer_seconds = {}
+        self.events = []
+        self.max_events = max_events
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, url=None, nbytes=0):
+        """Time the code inside a `with` block as one call of the stage `name`
+
+        The `with` block gives back a dictionary; set its `'bytes'` to record
+        the size of what the stage handled once it is known.
+        """
+        stack = self._stack()
+        stack.append(name)
+        info = {'bytes': nbytes}
+        wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            path = ';'.join(stack)
+            stack.pop()
+            self.record(name, wall, seconds, info['bytes'], url=url, path=path)
+
+    def record(self, name, wall, seconds, nbytes=0, url=None, path=None, thread=None):
+        """Add one call of a stage that was timed somewhere else, such as in another process
+
+        `wall` is when the call started, from `time.time()`.
+        """
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = _Stage()
+            stage.add(seconds, nbytes)
+            if path is None or ';' not in path:
+                self.outer_seconds[name] = self.outer_seconds.get(name, 0.0) + seconds
+            if len(self.events) < self.max_events:
+                self.events.append((name, path or name, wall, seconds, nbytes, url,
+                                    thread if thread is not None else threading.get_ident()))
+
+    def summary(self):
+        """Return a data frame with one row per stage, slowest stage first
+
+        The percentiles come from the histogram, so they are accurate to about
+        10 percent. `share` is the stage's part of the time spent in stages that
+        are not inside another one, so with `page` around `fetch`, `parse`, and
+        `build`, `page` has a share of 1 and the other three add up to about 1.
+        """
+        total = sum(self.outer_seconds.values()) or float('nan')
+        rows = []
+        for name, s in self.stages.items():
+            rows.append({'stage': name,
+                         'calls': s.calls,
+                         'total_s': round(s.seconds, 4),
+                         'mean_ms': round(s.seconds / s.calls * 1000, 3),
+                         'p50_ms': round(s.percentile(50) * 1000, 3),
+                         'p95_ms': round(s.percentile(95) * 1000, 3),
+                         'max_ms': round(s.max * 1000, 3),
+                         'bytes': s.bytes,
+                         'mb_per_s': round(s.bytes / s.seconds / 1e6, 3) if s.bytes and s.seconds else None,
+                         'share': round(s.seconds / total, 3)})
+        columns = ['stage', 'calls', 'total_s', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms',
+                   'bytes', 'mb_per_s', 'share']
+        df = pd.DataFrame(rows, columns=columns)
+        return df.sort_values('total_s', ascending=False, ignore_index=True)
+
+    def histogram(self, name):
+        """Return the histogram of one stage as a data frame of duration ranges and counts"""
+        stage = self.stages[name]
+        buckets = sorted(stage.histogram)
+        return pd.DataFrame({
+            'from_ms': [2 ** (b / _BUCKETS_PER_DOUBLING) / 1000 for b in buckets],
+            'to_ms': [2 ** ((b + 1) / _BUCKETS_PER_DOUBLING) / 1000 for b in buckets],
+            'calls': [stage.histogram[b] for b in buckets]})
+
+    def chrome_trace(self, path=None):
+        """Return the timings in the Chrome trace event format, and save them to `path` if given"""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, _, wall, seconds, nbytes, url, thread in self.events:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            args = {'bytes': nbytes}
+            if url is not None:
+                args['url'] = url
+            events.append({'name': name, 'cat': 'scrape', 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': round((wall - self.started) * 1e6, 1),
+                           'dur': round(seconds * 1e6, 1), 'args': args})
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'w', encoding='utf8') as f:
+                json.dump(trace, f)
+        return trace
+
+    def folded_stacks(self, path=None):
+        """Return the timings as folded stacks in microseconds, and save them to `path` if given
+
+        Each line is a stack of stages and the time spent in it but not in the
+        stages inside it, like `page;parse 5120`.
+        """
+        inclusive = {}
+        for _, stack, _, seconds, _, _, _ in self.events:
+            inclusive[stack] = inclusive.get(stack, 0) + seconds
+        totals = dict(inclusive)
+        for stack, seconds in inclusive.items():
+            parent = stack.rpartition(';')[0]
+            if parent in totals:
+                totals[parent] -= seconds
+        lines = ['{} {}'.format(stack, max(0, round(seconds * 1e6)))
+                 for stack, seconds in sorted(totals.items())]
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(text)
+        return text
+
+
+class NullProfiler:
+    """A profiler that records nothing, used when no profiler is given"""
+
+    @contextmanager
+    def stage(self, name, url=None, nbytes=0):
+        yield {'bytes': nbytes}
+
+    def record(self, *args, **kwargs):
+        pass
+
+
+def timed(parse, html):
+    """Run `parse(html)` and return its result with `(wall, seconds, pid)`
+
+    Used to time parsing inside the crawler's pool of processes.
+    """
+    wall = time.time()
+    start = time.perf_counter()
+    result = parse(html)
+    return result, (wall, time.perf_counter() - start, os.getpid())
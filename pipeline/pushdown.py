@@ -0,0 +1,599 @@
+"""Build pandas wrangling chains on database tables, and run each one as a single SQL query
+
+Chapter 9 asks "`pandas` or SQL?", and chapter 7 writes the filters, joins,
+and aggregations in SQL by hand. Doing the same work in pandas starts with
+`pd.read_sql_query("SELECT * FROM reviews", con=engine)`, which sends every
+row and column of the table over the network, and most of them are thrown
+away by the next line. A `LazyFrame` takes the usual pandas calls but only
+writes them down. Nothing is read until `collect()`, which turns the whole
+chain into one `SELECT` statement with SQLAlchemy. The database does the work,
+and only the final result comes back:
+
+    from pipeline.pushdown import read_table
+    reviews = read_table('reviews', engine)
+    locations = read_table('locations', engine)
+    countries = (reviews.query("variety == 'Riesling'")
+                 .merge(locations, on='location_id')
+                 .groupby('country')
+                 .agg(average_points=('points', 'mean'), numberofwines=('points', 'size'))
+                 .query('numberofwines >= 100')
+                 .sort_values('average_points', ascending=False))
+    countries.sql()        # SELECT ... JOIN ... WHERE ... GROUP BY ... HAVING ... ORDER BY
+    countries.collect()    # the data frame, as pandas would have made it
+
+A `LazyFrame` knows `query()`, selecting columns with `[]`, `groupby()`
+followed by `agg()`, `size()`, `mean()` or another aggregate, `merge()`,
+`sort_values()`, `head()`, `rename(columns=...)`, and `reset_index()`. A
+call that cannot be added to the query built so far, such as a filter after
+`head()`, puts that query in a subquery. `query()` strings can use
+comparisons, `in`, `and`, `or`, `not`, `+ - * /`, `@variables`, `.isna()`,
+`.isin()`, `.between()`, and `.str.contains()`, `.str.startswith()`,
+`.str.endswith()`, `.str.lower()`, `.str.upper()`, and `.str.len()`.
+
+Where pandas and SQL disagree, the results follow pandas: `!=`, `not in`, and
+`~` keep rows with missing values, `groupby()` drops missing keys and sorts by
+the keys, `merge()` matches missing keys with each other, and `sort_values()`
+puts missing values last. The order of rows that
+were never sorted is up to the database.
+
+`eager()` runs the same calls in pandas on `SELECT *` of each table.
+`benchmark()` times both ways, counts the rows and megabytes each one reads
+from the database, and checks that they give the same result.
+"""
+
+import ast
+import copy
+import operator
+import re
+import sys
+import time
+
+import pandas as pd
+from sqlalchemy import MetaData, Table, and_, case, false, func, not_, or_, select, true
+from sqlalchemy.exc import CompileError
+from sqlalchemy.sql.elements import ColumnElement
+
+from pipeline.bulkload import _quote
+from pipeline.embedded import _comparable
+
+_COMPARE = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+            ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+# Not // or %: SQL rounds them toward zero where pandas rounds down, so they raise a ValueError
+_ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+               ast.Div: operator.truediv}
+# How each pandas aggregate is written in SQL
+_AGGREGATES = {'sum': func.sum, 'mean': func.avg, 'min': func.min, 'max': func.max,
+               'count': func.count, 'size': lambda column: func.count(),
+               'nunique': lambda column: func.count(column.distinct()),
+               'median': lambda column: func.percentile_cont(0.5).within_group(column),
+               'std': func.stddev_samp, 'var': func.var_samp}
+_QUOTED = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_TICKED = re.compile(r'`([^`]+)`')
+_LOCAL = re.compile(r'@(\w+)')
+_REGEX = set('.^$*+?{}[]\\|()')
+
+
+def _values(value):
+    """Return numpy numbers as Python numbers, and list-likes as lists, which every driver takes"""
+    if pd.api.types.is_list_like(value):
+        return [_values(v) for v in value]
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _missing(*sides):
+    return [side.is_(None) for side in sides if isinstance(side, ColumnElement)]
+
+
+def _not(condition):
+    # NOT of a missing value is missing in SQL, so the row would be dropped; pandas keeps it
+    return not_(case((condition, true()), else_=false()))
+
+
+def _compare(op, left, right):
+    if isinstance(op, (ast.In, ast.NotIn)) or isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(right, list):
+        if not isinstance(left, ColumnElement):
+            raise ValueError("the left side of 'in' must be a column")
+        inside = left.in_(right)
+        return inside if isinstance(op, (ast.In, ast.Eq)) else or_(not_(inside), *_missing(left))
+    if isinstance(op, ast.NotEq):
+        return or_(left != right, *_missing(left, right))
+    if type(op) not in _COMPARE:
+        raise ValueError("{} cannot be turned into SQL".format(type(op).__name__))
+    return _COMPARE[type(op)](left, right)
+
+
+def _string_method(column, name, args, kwargs, dialect):
+    if name in ('lower', 'upper'):
+        return getattr(func, name)(column)
+    if name == 'len':
+        return func.length(column)
+    if name not in ('contains', 'startswith', 'endswith'):
+        raise ValueError(".str.{}() cannot be turned into SQL".format(name))
+    pattern = args[0] if args else kwargs['pat']
+    if name == 'contains' and kwargs.get('regex', True) and _REGEX & set(pattern):
+        return column.regexp_match(pattern, flags=None if kwargs.get('case', True) else 'i')
+    if not kwargs.get('case', True):
+        return getattr(func.lower(column), name)(pattern.lower(), autoescape=True)
+    if dialect == 'sqlite':
+        # LIKE in SQLite ignores the case of letters, and pandas does not
+        if name == 'contains':
+            return func.instr(column, pattern) > 0
+        start = 1 if name == 'startswith' else -len(pattern)
+        return func.substr(column, start, len(pattern)) == pattern
+    return getattr(column, name)(pattern, autoescape=True)
+
+
+def _method(column, name, args, kwargs):
+    if name in ('isna', 'isnull'):
+        return column.is_(None)
+    if name in ('notna', 'notnull'):
+        return column.is_not(None)
+    if name == 'isin':
+        return column.in_(args[0])
+    if name == 'between':
+        low, high = args[:2]
+        inclusive = args[2] if len(args) > 2 else kwargs.get('inclusive', 'both')
+        if inclusive == 'both':
+            return column.between(low, high)
+        return and_(column >= low if inclusive == 'left' else column > low,
+                    column <= high if inclusive == 'right' else column < high)
+    raise ValueError(".{}() cannot be turned into SQL".format(name))
+
+
+def _condition(expr, columns, local_dict, dialect):
+    """Turn a `df.query()` string into a SQLAlchemy condition on `columns`
+
+    Returns the condition and the `@variables` it used, with their values.
+    """
+    ticked, values = {}, {}
+
+    def name(match):
+        ticked['_ticked{}'.format(len(ticked))] = match.group(1)
+        return '_ticked{}'.format(len(ticked) - 1)
+
+    def local(match):
+        if match.group(1) not in local_dict:
+            raise KeyError("local variable '{}' is not defined".format(match.group(1)))
+        values[match.group(1)] = local_dict[match.group(1)]
+        return '_local_' + match.group(1)
+
+    # Backticks and @ mean something only outside of strings
+    parts = _QUOTED.split(expr)
+    for i in range(0, len(parts), 2):
+        parts[i] = _LOCAL.sub(local, _TICKED.sub(name, parts[i]))
+    tree = ast.parse(''.join(parts).strip(), mode='eval')
+
+    def visit(node):
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.BoolOp):
+            return (and_ if isinstance(node.op, ast.And) else or_)(*[visit(v) for v in node.values])
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            return (and_ if isinstance(node.op, ast.BitAnd) else or_)(visit(node.left), visit(node.right))
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            return _ARITHMETIC[type(node.op)](visit(node.left), visit(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+            return _not(visit(node.operand))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -visit(node.operand)
+        if isinstance(node, ast.Compare):
+            conditions, left = [], visit(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = visit(comparator)
+                conditions.append(_compare(op, left, right))
+                left = right
+            return and_(*conditions)
+        if isinstance(node, ast.Name):
+            if node.id.startswith('_local_'):
+                return _values(values[node.id[len('_local_'):]])
+            column = ticked.get(node.id, node.id)
+            if column not in columns:
+                raise KeyError("name '{}' is not a column".format(column))
+            return columns[column]
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return [visit(element) for element in node.elts]
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            args = [visit(arg) for arg in node.args]
+            kwargs = {keyword.arg: visit(keyword.value) for keyword in node.keywords}
+            owner = node.func.value
+            if isinstance(owner, ast.Attribute) and owner.attr == 'str':
+                return _string_method(visit(owner.value), node.func.attr, args, kwargs, dialect)
+            return _method(visit(owner), node.func.attr, args, kwargs)
+        raise ValueError("{} cannot be turned into SQL".format(ast.unparse(node)))
+
+    return visit(tree), values
+
+
+def _order_by(expression, ascending, dialect):
+    direction = expression.asc() if ascending else expression.desc()
+    if dialect in ('mysql', 'mariadb'):
+        # MySQL has no NULLS LAST, but sorts False before True
+        return [expression.is_(None), direction]
+    return [direction.nulls_last()]
+
+
+def _position(expression, expressions):
+    # SQLAlchemy expressions compare with == into SQL, so find them by identity
+    return next((i for i, other in enumerate(expressions) if other is expression), None)
+
+
+def _equal_keys(left, right):
+    # pandas matches a missing key with the missing keys on the other side; SQL's = does not.
+    # IS NOT DISTINCT FROM keeps some databases from using a hash join, so it is only used when
+    # both keys can be NULL
+    if getattr(left, 'nullable', True) and getattr(right, 'nullable', True):
+        return left.is_not_distinct_from(right)
+    return left == right
+
+
+class LazyFrame:
+    """A query on database tables, built from pandas calls, that runs when it is collected
+
+    Every call returns a new `LazyFrame` and leaves this one as it was.
+    """
+
+    def __init__(self, engine, source, columns, steps, tables):
+        self.engine = engine
+        self._source = source
+        self._index = {}
+        self._columns = dict(columns)
+        self._where = []
+        self._group = None
+        self._having = []
+        self._order = []
+        self._limit = None
+        self._series = None
+        self._steps = tuple(steps)
+        self._tables = frozenset(tables)
+
+    @property
+    def _dialect(self):
+        return self.engine.dialect.name
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def _step(self, step, **changes):
+        new = copy.copy(self)
+        new._steps = self._steps + (step,)
+        for name, value in changes.items():
+            setattr(new, '_' + name, value)
+        return new
+
+    def _lookup(self, names, index=True):
+        columns = {**self._index, **self._columns} if index else self._columns
+        missing = [name for name in names if name not in columns]
+        if missing:
+            raise KeyError("{} not in columns {}".format(missing, list(columns)))
+        return [columns[name] for name in names]
+
+    def _subquery(self):
+        """Return a frame that selects everything from this query, as a subquery"""
+        # Without a LIMIT, the order of the rows inside a subquery means nothing
+        inner = self if self._limit is not None else self._step(self._steps[-1], order=[])
+        sub = inner.select().subquery()
+        names = list(self._index) + list(self._columns)
+        expressions = list(self._index.values()) + list(self._columns.values())
+        order = [(sub.c[names[i]], ascending) for i, ascending in
+                 ((_position(e, expressions), ascending) for e, ascending in self._order) if i is not None]
+        new = copy.copy(self)
+        new._source = sub
+        new._index = {name: sub.c[name] for name in self._index}
+        new._columns = {name: sub.c[name] for name in self._columns}
+        new._where, new._group, new._having, new._order, new._limit = [], None, [], order, None
+        new._tables = frozenset([sub])
+        return new
+
+    def select(self):
+        """Return the query as a SQLAlchemy `Select`"""
+        columns = {**self._index, **self._columns}
+        statement = select(*[e.label(name) for name, e in columns.items()]).select_from(self._source)
+        if self._where:
+            statement = statement.where(*self._where)
+        if self._group is not None:
+            statement = statement.group_by(*self._group)
+        if self._having:
+            statement = statement.having(*self._having)
+        for expression, ascending in self._order:
+            statement = statement.order_by(*_order_by(expression, ascending, self._dialect))
+        if self._limit is not None:
+            statement = statement.limit(self._limit)
+        return statement
+
+    def sql(self):
+        """Return the text of the query, with the values written in"""
+        try:
+            return str(self.select().compile(self.engine, compile_kwargs={'literal_binds': True}))
+        except (CompileError, NotImplementedError):
+            # A value the dialect cannot write as a literal; show the placeholders instead
+            return str(self.select().compile(self.engine))
+
+    def __repr__(self):
+        return 'LazyFrame:\n' + self.sql()
+
+    def collect(self):
+        """Run the query and return what pandas would have returned: a data frame or a series"""
+        df = pd.read_sql_query(self.select(), con=self.engine)
+        if self._index:
+            df = df.set_index(list(self._index))
+        if self._series is not None:
+            column, name = self._series
+            return df[column].rename(name)
+        return df
+
+    def eager(self, tables=None):
+        """Make the same pandas calls on data frames of whole tables, read with `SELECT *`
+
+        `tables` is a dictionary of data frames by table name; tables not in it
+        are read from the database and added to it.
+        """
+        tables = {} if tables is None else tables
+        result = None
+        for name, args, kwargs in self._steps:
+            if name == 'read':
+                if args[0] not in tables:
+                    tables[args[0]] = pd.read_sql_query(
+                        'SELECT * FROM {}'.format(_quote(args[0], self._dialect)), con=self.engine)
+                result = tables[args[0]]
+            else:
+                args = [arg.eager(tables) if isinstance(arg, LazyFrame) else arg for arg in args]
+                result = getattr(result, name)(*args, **kwargs)
+        return result
+
+    def query(self, expr, local_dict=None, level=0):
+        """Keep the rows where `expr` is true, as `df.query()` does
+
+        `@name` is a variable of the function that calls `query()`, or of
+        `local_dict`. After `groupby()`, the condition goes in `HAVING`.
+        """
+        if local_dict is None:
+            caller = sys._getframe(level + 1)
+            local_dict = {**caller.f_globals, **caller.f_locals}
+        frame = self._subquery() if self._limit is not None else self
+        condition, values = _condition(expr, {**frame._index, **frame._columns}, local_dict, self._dialect)
+        # str methods need the python engine of df.query()
+        step = ('query', (expr,), {'local_dict': values, 'engine': 'python'})
+        if frame._group is None:
+            return frame._step(step, where=frame._where + [condition])
+        return frame._step(step, having=frame._having + [condition])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._step(('__getitem__', (key,), {}), columns={key: self._lookup([key], False)[0]},
+                              series=(key, key))
+        names = list(key)
+        return self._step(('__getitem__', (key,), {}),
+                          columns=dict(zip(names, self._lookup(names, False))), series=None)
+
+    def groupby(self, by, as_index=True, sort=True, dropna=True):
+        """Group the rows by one or more columns, as `df.groupby()` does"""
+        return LazyGroupBy(self, by, as_index=as_index, sort=sort, dropna=dropna)
+
+    def merge(self, right, how='inner', on=None, left_on=None, right_on=None, suffixes=('_x', '_y')):
+        """Join another `LazyFrame` on the database, as `pd.merge()` does
+
+        `how` is 'inner', 'left', 'right', 'outer', or 'cross'. The index of a
+        grouped frame is merged as columns, as after `reset_index()`.
+        """
+        if not isinstance(right, LazyFrame):
+            raise TypeError("a LazyFrame can only be merged with another LazyFrame")
+        if how not in ('inner', 'left', 'right', 'outer', 'cross'):
+            raise ValueError("how must be 'inner', 'left', 'right', 'outer', or 'cross'")
+        step = ('merge', (right,), {'how': how, 'on': on, 'left_on': left_on, 'right_on': right_on,
+                                    'suffixes': suffixes})
+        left = self
+        if left._group is not None or left._limit is not None or left._where and how in ('right', 'outer'):
+            left = left._subquery()
+        # A right side with conditions of its own, or a table the left side already has, is a subquery
+        if right._group is not None or right._limit is not None or right._where \
+                or len(right._tables) > 1 or right._tables & left._tables:
+            right = right._subquery()
+        left_columns = {**left._index, **left._columns}
+        right_columns = {**right._index, **right._columns}
+
+        listed = lambda names: [names] if isinstance(names, str) else list(names)
+        if how == 'cross':
+            pairs = []
+        elif on is not None:
+            pairs = [(name, name) for name in listed(on)]
+        elif left_on is not None and right_on is not None:
+            if len(listed(left_on)) != len(listed(right_on)):
+                raise ValueError("left_on and right_on must have the same number of columns")
+            pairs = list(zip(listed(left_on), listed(right_on)))
+        else:
+            pairs = [(name, name) for name in left_columns if name in right_columns]
+            if not pairs:
+                raise ValueError("no columns to merge on: give on, or left_on and right_on")
+        left._lookup([l for l, _ in pairs])
+        right._lookup([r for _, r in pairs])
+        onclause = and_(*[_equal_keys(left_columns[l], right_columns[r]) for l, r in pairs]) \
+            if pairs else true()
+        if how == 'right':
+            source = right._source.join(left._source, onclause, isouter=True)
+        else:
+            source = left._source.join(right._source, onclause, isouter=how == 'left', full=how == 'outer')
+
+        # A key with the same name on both sides becomes one column, as in pandas
+        shared = {l for l, r in pairs if l == r}
+        overlap = (set(left_columns) & set(right_columns)) - shared
+        columns = {}
+        for name, expression in left_columns.items():
+            if name in shared and how == 'right':
+                expression = right_columns[name]
+            elif name in shared and how == 'outer':
+                expression = func.coalesce(expression, right_columns[name])
+            columns[name + suffixes[0] if name in overlap else name] = expression
+        for name, expression in right_columns.items():
+            if name not in shared:
+                columns[name + suffixes[1] if name in overlap else name] = expression
+        return left._step(step, source=source, index={}, columns=columns, where=list(left._where),
+                          order=left._order if how in ('inner', 'left') else [], series=None,
+                          tables=left._tables | right._tables)
+
+    def sort_values(self, by=None, ascending=True):
+        """Order the rows, as `df.sort_values()` does, with missing values last
+
+        A series, such as `groupby('country')['points'].mean()`, needs no `by`.
+        """
+        if by is None and self._series is None:
+            raise TypeError("sort_values() of a data frame needs by")
+        names = [self._series[0]] if by is None else [by] if isinstance(by, str) else list(by)
+        ascendings = [ascending] * len(names) if isinstance(ascending, bool) else list(ascending)
+        frame = self._subquery() if self._limit is not None else self
+        keys = frame._lookup(names)
+        # Rows that tie stay in the order they had, as with a stable sort
+        order = list(zip(keys, ascendings)) + [(e, a) for e, a in frame._order if _position(e, keys) is None]
+        step = ('sort_values', () if by is None else (by,), {'ascending': ascending})
+        return frame._step(step, order=order)
+
+    def head(self, n=5):
+        """Keep the first `n` rows, with `LIMIT`"""
+        return self._step(('head', (n,), {}), limit=n if self._limit is None else min(n, self._limit))
+
+    def rename(self, columns):
+        """Rename columns with a dictionary of `{old name: new name}`"""
+        return self._step(('rename', (), {'columns': columns}),
+                          columns={columns.get(name, name): e for name, e in self._columns.items()})
+
+    def reset_index(self, drop=False, name=None):
+        """Turn the index into columns, or drop it, as `df.reset_index()` does"""
+        kwargs = {'drop': drop}
+        columns, series = self._columns, self._series
+        if series is not None and not drop:
+            column, series_name = series
+            if name is None and series_name is None:
+                raise ValueError("the series has no name: give one with reset_index(name=...)")
+            new_name = name if name is not None else series_name
+            columns = {new_name if c == column else c: e for c, e in columns.items()}
+            series = None
+            if name is not None:
+                kwargs['name'] = name
+        if not drop:
+            columns = {**self._index, **columns}
+        return self._step(('reset_index', (), kwargs), index={}, columns=columns, series=series)
+
+
+class LazyGroupBy:
+    """The groups of a `LazyFrame`, before their aggregates are chosen"""
+
+    def __init__(self, frame, by, as_index=True, sort=True, dropna=True):
+        self.frame = frame
+        self.by = [by] if isinstance(by, str) else list(by)
+        frame._lookup(self.by)
+        self.as_index = as_index
+        self.sort = sort
+        self.dropna = dropna
+        self.selection = None
+        self._steps = (('groupby', (by,), {'as_index': as_index, 'sort': sort, 'dropna': dropna}),)
+
+    def __getitem__(self, key):
+        new = copy.copy(self)
+        new.selection = key
+        new._steps = self._steps + (('__getitem__', (key,), {}),)
+        return new
+
+    def _selected(self):
+        if self.selection is None:
+            return [c for c in self.frame._columns if c not in self.by]
+        return [self.selection] if isinstance(self.selection, str) else list(self.selection)
+
+    def _aggregate(self, named, step, series=None):
+        frame = self.frame
+        if frame._group is not None or frame._limit is not None:
+            frame = frame._subquery()
+        keys = frame._lookup(self.by)
+        where = list(frame._where)
+        if self.dropna:
+            where += [key.is_not(None) for key in keys]
+        aggregates = {}
+        for name, (column, how) in named.items():
+            if how not in _AGGREGATES:
+                raise ValueError("aggregate {!r} cannot be turned into SQL; use one of {}".format(
+                    how, sorted(_AGGREGATES)))
+            aggregates[name] = _AGGREGATES[how](None if how == 'size' else frame._lookup([column])[0])
+        by = dict(zip(self.by, keys))
+        index, columns = (by, aggregates) if self.as_index else ({}, {**by, **aggregates})
+        new = frame._step(self._steps[0], index=index, columns=columns, where=where, group=keys, having=[],
+                          order=[(key, True) for key in keys] if self.sort else [], series=series)
+        new._steps = new._steps + self._steps[1:] + (step,)
+        return new
+
+    def agg(self, func=None, **named):
+        """Compute aggregates, as `groupby().agg()` does
+
+        Give them as `name=('column', 'mean')`, as `{'column': 'mean'}`, or as
+        one aggregate, like 'mean', for every selected column.
+        """
+        if func is None:
+            spec = named
+        elif isinstance(func, dict):
+            if not all(isinstance(how, str) for how in func.values()):
+                raise ValueError("give one aggregate per column, like {'points': 'mean'}")
+            spec = {column: (column, how) for column, how in func.items()}
+        elif isinstance(func, str):
+            spec = {column: (column, func) for column in self._selected()}
+        else:
+            raise ValueError("aggregates are given by name, like 'mean'")
+        series = None
+        if isinstance(func, str) and isinstance(self.selection, str) and self.as_index:
+            series = (self.selection, self.selection)
+        return self._aggregate(spec, ('agg', () if func is None else (func,), named), series)
+
+    aggregate = agg
+
+    def size(self):
+        """Count the rows of each group, missing values and all"""
+        return self._aggregate({'size': (None, 'size')}, ('size', (), {}),
+                               ('size', None) if self.as_index else None)
+
+    def __getattr__(self, name):
+        # groupby(...).mean(), groupby(...)['points'].max(), and so on
+        if name not in _AGGREGATES or name == 'size':
+            raise AttributeError(name)
+        series = (self.selection, self.selection) if isinstance(self.selection, str) and self.as_index \
+            else None
+        return lambda: self._aggregate({c: (c, name) for c in self._selected()}, (name, (), {}), series)
+
+
+def read_table(name, engine):
+    """Return a `LazyFrame` of a whole table, like `pd.read_sql_table()` but without reading any rows"""
+    table = Table(name, MetaData(), autoload_with=engine)
+    return LazyFrame(engine, table, {column.name: column for column in table.columns},
+                     [('read', (name,), {})], [name])
+
+
+def _plain(result):
+    """Return a data frame of a result with the index as columns, to compare two results"""
+    if isinstance(result, pd.Series):
+        result = result.to_frame()
+    if any(name is not None for name in result.index.names):
+        return result.reset_index()
+    return result.reset_index(drop=True)
+
+
+def benchmark(frame):
+    """Time the pandas calls of a `LazyFrame` on whole tables against the same calls run as one query
+
+    Returns the seconds, and the rows and megabytes each way reads from the
+    database, and whether the two give the same rows (in any order).
+    """
+    tables = {}
+    start = time.perf_counter()
+    eager = frame.eager(tables)
+    eager_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    lazy = frame.collect()
+    lazy_seconds = time.perf_counter() - start
+    a, b = _plain(eager), _plain(lazy)
+    same = a.shape == b.shape and _comparable(a).values.tolist() == _comparable(b).values.tolist()
+    read = tables.values()
+    results = {'pandas': {'seconds': round(eager_seconds, 3), 'rows_read': sum(len(t) for t in read),
+                          'mb_read': round(sum(t.memory_usage(deep=True).sum() for t in read) / 1e6, 2)},
+               'sql': {'seconds': round(lazy_seconds, 3), 'rows_read': len(b),
+                       'mb_read': round(b.memory_usage(deep=True).sum() / 1e6, 2)}}
+    df = pd.DataFrame(results).T
+    df['same'] = same
+    return df
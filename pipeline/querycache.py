@@ -0,0 +1,293 @@
+"""Keep the results of SQL queries, and forget them when a table they read changes
+
+Chapter 7 runs many queries more than once: the query with
+`REPLACE(LOWER(description), 'aroma', 'good smell')` is sent to the server twice
+in a row, once to look at `.description[0]` and once for
+`.description_replace[0]`, and every re-run of a notebook sends all of them
+again. A `QueryCache` sits between the notebook and the database:
+
+    from pipeline.querycache import QueryCache
+    db = QueryCache(engine)
+    db.read_sql_query(myquery).description[0]
+    db.read_sql_query(myquery).description_replace[0]    # from the cache
+
+A result is found again if the query is the same apart from spacing, line
+breaks, comments, and the case of words outside of quotes, with the same
+parameters, and if none of the tables it reads has been changed since. Every
+table has a version number, and `INSERT`, `UPDATE`, `DELETE` (and `CREATE`,
+`DROP`, `ALTER`, `TRUNCATE`) statements sent through `execute()` add one to
+the versions of the tables they name, so results read from the old version
+are never used again:
+
+    db.execute("UPDATE nba SET basketballteam = 'Charlotte Bobcats' WHERE city = 'Charlotte'")
+
+The tables are the names after `FROM` and `JOIN` (and the commas between
+them), `INTO`, `UPDATE`, `TABLE`, and `TRUNCATE`. A query that also reads from
+something else, like DuckDB's `read_parquet()`, is run but not cached.
+
+Changes made some other way, such as by another notebook or by `df.to_sql()`,
+are not seen; call `db.changed('nba')` after them, or use `db.to_sql()`.
+
+Results are kept in memory up to `max_bytes`, and the ones used least recently
+are dropped first. With `directory=`, results are also written there as
+Parquet files, so they survive a restart of the kernel; the table versions are
+saved in the same place. `con` is a SQLAlchemy engine, a `sqlite3`
+connection, or a backend from `pipeline.embedded`.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+from pipeline.embedded import read_sql_query
+
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\w+|[^\s\w]")
+# Words after which a list of tables begins
+_TABLE_WORDS = {'from', 'join', 'into', 'update', 'table', 'truncate', 'using'}
+# Words that can follow a table, so they are not its alias
+_CLAUSES = {'where', 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'outer', 'on', 'using',
+            'group', 'order', 'having', 'limit', 'offset', 'fetch', 'union', 'except', 'intersect', 'set',
+            'values', 'select', 'returning', 'window', 'default', 'for', 'lateral', 'qualify', 'as'}
+_WRITES = {'insert', 'update', 'delete', 'create', 'drop', 'alter', 'truncate', 'replace', 'merge'}
+
+
+def normalize_sql(sql):
+    """Return the query with comments removed, spacing collapsed, and words in lower case
+
+    Text in single or double quotes (strings and quoted names) is left as it is.
+    """
+    parts = _QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = ' '.join(_COMMENTS.sub(' ', parts[i]).lower().split())
+    return ' '.join(part for part in parts if part).rstrip(';').strip()
+
+
+def _name(token):
+    if token.startswith('"'):
+        return token[1:-1].replace('""', '"').lower()
+    if token[0].isalpha() or token[0] == '_':
+        return token.lower()
+    return None
+
+
+def _closing(tokens, i):
+    """Return the position of the parenthesis that closes the one at `i`"""
+    depth = 0
+    for j in range(i, len(tokens)):
+        depth += {'(': 1, ')': -1}.get(tokens[j], 0)
+        if depth == 0:
+            return j
+    return len(tokens) - 1
+
+
+def _references(tokens):
+    """Return the tables named after FROM, JOIN, INTO, UPDATE, and so on in a list of tokens
+
+    A source that is not a table, like a table function, is returned as None.
+    """
+    found = []
+    i = 0
+    while i < len(tokens):
+        word = tokens[i]
+        i += 1
+        if word not in _TABLE_WORDS or word == 'using' and tokens[i:i + 1] == ['(']:
+            # JOIN ... USING (columns) names columns, not tables
+            continue
+        while i < len(tokens):
+            while i < len(tokens) and tokens[i] in ('table', 'if', 'not', 'exists', 'only', 'lateral'):
+                i += 1
+            if i == len(tokens):
+                break
+            if tokens[i] == '(':
+                end = _closing(tokens, i)
+                inner = tokens[i + 1:end]
+                found.extend(_references(inner) if inner[:1] in (['select'], ['with'], ['values'])
+                             else [None])
+                i = end + 1
+            else:
+                name = _name(tokens[i])
+                if name is None:
+                    break
+                # schema.table
+                while tokens[i + 1:i + 2] == ['.'] and i + 2 < len(tokens) and _name(tokens[i + 2]):
+                    i += 2
+                    name = _name(tokens[i])
+                i += 1
+                if word in ('from', 'join') and tokens[i:i + 1] == ['(']:
+                    # A table function, like read_parquet('...')
+                    name, i = None, _closing(tokens, i) + 1
+                found.append(name)
+            if tokens[i:i + 1] == ['as']:
+                i += 1
+            if i < len(tokens) and _name(tokens[i]) and tokens[i] not in _CLAUSES:
+                i += 1
+            if tokens[i:i + 1] != [',']:
+                break
+            i += 1
+    return found
+
+
+def references(sql):
+    """Return the tables a normalized statement names, with None for a source that is not a table"""
+    return _references(_TOKENS.findall(sql))
+
+
+def tables(sql):
+    """Return the names of the tables a normalized query reads or writes, in lower case"""
+    return sorted({name for name in references(sql) if name is not None})
+
+
+def is_write(sql):
+    """True if a normalized statement changes the data or the tables"""
+    words = _QUOTED.sub("''", sql).split()
+    if not words:
+        return False
+    # A WITH query can end in an INSERT, UPDATE, or DELETE
+    return words[0] in _WRITES or words[0] == 'with' and bool(_WRITES & set(words))
+
+
+class QueryCache:
+    """Run queries through a cache of their results, with an LRU limit on memory"""
+
+    def __init__(self, con, max_bytes=256 * 1024 * 1024, directory=None):
+        self.con = con
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.results = collections.OrderedDict()
+        self.by_table = collections.defaultdict(set)
+        self.versions = collections.Counter()
+        self.size = 0
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, 'versions.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self.versions.update(json.load(f))
+
+    def _key(self, sql, params, names):
+        versions = {name: self.versions[name] for name in names}
+        text = json.dumps([sql, params, versions], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.parquet')
+
+    def _keep(self, key, df, names):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        self.results[key] = (df, nbytes, names)
+        self.size += nbytes
+        for name in names:
+            self.by_table[name].add(key)
+        while self.size > self.max_bytes:
+            old, (_, n, old_names) = self.results.popitem(last=False)
+            self.size -= n
+            for name in old_names:
+                self.by_table[name].discard(old)
+            self.counts['evictions'] += 1
+
+    def read_sql_query(self, sql, params=None):
+        """Return the result of a query as a data frame, from the cache if it is there
+
+        A statement that changes data is run with `execute()` instead, and
+        returns None. A query that reads from something other than a table, such
+        as a table function, is not cached, since we could not tell when its
+        result changes.
+        """
+        normalized = normalize_sql(sql)
+        if is_write(normalized):
+            self.execute(sql, params)
+            return None
+        found = references(normalized)
+        if None in found:
+            self.counts['uncached'] += 1
+            return read_sql_query(sql, self.con, params=params)
+        names = sorted(set(found))
+        with self._lock:
+            key = self._key(normalized, params, names)
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.counts['hits'] += 1
+                return self.results[key][0].copy()
+            if self.directory and os.path.exists(self._path(key)):
+                df = pd.read_parquet(self._path(key))
+                self.counts['disk_hits'] += 1
+                self._keep(key, df, names)
+                return df.copy()
+            self.counts['misses'] += 1
+        df = read_sql_query(sql, self.con, params=params)
+        with self._lock:
+            # Only keep the result if no table changed while the query ran
+            if key == self._key(normalized, params, names):
+                self._keep(key, df, names)
+                if self.directory:
+                    try:
+                        df.to_parquet(self._path(key))
+                    except (ValueError, TypeError, ImportError):
+                        # A column Parquet cannot store; keep the result in memory only
+                        pass
+        return df.copy()
+
+    def execute(self, sql, params=None):
+        """Run a statement that changes data, and forget the results of the tables it names"""
+        con = getattr(self.con, 'engine', self.con)
+        if isinstance(con, sqlite3.Connection):
+            con.execute(sql, params or ())
+            con.commit()
+        elif hasattr(con, 'begin'):
+            from sqlalchemy import text
+            with con.begin() as conn:
+                conn.execute(text(sql), params or {})
+        else:
+            con.execute(sql, params)
+        self.changed(*tables(normalize_sql(sql)))
+
+    def to_sql(self, df, name, **kwargs):
+        """Write a data frame with `df.to_sql()` and forget the results that read the table"""
+        con = getattr(self.con, 'engine', self.con)
+        if hasattr(con, 'register'):
+            con.register(name, df, copy=True)
+        else:
+            df.to_sql(name, con=con, **kwargs)
+        self.changed(name)
+
+    def changed(self, *names):
+        """Add one to the version of each table, so results read from it are not used again"""
+        with self._lock:
+            for name in names:
+                name = name.lower()
+                self.versions[name] += 1
+                for key in self.by_table.pop(name, set()):
+                    if key in self.results:
+                        _, nbytes, _ = self.results.pop(key)
+                        self.size -= nbytes
+                    if self.directory and os.path.exists(self._path(key)):
+                        os.remove(self._path(key))
+            if self.directory:
+                with open(os.path.join(self.directory, 'versions.json'), 'w') as f:
+                    json.dump(self.versions, f)
+
+    def clear(self):
+        """Forget every result in memory (the files in `directory` stay)"""
+        with self._lock:
+            self.results.clear()
+            self.by_table.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the hits, misses, evictions, uncached queries, and size of the cache"""
+        return {'entries': len(self.results), 'mb': round(self.size / 1e6, 2),
+                'hits': self.counts['hits'], 'disk_hits': self.counts['disk_hits'],
+                'misses': self.counts['misses'], 'evictions': self.counts['evictions'],
+                'uncached': self.counts['uncached']}
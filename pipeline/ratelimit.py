@@ -0,0 +1,59 @@
+"""A token bucket for keeping requests under an API's rate limit
+
+A bucket holds up to `capacity` tokens and refills at `rate` tokens per second.
+Each request takes some number of tokens out: one per request for a limit like
+"100 requests per minute", or the size of the prompt for a limit like "90,000
+tokens per minute". When the bucket is empty the caller waits until enough
+tokens have dripped back in.
+
+    bucket = TokenBucket(rate=100/60, capacity=100)
+    bucket.wait()                # in a normal loop
+    await bucket.acquire(500)    # in async code
+"""
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Hand out `rate` tokens per second, with bursts of up to `capacity` tokens"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n=1):
+        """Take `n` tokens and return how many seconds to wait before using them
+
+        The tokens are taken right away, even if that leaves the bucket in debt,
+        so callers are served in the order they asked.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, n):
+        """Put back tokens that were reserved but not used"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def wait(self, n=1):
+        """Block until `n` tokens are available"""
+        delay = self.reserve(n)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire(self, n=1):
+        """Wait, without blocking the event loop, until `n` tokens are available"""
+        delay = self.reserve(n)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
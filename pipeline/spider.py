@@ -0,0 +1,217 @@
+"""Spiders defined by a spec instead of new code
+
+`wnrn_spider()` in chapter 5 has its tags written into the code, and builds
+`mydict = {'time':..., 'artist':..., 'song':..., 'album':...}` by hand. If the four
+lists come out with different lengths (a spin with no album, say), `pd.DataFrame()`
+either fails or, worse, if a different tag is missing on another row, lines up
+the wrong values next to each other. A spider spec writes the same information as
+data, usually in a JSON file like `pipeline/spiders/wnrn.json`:
+
+    {"name": "wnrn",
+     "start_url": "https://spinitron.com/WNRN",
+     "row": "tr",
+     "fields": {"time": {"selector": "td.spin-time", "type": "time", "format": "%I:%M %p"},
+                "artist": "span.artist",
+                "song": "span.song",
+                "album": "span.release"},
+     "links": {"selector": "div.recent-playlists a", "attribute": "href", "contains": "/pl/"}}
+
+Each field has a selector (see `pipeline.extract`) and optionally a type that is
+applied to the whole column at the end: `text`, `int`, `float`, `timestamp`, or
+`time`, with an optional `format` for the last two. If the spec names a `row`,
+every field is read once per row, so a missing value becomes a missing value
+instead of shifting the rest of the column. Without a `row`, every page is checked
+that its fields have the same number of values, and `on_misaligned` decides
+whether a page that fails the check raises an error (`'raise'`) or is skipped and
+listed in `df.attrs['failed']` (`'skip'`).
+
+    from pipeline.spider import load_spider
+    wnrn = load_spider('pipeline/spiders/wnrn.json')
+    wnrn_total_playlist = wnrn.run()
+
+`wnrn.crawl(max_depth=3)` keeps following the links past the first page.
+
+Scraping a new station takes a new spec, not a new function.
+"""
+
+import json
+import os
+from urllib.parse import urljoin
+
+import pandas as pd
+import requests
+
+from pipeline.accumulate import FrameAccumulator
+from pipeline.crawler import iter_crawl, make_session
+from pipeline.extract import Extractor, stream_url
+from pipeline.wnrn import HEADERS
+
+SPIDER_FOLDER = os.path.join(os.path.dirname(__file__), 'spiders')
+
+
+class MisalignedPage(ValueError):
+    """Raised when the fields on a page have different numbers of values"""
+
+
+def _to_text(values, fmt=None):
+    if values.isna().all():
+        # A field that matched nothing gives an empty or all-missing float column, with no .str
+        return values.astype(object)
+    return values.str.strip()
+
+
+def _to_time(values, fmt=None):
+    return pd.to_datetime(values, format=fmt or '%I:%M %p', errors='coerce').dt.time
+
+
+CONVERTERS = {
+    'text': _to_text,
+    'int': lambda values, fmt=None: pd.to_numeric(values, errors='coerce').astype('Int64'),
+    'float': lambda values, fmt=None: pd.to_numeric(values, errors='coerce'),
+    'timestamp': lambda values, fmt=None: pd.to_datetime(values, format=fmt, errors='coerce'),
+    'time': _to_time,
+}
+
+
+class Spider:
+    """Run a spider spec: download pages, extract the fields, and build a data frame"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec.get('name', 'spider')
+        self.fields = {name: f if isinstance(f, dict) else {'selector': f}
+                       for name, f in spec['fields'].items()}
+        for name, f in self.fields.items():
+            if f.get('type', 'text') not in CONVERTERS:
+                raise ValueError("field {!r} has an unknown type {!r}".format(name, f['type']))
+        self.row = spec.get('row')
+        self.on_misaligned = spec.get('on_misaligned', 'raise')
+        self.extractor = Extractor({name: (f['selector'], f.get('attribute'))
+                                    for name, f in self.fields.items()}, row=self.row)
+        links = spec.get('links')
+        self.links_extractor = (Extractor({'link': (links['selector'], links.get('attribute', 'href'))})
+                                if links else None)
+
+    def parse(self, html):
+        """Return the raw text of every field on one page as a dictionary of lists"""
+        columns = self.extractor.extract(html)
+        if self.row:
+            # Rows in which nothing matched, like table headers, are not data
+            keep = [i for i, values in enumerate(zip(*columns.values()))
+                    if any(v is not None for v in values)]
+            return {name: [values[i] for i in keep] for name, values in columns.items()}
+        lengths = {name: len(values) for name, values in columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise MisalignedPage("fields have different numbers of values: {}".format(lengths))
+        return columns
+
+    def stream(self, url, chunk_size=64 * 1024):
+        """Yield the rows of one page as they are downloaded, as dictionaries of raw text
+
+        Needs a `row` in the spec. The page is read in chunks of `chunk_size`
+        bytes, so the memory used stays the same no matter how long the page is.
+        """
+        if not self.row:
+            raise ValueError("streaming needs a 'row' selector in the spec")
+        for row in stream_url(url, self.extractor, headers=self.spec.get('headers', HEADERS),
+                              chunk_size=chunk_size):
+            if any(v is not None for v in row.values()):
+                yield row
+
+    def hrefs(self, html):
+        """Return the links the spec says to follow, as they are written in the page"""
+        if self.links_extractor is None:
+            return []
+        contains = self.spec['links'].get('contains')
+        return [href for href in self.links_extractor.extract(html)['link']
+                if href and (contains is None or contains in href)]
+
+    def links(self, html, base_url=None):
+        """Return the absolute URLs of the links the spec says to follow"""
+        base_url = base_url or self.spec.get('start_url', '')
+        return [urljoin(base_url, href) for href in self.hrefs(html)]
+
+    def convert(self, df):
+        """Apply each field's type to its column"""
+        for name, f in self.fields.items():
+            if name in df:
+                df[name] = CONVERTERS[f.get('type', 'text')](df[name], f.get('format'))
+        return df
+
+    def start_urls(self):
+        """Download the start page and return it with every page it links to"""
+        start = self.spec['start_url']
+        r = requests.get(start, headers=self.spec.get('headers', HEADERS))
+        r.raise_for_status()
+        return [start] + [url for url in self.links(r.text, start) if url != start]
+
+    def run(self, urls=None, url_column=None, **crawl_args):
+        """Crawl `urls` (or the start page and its links) and return one typed data frame
+
+        Takes the keyword arguments of `pipeline.crawler.iter_crawl()`.
+        """
+        urls = list(urls) if urls is not None else self.start_urls()
+        self._session(crawl_args)
+        results = iter_crawl(urls, parse=self.parse, **crawl_args)
+        return self._build(urls, results, url_column)
+
+    def crawl(self, max_depth=None, max_pages=None, url_column=None, **crawl_args):
+        """Follow the spec's links from the start page until no new pages are left
+
+        Uses a `pipeline.frontier.Frontier`, so each page is visited once,
+        and stops `max_depth` links away from the start page or after
+        `max_pages` pages. Takes the keyword arguments of
+        `pipeline.frontier.iter_frontier()`, which do not include `cache`.
+        """
+        from pipeline.frontier import Frontier, iter_frontier
+
+        frontier = Frontier(max_depth=max_depth)
+        frontier.add(self.spec['start_url'])
+        self._session(crawl_args)
+        urls = []
+        # The frontier resolves each page's links against that page's own URL
+        pages = iter_frontier(frontier, self.parse, self.hrefs, max_pages=max_pages, **crawl_args)
+
+        def results():
+            for url, _, result in pages:
+                urls.append(url)
+                yield url, result
+
+        df = self._build(urls, results(), url_column)
+        df.attrs['frontier'] = dict(frontier.stats, left=len(frontier))
+        return df
+
+    def _session(self, crawl_args):
+        if crawl_args.get('session') is None:
+            crawl_args['session'] = make_session(headers=self.spec.get('headers', HEADERS))
+
+    def _build(self, urls, results, url_column=None):
+        pages = {}
+        failed = []
+        for url, result in results:
+            if isinstance(result, Exception):
+                if isinstance(result, MisalignedPage) and self.on_misaligned == 'raise':
+                    raise MisalignedPage("{}: {}".format(url, result))
+                failed.append((url, repr(result)))
+            else:
+                pages[url] = result
+
+        # Columns are extended page by page and turned into a data frame once
+        rows = FrameAccumulator(columns=list(self.fields) + ([url_column] if url_column else []))
+        for url in urls:
+            if url in pages:
+                page = pages.pop(url)
+                if url_column:
+                    page[url_column] = [url] * len(next(iter(page.values()), []))
+                rows.add_rows(page)
+        df = self.convert(rows.to_frame())
+        df.attrs['failed'] = failed
+        return df
+
+
+def load_spider(path):
+    """Read a spider spec from a JSON file; a bare name looks in `pipeline/spiders`"""
+    if not os.path.exists(path) and not path.endswith('.json'):
+        path = os.path.join(SPIDER_FOLDER, path + '.json')
+    with open(path, encoding='utf8') as f:
+        return Spider(json.load(f))
@@ -0,0 +1,192 @@
+"""Read a large query result a chunk at a time, and aggregate it as it arrives
+
+`pd.read_sql_query("SELECT * FROM reviews", con=engine)` in chapters 6 and 7
+asks the database driver for every row before the data frame is built, so the
+whole result has to fit in memory twice. Even `pd.read_sql_query(..., chunksize=...)`
+only splits the rows after the driver has downloaded all of them, unless the
+connection asks the server to hold on to the results. `iter_query()` does ask:
+
+* on PostgreSQL (psycopg) the rows come from a named, server-side cursor;
+* on MySQL the cursor is unbuffered, so rows are read from the network as
+  they are needed (SQLAlchemy's `stream_results` does this for mysqlclient
+  and PyMySQL, but not for mysql-connector, which gets an unbuffered cursor
+  of its own);
+* on SQLite the rows are read from the database file as they are needed.
+
+Each chunk is a data frame of up to `chunksize` rows. The column types come
+from the first chunk, in pandas types that can hold missing values (`Int64`
+for integers, `boolean`, and `float64`), so a NULL in a later chunk does not
+change them. SQLite lets a column hold numbers in some rows and text in others;
+such a column is object from the first chunk that shows it:
+
+    from pipeline.sqlstream import iter_query, aggregate
+    for chunk in iter_query("SELECT * FROM reviews", engine, chunksize=50000):
+        ...
+
+`aggregate()` folds the chunks into a grouped summary, keeping only one row per
+group in memory, so
+
+    aggregate(iter_query("SELECT country, points FROM reviews r ...", engine),
+              by='country', average_points=('points', 'mean'),
+              numberofwines=('points', 'size'))
+
+gives the same result as `df.groupby('country').agg(...)` on the whole table.
+`fold()` does the same for any function that combines a running result with the
+next chunk.
+"""
+
+import functools
+import sqlite3
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import text
+
+from pipeline.arrowsql import _batch
+
+# How each aggregate is computed from pieces that can be combined chunk by chunk
+_PARTS = {'sum': ('sum',), 'count': ('count',), 'size': ('size',),
+          'min': ('min',), 'max': ('max',), 'mean': ('sum', 'count')}
+_COMBINE = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def _dtype(arrow_type):
+    """Return a pandas type for a column of the first chunk that a NULL in a later chunk will not change"""
+    if pa.types.is_integer(arrow_type):
+        return 'Int64'
+    if pa.types.is_boolean(arrow_type):
+        return 'boolean'
+    if pa.types.is_floating(arrow_type):
+        return 'float64'
+    if pa.types.is_null(arrow_type):
+        return object
+    return None
+
+
+def _chunks_from_rows(partitions, names):
+    schema = None
+    dtypes = None
+    text = set()
+    for rows in partitions:
+        batch = _batch(list(zip(*rows)), names, text)
+        if schema is None:
+            schema = batch.schema
+            dtypes = [_dtype(field.type) for field in schema]
+        else:
+            # A column that is all NULL in this chunk takes the type from the first chunk
+            arrays = [column.cast(field.type) if column.type == pa.null() else column
+                      for column, field in zip(batch.columns, schema)]
+            batch = pa.RecordBatch.from_arrays(arrays, names=names)
+        chunk = batch.to_pandas()
+        for i, dtype in enumerate(dtypes):
+            if i in text and dtype is not None:
+                # SQLite let this column change type partway; it is object from here on
+                dtypes[i] = dtype = object
+            if dtype is not None:
+                try:
+                    chunk.isetitem(i, chunk.iloc[:, i].astype(dtype))
+                except (TypeError, ValueError):
+                    dtypes[i] = object
+                    chunk.isetitem(i, chunk.iloc[:, i].astype(object))
+        yield chunk
+
+
+def _fetchmany(cursor, chunksize):
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield rows
+
+
+def _iter_mysqlconnector(query, conn, chunksize, params):
+    # SQLAlchemy has no server-side cursor for mysql-connector and would buffer every row
+    compiled = (text(query) if isinstance(query, str) else query).compile(dialect=conn.dialect)
+    raw = conn.connection.driver_connection
+    cursor = raw.cursor(buffered=False)
+    try:
+        values = {**compiled.params, **(params or {})}
+        cursor.execute(str(compiled), [values[name] for name in compiled.positiontup or ()])
+        names = [d[0] for d in cursor.description]
+        yield from _chunks_from_rows(_fetchmany(cursor, chunksize), names)
+    finally:
+        # The rows not read yet have to be taken off the connection before it runs another query
+        if raw.unread_result:
+            raw.consume_results()
+        cursor.close()
+
+
+def iter_query(query, con, chunksize=10000, params=None):
+    """Yield the result of a query as data frames of up to `chunksize` rows
+
+    `con` is a SQLAlchemy engine (or connection), or a `sqlite3` connection.
+    With an engine, the query is sent with `stream_results=True`, which makes
+    SQLAlchemy use a server-side cursor on PostgreSQL and MySQL, except with
+    mysql-connector, whose own `cursor(buffered=False)` is used instead.
+    """
+    if isinstance(con, sqlite3.Connection):
+        cursor = con.cursor()
+        cursor.execute(query, params or ())
+        names = [d[0] for d in cursor.description]
+        yield from _chunks_from_rows(_fetchmany(cursor, chunksize), names)
+        return
+    if hasattr(con, 'connect'):
+        with con.connect() as conn:
+            yield from iter_query(query, conn, chunksize, params)
+        return
+    if con.dialect.name == 'mysql' and con.dialect.driver == 'mysqlconnector':
+        yield from _iter_mysqlconnector(query, con, chunksize, params)
+        return
+    conn = con.execution_options(stream_results=True, max_row_buffer=chunksize)
+    result = conn.execute(text(query) if isinstance(query, str) else query, params or {})
+    try:
+        yield from _chunks_from_rows(result.partitions(chunksize), list(result.keys()))
+    finally:
+        result.close()
+
+
+def fold(chunks, function, initial=None):
+    """Combine chunks one at a time: `function(running_result, chunk)` returns the new result"""
+    return functools.reduce(function, chunks, initial)
+
+
+def _parts(named):
+    parts = {}
+    for column, how in named.values():
+        if how not in _PARTS:
+            raise ValueError("aggregate() cannot combine {!r} across chunks".format(how))
+        for part in _PARTS[how]:
+            parts['{}__{}'.format(part, column)] = (column, part)
+    return parts
+
+
+def aggregate(chunks, by=None, **named):
+    """Group and aggregate data frame chunks as they arrive
+
+    Takes named aggregations like `df.groupby(by).agg(name=(column, how))`,
+    where `how` is 'sum', 'count', 'size', 'min', 'max', or 'mean'. Missing
+    values in `by` form a group of their own, as NULL does in SQL's GROUP BY.
+    Without `by` the result has a single row for the whole table.
+    """
+    parts = _parts(named)
+    by = [by] if isinstance(by, str) else list(by or [])
+    running = None
+    for chunk in chunks:
+        keys = by or pd.Series(0, index=chunk.index, name='_all')
+        partial = chunk.groupby(keys, dropna=False).agg(**parts)
+        if running is None:
+            running = partial
+        else:
+            combined = pd.concat([running, partial])
+            running = combined.groupby(level=list(range(combined.index.nlevels)), dropna=False).agg(
+                {name: _COMBINE[part] for name, (_, part) in parts.items()})
+    if running is None:
+        return pd.DataFrame(columns=by + list(named)).set_index(by) if by else \
+            pd.DataFrame(columns=list(named))
+    result = pd.DataFrame(index=running.index)
+    for name, (column, how) in named.items():
+        if how == 'mean':
+            result[name] = running['sum__' + column] / running['count__' + column]
+        else:
+            result[name] = running['{}__{}'.format(how, column)]
+    return result if by else result.reset_index(drop=True)
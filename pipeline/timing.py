@@ -0,0 +1,28 @@
+"""Summaries of timings for the benchmarks in this folder"""
+
+import math
+
+
+def percentile(ordered, q):
+    """Return the `q`th percentile (0-100) of a list that is already sorted"""
+    if not ordered:
+        return float('nan')
+    rank = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def latency_summary(latencies, seconds, **extra):
+    """Summarize request latencies (in seconds) measured over `seconds` of wall time
+
+    Returns requests per second and the 50th, 95th, and 99th percentile latency
+    in milliseconds, plus any `extra` counts passed in, such as retries.
+    """
+    ordered = sorted(latencies)
+    summary = {'requests': len(ordered),
+               'seconds': round(seconds, 3),
+               'requests_per_s': round(len(ordered) / seconds, 1) if seconds else float('nan'),
+               'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+               'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+               'p99_ms': round(percentile(ordered, 99) * 1000, 3)}
+    summary.update(extra)
+    return summary
@@ -0,0 +1,147 @@
+"""Collect tweets in checkpointed batches instead of one long loop
+
+In chapters 4 and 9 we collect tweets with a loop like this one:
+
+    msgs = []
+    for tweet in tweepy.Cursor(api.search, q='#uva').items(1000):
+        msgs.append((tweet.text, tweet.created_at, tweet.user.screen_name))
+
+If the loop fails at tweet 999, all 999 tweets are lost, and `msgs` keeps growing
+in memory until the loop ends. `collect_tweets()` writes every `batch_size` tweets
+to a Parquet file in a folder and saves the position of the cursor (the `max_id`
+of the next search) in a checkpoint file in the same folder. If the collection
+stops for any reason, calling `collect_tweets()` again with the same folder picks
+up where it left off without collecting any tweet twice.
+
+The tweets come from a "source": a function that takes a `max_id` and returns
+tweets in the order Twitter returns them, newest first. `tweepy_source()` searches
+Twitter and `fixture_source()` replays tweets recorded to a file, so the same code
+can run without a connection to Twitter.
+"""
+
+import json
+import os
+
+import pandas as pd
+
+COLUMNS = ['id', 'text', 'created_at', 'user']
+CHECKPOINT = '_checkpoint.json'
+
+
+def tweet_row(tweet):
+    """Extract the id, text, time, and user from a tweepy Status or a recorded dict"""
+    if isinstance(tweet, dict):
+        return (tweet['id'], tweet['text'], tweet['created_at'], tweet['user']['screen_name'])
+    return (tweet.id, tweet.text, tweet.created_at, tweet.user.screen_name)
+
+
+def tweepy_source(api, **search_args):
+    """Return a source that searches Twitter with tweepy.Cursor(api.search, ...)"""
+    import tweepy
+
+    def source(max_id=None):
+        args = dict(search_args)
+        if max_id is not None:
+            args['max_id'] = max_id
+        return tweepy.Cursor(api.search, **args).items()
+
+    return source
+
+
+def fixture_source(path):
+    """Return a source that replays tweets saved as JSON lines, newest first"""
+
+    def source(max_id=None):
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                if line.strip():
+                    tweet = json.loads(line)
+                    if max_id is None or tweet['id'] <= max_id:
+                        yield tweet
+
+    return source
+
+
+def read_checkpoint(folder):
+    """Return the saved position of a collection, or the start of a new one"""
+    path = os.path.join(folder, CHECKPOINT)
+    if not os.path.exists(path):
+        return {'batches': 0, 'count': 0, 'max_id': None}
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+
+def _replace(path, write):
+    # Write to a hidden temporary file first so that a crash never leaves a
+    # half-written batch or checkpoint behind
+    folder, name = os.path.split(path)
+    tmp = os.path.join(folder, '.' + name + '.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_batch(folder, rows, state):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    name = 'batch-{:05d}.parquet'.format(state['batches'])
+    _replace(os.path.join(folder, name), lambda tmp: df.to_parquet(tmp, index=False))
+
+    # The checkpoint is only moved forward after the batch is safely on disk. If
+    # we crash in between, the next run writes the same batch file again.
+    state = dict(state, batches=state['batches'] + 1, count=state['count'] + len(rows),
+                 max_id=rows[-1][0] - 1)
+
+    def dump(tmp):
+        with open(tmp, 'w', encoding='utf8') as f:
+            json.dump(state, f)
+
+    _replace(os.path.join(folder, CHECKPOINT), dump)
+    return state
+
+
+def collect_tweets(source, folder, limit=1000, batch_size=100, row=tweet_row):
+    """Collect up to `limit` tweets from `source` into Parquet batches inside `folder`
+
+    Returns the total number of tweets saved in the folder. Run it again with the
+    same folder to resume a collection that stopped, or with a larger `limit` to
+    go further back in time.
+    """
+    os.makedirs(folder, exist_ok=True)
+    state = read_checkpoint(folder)
+    bound = state['max_id']
+    rows = []
+
+    if state['count'] >= limit:
+        return state['count']
+
+    for tweet in source(max_id=bound):
+        r = row(tweet)
+        # Tweets arrive newest first, so anything above the bound has already
+        # been saved (cursors can repeat tweets at the edges of pages)
+        if bound is not None and r[0] > bound:
+            continue
+        bound = r[0] - 1
+        rows.append(r)
+        if len(rows) == batch_size:
+            state = _write_batch(folder, rows, state)
+            rows = []
+        if state['count'] + len(rows) >= limit:
+            break
+
+    if rows:
+        state = _write_batch(folder, rows, state)
+    return state['count']
+
+
+def tweet_dataset(folder):
+    """Return the collected batches as one lazy pyarrow dataset
+
+    No data is read until the dataset is scanned, for example with
+    `tweet_dataset(folder).to_table(columns=['text']).to_pandas()`.
+    """
+    import pyarrow.dataset as ds
+    return ds.dataset(folder, format='parquet')
+
+
+def read_tweets(folder, columns=None):
+    """Read the collected batches into one data frame, like the `tweets` frame in chapter 9"""
+    return pd.read_parquet(folder, columns=columns)
@@ -0,0 +1,75 @@
+"""The WNRN playlist spider from chapter 5
+
+`wnrn_spider()` is the function we build in chapter 5. The parsing half of it is
+split out as `parse_playlist()`, which takes the raw HTML of a spinitron playlist
+and returns a dictionary of lists, so the crawler in `pipeline.crawler` can
+download pages in one place and parse them in another.
+
+`parse_playlist()` reads the page in one pass with an `Extractor` from
+`pipeline.extract`. `parse_playlist_bs4()` is the same code as in chapter 5, with
+`BeautifulSoup()` and four calls to `.find_all()`, and returns the same columns.
+"""
+
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup
+
+from pipeline.extract import Extractor
+from pipeline.profiler import NullProfiler
+
+HEADERS = {'user-agent': 'Kropko class example (jkropko@virginia.edu)'}
+BASE_URL = 'https://spinitron.com/'
+COLUMNS = ['time', 'artist', 'song', 'album']
+
+FIELDS = {'time': 'td.spin-time',
+          'artist': 'span.artist',
+          'song': 'span.song',
+          'album': 'span.release'}
+
+playlist_extractor = Extractor(FIELDS)
+links_extractor = Extractor({'link': ('div.recent-playlists a', 'href')})
+
+
+def parse_playlist(html):
+    """Extract the time, artist, song, and album of every spin on a playlist page"""
+    return playlist_extractor.extract(html)
+
+
+def parse_playlist_bs4(html):
+    """Extract the same columns as `parse_playlist()` the way chapter 5 does"""
+    wnrn = BeautifulSoup(html, 'lxml')
+
+    artistlist = wnrn.find_all("span", "artist")
+    songlist = wnrn.find_all("span", "song")
+    albumlist = wnrn.find_all("span", "release")
+    timelist = wnrn.find_all("td", "spin-time")
+
+    artists = [a.string for a in artistlist]
+    songs = [a.string for a in songlist]
+    albums = [a.string for a in albumlist]
+    times = [a.string for a in timelist]
+
+    return {'time': times, 'artist': artists, 'song': songs, 'album': albums}
+
+
+def playlist_links(html):
+    """Return the links to other playlists in the "recent-playlists" box"""
+    links = links_extractor.extract(html)['link']
+    return [href for href in links if href and "/pl/" in href]
+
+
+def wnrn_spider(url, profiler=None):
+    """Perform web scraping for any WNRN playlist given the available link
+
+    With a `pipeline.profiler.StageProfiler`, the download, the parsing, and
+    the data frame are timed as the stages `fetch`, `parse`, and `build`.
+    """
+    profiler = profiler or NullProfiler()
+    with profiler.stage('page', url):
+        with profiler.stage('fetch', url) as fetched:
+            r = requests.get(url, headers=HEADERS)
+            fetched['bytes'] = len(r.content)
+        with profiler.stage('parse', url, len(r.content)):
+            columns = parse_playlist(r.text)
+        with profiler.stage('build', url):
+            return pd.DataFrame(columns)